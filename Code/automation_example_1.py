@@ -10,6 +10,11 @@ from ctypes import c_ubyte
 from beamngpy import BeamNGpy, Scenario, Road, Vehicle
 from beamngpy.sensors import Damage, State, Timer
 
+from fitness_cache import FitnessCache, canonical_form
+from scenario_cache import ScenarioCache
+from sensor_gateway import SensorGateway
+from simulator_connections import SimulatorConnections
+from telemetry_recorder import TelemetryRecorder, TELEMETRY_COLUMNS
 from test_oracles import DamagedOracle, TargetAreaOracle
 
 from shapely.geometry import Point
@@ -23,6 +28,20 @@ import itertools as it
 BNG_HOME = "C:\\BeamNG.tech.v0.21.3.0"
 BNG_USER = "C:\\BeamNG.tech_userpath"
 
+# Connections to the running simulators, shared by all the experiments
+simulator_connections = SimulatorConnections(home=BNG_HOME, user=BNG_USER)
+# The scenarios made and loaded in the simulators. All the tests share the same road and vehicles, so
+# they reuse the same scenario and only the trajectory of the heading vehicle changes
+scenario_cache = ScenarioCache(prefix='automated_test')
+# What experiments that time out return. The fitness is unknown, so the trajectory must be evaluated again
+TIMED_OUT = -2.0
+# The results of the trajectories already evaluated, also in previous runs
+fitness_cache = FitnessCache('fitness_cache_example_1.sqlite', cacheable=lambda distance: distance != TIMED_OUT)
+# The telemetry of all the experiments, and the signals recorded (the ego-car ones, plus the position of the heading
+# vehicle and the distance between the two)
+TELEMETRY_FOLDER = 'telemetry_example_1'
+TELEMETRY_EXAMPLE_1_COLUMNS = dict(TELEMETRY_COLUMNS, heading_pos=(3,), distance=())
+
 SPEED_LIMIT_KMH = 50
 MIN_SPEED_LIMIT_KMH = 10
 
@@ -44,7 +63,7 @@ def window(iterable, size):
     return zip(*shiftedStarts)
 
 
-def execute_experiment(individual):
+def execute_experiment(individual, host='localhost', port=64256):
 
     global global_test_count
     global_test_count = global_test_count + 1
@@ -73,8 +92,8 @@ def execute_experiment(individual):
     start_of_the_road = Point(0, 30, GROUND_LEVEL)
     direction_of_the_road = (0, 0, 1, -1)
 
-    # Create the scenario. Each test gets its own scenario
-    scenario = Scenario('tig', "automated_test_"+str(global_test_count))
+    # Describe the scenario. The scenario cache decides whether it must be made again or can be reused
+    scenario = Scenario('tig', "automated_test")
 
     # Nodes form a straight line, so the road is going to be a straight segment
     road_nodes = [(INTER_NODE_DISTANCE * i, 30, GROUND_LEVEL, 8.0) for i in range(0,10)]
@@ -111,88 +130,102 @@ def execute_experiment(individual):
     heading_vehicle_state_sensor = State()
     heading_vehicle.attach_sensor('state', heading_vehicle_state_sensor)
 
-    # Setup the test Oracles
-    damage_oracle = DamagedOracle(damage_sensor)
-    heading_vehicle_damage_oracle = DamagedOracle(heading_vehicle_damage_sensor)
-
     target_position = (individual[-2]['x'], individual[-2]['y'], individual[-2]['z'])
     radius = 2.0 * LANE_WIDTH + 0.2
     # Debug position where ends
     coordinates.append([c for c in target_position])
     radii.append(1.0)
     rgba_colors.append([1.0, 0.0, 0.0, 0.3])
-    target_area_reached_oracle = TargetAreaOracle(target_position, radius, state_sensor)
 
     # Configure the ego-car destination. The end of the road
     destination = road_nodes[-1]
     scenario.add_checkpoints([destination], [(1.0, 1.0, 1.0)], ids=["goal_wp"])
 
     print("Connecting to simulator")
-    # Connect to the running BeamNG
-    bng = BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER)
-    try:
-        bng.open(launch=False, deploy=False)
-        scenario.make(bng)
-
-        # Enable Debugging. Now we visualize small spheres that identify the trajectory
-        # of the heading car
-        bng.add_debug_spheres(coordinates, radii, rgba_colors)
-
+    # Connect to the running BeamNG. The connection stays open across experiments
+    with simulator_connections.session(host, port, keep_scenario=True) as bng:
         # Configure simulation
         bng.set_deterministic()
         bng.set_steps_per_second(60)
 
-        # Load the scenario and pause
-        bng.load_scenario(scenario)
-        bng.start_scenario()
-        bng.pause()
-
-        # Focus the main camera on the ego_vehicle
-        # bng.switch_vehicle(ego_vehicle)
-        # We also focus the main camera on the heading_vehicle to see how
-        # the "drunk" driver drives
-        bng.switch_vehicle(heading_vehicle)
-
-        # Configure the movement of the NPC vehicle
-        heading_vehicle.ai_set_mode('disabled')
-        heading_vehicle.ai_set_script(individual)
-
-        # Configure the test subject
-        ego_vehicle.ai_drive_in_lane(True)
-        ego_vehicle.ai_set_speed(SPEED_LIMIT_KMH / 3.6, mode='limit')
-        ego_vehicle.ai_set_waypoint("goal_wp")
+        # Load (or restart) the scenario and pause
+        scenario = scenario_cache.load(bng, scenario, host, port)
 
-        # Temporarily store runtime data to compute the fitness function
-        distances = []
+        # If the scenario is reused, its vehicles (and sensors) are the ones connected to the simulator
+        ego_vehicle = scenario.get_vehicle('ego')
+        heading_vehicle = scenario.get_vehicle('heading')
+        state_sensor = ego_vehicle.sensors['state']
+        heading_vehicle_state_sensor = heading_vehicle.sensors['state']
 
-        # Execute the simulation for one second, check the oracles and resume, until either the oracles or the timeout
-        # trigger
-        for i in range(1, TIMEOUT):
-            bng.step(60)
+        # Setup the test Oracles
+        damage_oracle = DamagedOracle(ego_vehicle.sensors['damage'])
+        heading_vehicle_damage_oracle = DamagedOracle(heading_vehicle.sensors['damage'])
+        target_area_reached_oracle = TargetAreaOracle(target_position, radius, state_sensor)
 
-            # Poll data (for both vehicles!)
-            ego_vehicle.poll_sensors()
-            heading_vehicle.poll_sensors()
-
-            # Compute our "fitness" function. We want to minimize the distance
-            # between the two cars
-            distance = Point(state_sensor.data['pos']).distance( Point(heading_vehicle_state_sensor.data['pos']))
-            distances.append(distance)
-
-            # Check the oracles
-            if damage_oracle.check() or heading_vehicle_damage_oracle.check():
-                print("Test Failed!")
-                return -1.0
-
-            if target_area_reached_oracle.check():
-                print("Test Passed!")
-                return min(distances)
-
-        print("Test Failed with timeout!")
-        return -2.0
-    finally:
-        bng.delete_scenario(scenario.path)
-        bng.skt.close()
+        # Enable Debugging. Now we visualize small spheres that identify the trajectory
+        # of the heading car
+        sphere_ids = bng.add_debug_spheres(coordinates, radii, rgba_colors)
+
+        # Poll the sensors of both vehicles at once
+        gateway = SensorGateway([ego_vehicle, heading_vehicle])
+        # Record the telemetry of the experiment, and its outcome
+        recorder = TelemetryRecorder(TELEMETRY_FOLDER, columns=TELEMETRY_EXAMPLE_1_COLUMNS,
+                                     individual=canonical_form(individual))
+        fitness = None
+
+        try:
+            # Focus the main camera on the ego_vehicle
+            # bng.switch_vehicle(ego_vehicle)
+            # We also focus the main camera on the heading_vehicle to see how
+            # the "drunk" driver drives
+            bng.switch_vehicle(heading_vehicle)
+
+            # Configure the movement of the NPC vehicle
+            heading_vehicle.ai_set_mode('disabled')
+            heading_vehicle.ai_set_script(individual)
+
+            # Configure the test subject
+            ego_vehicle.ai_drive_in_lane(True)
+            ego_vehicle.ai_set_speed(SPEED_LIMIT_KMH / 3.6, mode='limit')
+            ego_vehicle.ai_set_waypoint("goal_wp")
+
+            # Temporarily store runtime data to compute the fitness function
+            distances = []
+
+            # Execute the simulation for one second, check the oracles and resume, until either the oracles or the
+            # timeout trigger
+            for i in range(1, TIMEOUT):
+                bng.step(60)
+
+                # Poll data (for both vehicles!)
+                gateway.poll()
+
+                # Compute our "fitness" function. We want to minimize the distance
+                # between the two cars
+                distance = Point(state_sensor.data['pos']).distance( Point(heading_vehicle_state_sensor.data['pos']))
+                distances.append(distance)
+                recorder.record_sensors(state=state_sensor, damage=ego_vehicle.sensors['damage'],
+                                        heading_pos=heading_vehicle_state_sensor.data['pos'], distance=distance)
+
+                # Check the oracles
+                if damage_oracle.check() or heading_vehicle_damage_oracle.check():
+                    print("Test Failed!")
+                    fitness = -1.0
+                    return fitness
+
+                if target_area_reached_oracle.check():
+                    print("Test Passed!")
+                    fitness = min(distances)
+                    return fitness
+
+            print("Test Failed with timeout!")
+            fitness = TIMED_OUT
+            return fitness
+        finally:
+            gateway.close()
+            recorder.close(fitness=fitness)
+            # The spheres would otherwise stay in the scenario for the next tests
+            bng.remove_debug_spheres(sphere_ids)
 
 
 def mutate(individual):
@@ -271,14 +304,14 @@ def main():
         }
         best_individual.append(node)
 
-    best_distance = execute_experiment(best_individual)
+    best_distance = fitness_cache.evaluate(execute_experiment, best_individual)
     print("Improved fitness to", best_distance)
 
     for generation in range(1,11):
         # Mutate best
         new_individual = mutate(best_individual)
-        # Compute fitness
-        distance = execute_experiment(new_individual)
+        # Compute fitness. Trajectories already evaluated are not simulated again
+        distance = fitness_cache.evaluate(execute_experiment, new_individual)
         # Check for improvement. If the new individual is better we keep it, otherwise
         # we keep the old individual
         if distance < best_distance:
@@ -292,9 +325,19 @@ def main():
             break
 
     print("Final fitness", best_distance)
+    print("Fitness cache", fitness_cache)
+
+
+def delete_cached_scenarios(host='localhost', port=64256):
+    print("Scenarios", scenario_cache)
+    with simulator_connections.session(host, port, keep_scenario=True) as bng:
+        scenario_cache.delete(bng, host, port)
 
 if __name__ == "__main__":
     # This is the "main" Bng Client that starts and stop the simulator
     # All the tests will share the same instance of the simulator
     with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
-        main()
+        try:
+            main()
+        finally:
+            delete_cached_scenarios()
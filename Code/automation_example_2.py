@@ -2,14 +2,32 @@
 
 # TODO Still open to finish: missing OBE monitor, distance to spine, maybe ranking by time and distance_to_obe ?
 
+import logging
+import sys
+from copy import deepcopy
+from functools import partial
+
+import numpy as np
 from numpy.random import randint
 from numpy.random import rand
 
 from beamngpy import BeamNGpy, Scenario, Road, Vehicle
 from beamngpy.sensors import Damage, State, Timer
 
+from early_stop import EarlyStop, StationaryPolicy, RemainingCurvaturePolicy
+from fitness_cache import FitnessCache
+from road_validation import ValidationPipeline, SegmentBoundsCheck, LengthAndMapBoundsCheck, CurvatureCheck, \
+    SelfIntersectionCheck
+from scenario_cache import ScenarioCache
+from simulator_connections import SimulatorConnections
 from test_oracles import TargetAreaOracle, SimpleOBEOracle
-from trajectory_generator import generate_trajectory
+from simulator_pool import SimulatorPool
+from steady_state_ga import SteadyStateGA
+from surrogate import SurrogateSelector, append_to_archive
+from road_population import RoadPopulation, SegmentBounds, tournament_selection, crossover
+from road_population import mutate as mutate_population
+from multi_objective import select_survivors, non_dominated_sort, crowding_distance, crowded_tournament
+from trajectory_generator import generate_trajectories
 from shapely.geometry import Point, LineString
 from visualization import RoadVisualizer
 
@@ -19,6 +37,17 @@ import matplotlib.pyplot as plt
 BNG_HOME = "C:\\BeamNG.tech.v0.21.3.0"
 BNG_USER = "C:\\BeamNG.tech_userpath"
 
+# Connections to the running simulators, shared by all the experiments
+simulator_connections = SimulatorConnections(home=BNG_HOME, user=BNG_USER)
+# The scenarios made and loaded in the simulators. Tests reuse them instead of making new ones
+scenario_cache = ScenarioCache(prefix='pcg_test')
+# The outcomes of the tests that completed. The other ones ("Stopped" early, or "Error" if the simulation timed out)
+# do not tell the actual fitness of the road
+COMPLETED_OUTCOMES = ("Pass", "Fail")
+# The results of the roads already evaluated, also in previous runs. Only completed tests are cached
+fitness_cache = FitnessCache('fitness_cache_example_2.sqlite',
+                             cacheable=lambda execution: execution[0] in COMPLETED_OUTCOMES)
+
 SEGMENT_COUNT = 5
 
 MIN_LENGTH = 5
@@ -45,8 +74,47 @@ CAR_STARTING_ROT = (0, 0, 1, 0)
 
 # Roads should not be that long!
 TIMEOUT = 120
+MAX_ROAD_LENGTH = 1000
+
+# The terrain of the tig map covers x in [-1023, 1024] and y in [-1114, 933]
+MAP_BOUNDS = (-1000, -1100, 1000, 900)
+
+# Sharper turns fold the road onto itself
+MIN_CURVATURE_RADIUS = 2 * LANE_WIDTH
+
+# What invalid roads score. They are never simulated
+INVALID_ROAD = ("Invalid", -1.0)
+
+# Stop the simulation if the car is stuck for that many polls
+STATIONARY_POLLS = 10
+# The car starts at rest: do not guess how far it can go from the lane during the first polls
+EARLY_STOP_WARMUP_POLLS = 4
+# How far from the center of the lane the car plausibly goes per unit of lateral acceleration (v^2 / radius) on the
+# road ahead. This is a conservative guess: simulations stop when even that could not beat the best fitness so far
+DEVIATION_PER_LATERAL_ACCELERATION = 0.2
+# How fast (m/s^2) the car can speed up towards the speed limit before reaching the turns ahead
+MAX_ACCELERATION = 3.0
+
+SEGMENT_BOUNDS = SegmentBounds(MIN_LENGTH, MAX_LENGTH, MIN_RADIUS, MAX_RADIUS, MIN_ANGLE, MAX_ANGLE)
+
+# Probability that a child combines the segments of two parents
+CROSSOVER_RATE = 0.5
+
+# In the surrogate-assisted search, each generation has that many more children than simulated roads
+SURROGATE_OVERSAMPLING = 3
+
+# The (road, fitness) pairs observed in the simulations, to evaluate the surrogate offline (benchmark_surrogate.py)
+ARCHIVE_FILE = "road_archive_example_2.jsonl"
+
+# In the multi-objective search, the road features (see surrogate.FEATURE_NAMES) that are objectives besides the
+# lane deviation: the total curvature (how complex the road is) and the max angle/radius ratio (its sharpest turn)
+OBJECTIVE_FEATURES = [0, 1]
 
-global_test_count = 0
+# The best fitness found so far by the search. Simulations that cannot beat it stop early
+best_fitness_so_far = None
+
+# The simulator instances (host, port) that run the experiments. Tests are distributed among them
+SIMULATOR_ENDPOINTS = [('localhost', 64256)]
 
 
 def generate_random_road(n_segments):
@@ -92,11 +160,11 @@ def change_attribute_mutation(road_segment):
 
 
 def mutate(individual):
-    # Clone the individual and mutate its segments
-    mutant = [dict(road_segment) for road_segment in individual]
+    # Clone the individual and mutate its segments. The parent must not change, as it might be selected again
+    mutant = deepcopy(individual)
 
     # Pick the road_segments to mutate
-    for road_segment in individual:
+    for road_segment in mutant:
         if rand() <= 1 / len(individual):
             if rand() <= 0.5:
                 replace_segment_mutation(road_segment)
@@ -108,23 +176,54 @@ def mutate(individual):
     return mutant
 
 
-def execute_experiment(individual, road_visualizer=None):
-    global global_test_count
-    global_test_count = global_test_count + 1
+def plausible_distance(curvature, speed):
+    return DEVIATION_PER_LATERAL_ACCELERATION * speed ** 2 * curvature
+
+
+def record_fitness(execution):
+    """Keeps track of the best fitness found so far, and returns the fitness of the execution. Only completed tests
+    count for the best fitness: the fitness of the ones stopped early is only a lower bound."""
+    global best_fitness_so_far
+    if execution[0] in COMPLETED_OUTCOMES and (best_fitness_so_far is None or execution[1] > best_fitness_so_far):
+        best_fitness_so_far = execution[1]
+    return execution[1]
 
-    # Create the scenario. Each test gets its own scenario
-    scenario = Scenario('tig', "pcg_test_" + str(global_test_count))
 
+def generate_road_nodes(individual):
+    return generate_batch_road_nodes([individual])[0]
+
+
+def generate_batch_road_nodes(individuals):
     # We make a simplifying assumption that
     # All the roads start from the same place with the same initial straight segment
     # This lets us "hardcode" the initial position of the vehicle
-    wrapped_individual = [{'trajectory_segments':
-                               [{'type': 'straight', 'length': 10}]
-                           }]
-    wrapped_individual.extend(individual)
+    wrapped_individuals = []
+    for individual in individuals:
+        wrapped_individual = [{'trajectory_segments':
+                                   [{'type': 'straight', 'length': 10}]
+                               }]
+        wrapped_individual.extend(individual)
+        wrapped_individuals.append(wrapped_individual)
+
+    # The trajectories of all the roads are generated at once
+    return [[(p[0], p[1], GROUND_LEVEL, 2 * LANE_WIDTH) for p in points.tolist()] for points in
+            generate_trajectories(ROAD_STARTING_POINT, ROAD_STARTING_DIRECTION, wrapped_individuals, analytic=True)]
 
-    road_nodes = [(p[0], p[1], GROUND_LEVEL, 2 * LANE_WIDTH) for p in
-                  generate_trajectory(ROAD_STARTING_POINT, ROAD_STARTING_DIRECTION, wrapped_individual)]
+
+# The checks that roads must pass before being simulated. Cheapest checks first
+validation_pipeline = ValidationPipeline([
+    SegmentBoundsCheck(MIN_LENGTH, MAX_LENGTH, MIN_RADIUS, MAX_RADIUS, MIN_ANGLE, MAX_ANGLE),
+    LengthAndMapBoundsCheck(MAX_ROAD_LENGTH, MAP_BOUNDS),
+    CurvatureCheck(MIN_CURVATURE_RADIUS),
+    SelfIntersectionCheck()
+], generate_road_nodes, generate_batch_road_nodes)
+
+
+def execute_experiment(individual, road_visualizer=None, host='localhost', port=64256):
+    # Describe the scenario. The scenario cache decides whether it must be made again or can be reused
+    scenario = Scenario('tig', "pcg_test")
+
+    road_nodes = generate_road_nodes(individual)
 
     road = Road('tig_road_rubber_sticky', rid='the_road')
     road.nodes.extend(road_nodes)
@@ -147,22 +246,20 @@ def execute_experiment(individual, road_visualizer=None):
     # Configure Oracle
     target_position = (road_nodes[-2][0], road_nodes[-2][1], road_nodes[-2][2])
     radius = 2.0 * LANE_WIDTH + 0.2
-    target_area_reached_oracle = TargetAreaOracle(target_position, radius, state_sensor)
-
-    # Connect to the running BeamNG
-    bng = BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER)
-    try:
-        bng.open(launch=False, deploy=False)
-        scenario.make(bng)
 
+    # Connect to the running BeamNG. The connection stays open across experiments, and so does the scenario
+    with simulator_connections.session(host, port, keep_scenario=True) as bng:
         # Configure simulation
         bng.set_deterministic()
         bng.set_steps_per_second(60)
 
-        # Load the scenario and pause
-        bng.load_scenario(scenario)
-        bng.start_scenario()
-        bng.pause()
+        # Load (or restart) the scenario and pause
+        scenario = scenario_cache.load(bng, scenario, host, port)
+
+        # If the scenario is reused, its vehicles are the ones connected to the simulator
+        ego_vehicle = scenario.get_vehicle('ego')
+        state_sensor = ego_vehicle.sensors['state']
+        target_area_reached_oracle = TargetAreaOracle(target_position, radius, state_sensor)
 
         # Focus the main camera on the ego_vehicle
         bng.switch_vehicle(ego_vehicle)
@@ -170,7 +267,8 @@ def execute_experiment(individual, road_visualizer=None):
         # We need to query the exact geometry of the road to check if the car is driving
         # inside the lane or not
         road_edges = bng.get_road_edges('the_road')
-        road_nodes = [(edges['middle'][0], edges['middle'][1], GROUND_LEVEL, 2 * LANE_WIDTH) for edges in road_edges]
+        road_nodes = [(edges['middle'][0], edges['middle'][1], GROUND_LEVEL, 2 * LANE_WIDTH)
+                      for edges in road_edges]
 
         right_lane_center_polyline = LineString([(p[0], p[1], p[2]) for p in road_nodes]).parallel_offset(
             LANE_WIDTH * 0.5, "right")
@@ -188,6 +286,14 @@ def execute_experiment(individual, road_visualizer=None):
         # until either the oracles or the timeout triggers
         distances = []
 
+        # Stop the simulations that are not worth running anymore
+        early_stop = EarlyStop(StationaryPolicy(state_sensor, k=STATIONARY_POLLS),
+                               RemainingCurvaturePolicy(road_nodes, state_sensor, lambda: max(distances),
+                                                        lambda: best_fitness_so_far, plausible_distance,
+                                                        max_speed=SPEED_LIMIT_KMH / 3.6,
+                                                        max_acceleration=MAX_ACCELERATION,
+                                                        warmup_polls=EARLY_STOP_WARMUP_POLLS))
+
         for i in range(1, TIMEOUT):
             bng.step(30)
 
@@ -209,11 +315,12 @@ def execute_experiment(individual, road_visualizer=None):
                 # print("Test Passed!")
                 return "Pass", max(distances)
 
+            if early_stop.check():
+                logging.debug("Test stopped early. %s" % early_stop.reason)
+                return "Stopped", max(distances)
+
         # print("Test Failed with timeout!")
         return "Error", -1.0
-    finally:
-        bng.delete_scenario(scenario.path)
-        bng.skt.close()
 
 
 # tournament selection
@@ -227,28 +334,60 @@ def selection(pop, scores, k=3):
     return pop[selection_ix]
 
 
+def road_objectives(individuals, executions):
+    """The objectives (to maximize) of the simulated roads: their lane deviation and some of their features.
+    Invalid roads are dominated by all the others."""
+    objectives = np.column_stack(([e[1] for e in executions],
+                                  RoadPopulation.from_individuals(individuals).features()[:, OBJECTIVE_FEATURES]))
+    objectives[[e[0] == INVALID_ROAD[0] for e in executions]] = -np.inf
+    return objectives
+
+
 # https://machinelearningmastery.com/simple-genetic-algorithm-from-scratch-in-python/
-def main():
+def main(endpoints=SIMULATOR_ENDPOINTS, use_surrogate=False, multi_objective=False):
     n_pop = 4
     n_iter = 10
 
+    # The surrogate picks the n_pop most promising children to simulate
+    surrogate = SurrogateSelector(top_k=n_pop) if use_surrogate else None
+    n_children = n_pop * SURROGATE_OVERSAMPLING if use_surrogate else n_pop
+
+    # Distribute the experiments among the available simulators
+    simulator_pool = SimulatorPool(endpoints)
+
     # initial population of random roads made of N segments N=10
     pop = [generate_random_road(10) for _ in range(n_pop)]
 
     # keep track of best solution
     best, best_eval = None, 0
 
+    # In the multi-objective search, the best and most diverse roads found so far, and their objectives
+    elite, elite_objectives = [], np.empty((0, 1 + len(OBJECTIVE_FEATURES)))
+
     for gen in range(n_iter):
-        # TODO: Note that we do NOT validate the inputs here!
+        # Invalid roads are not simulated
+        valid = validation_pipeline.are_valid(pop)
+        print("Validation of the roads:")
+        print(validation_pipeline.report())
 
-        # Evaluate all candidates in the population
-        executions = [execute_experiment(c) for c in pop]
+        # Evaluate all valid candidates in the population. Roads already evaluated are not simulated again
+        valid_executions = iter(fitness_cache.map(execute_experiment, [i for i, v in zip(pop, valid) if v],
+                                                  map_function=simulator_pool.map))
+        executions = [next(valid_executions) if v else INVALID_ROAD for v in valid]
+        print("Fitness cache", fitness_cache)
 
         print("Results from the executions:")
         [ print(execution) for execution in executions ]
 
         test_outcome = [e[0] for e in executions]
-        scores = [e[1] for e in executions]
+        scores = [record_fitness(e) for e in executions]
+
+        # Learn from the roads that have been simulated until the end
+        simulated = [(individual, e[1]) for individual, e, v in zip(pop, executions, valid)
+                     if v and e[0] in COMPLETED_OUTCOMES]
+        append_to_archive(ARCHIVE_FILE, [individual for individual, _ in simulated], [f for _, f in simulated])
+        if surrogate is not None:
+            surrogate.observe([individual for individual, _ in simulated], [f for _, f in simulated])
 
         # check for new best solution
         for i in range(n_pop):
@@ -265,23 +404,94 @@ def main():
             print("Error test. Search is over")
             return [best, best_eval]
 
-        # select individuals using tournament selection (k=3)
-        selected = [selection(pop, scores) for _ in range(n_pop)]
+        if multi_objective:
+            # Keep the roads of the best fronts, preferring diverse ones, among the elite and the new roads.
+            # No extra simulation is needed: objectives come from the executions and the road features
+            candidates = elite + pop
+            objectives = np.vstack((elite_objectives, road_objectives(pop, executions)))
+            survivors = select_survivors(objectives, n_pop)
+            elite, elite_objectives = [candidates[i] for i in survivors], objectives[survivors]
+            ranks = non_dominated_sort(elite_objectives)
+            print("Generation: %d. Pareto front of %d roads" % (gen, np.count_nonzero(ranks == 0)))
+
+            pop = elite
+            distances = crowding_distance(elite_objectives, ranks)
+            select_parents = lambda: crowded_tournament(ranks, distances, n_children)
+        else:
+            # tournament selection (k=3)
+            select_parents = lambda: tournament_selection(scores, n_children, k=3)
+
+        # select pairs of parents. The whole population at once
+        parents = RoadPopulation.from_individuals(pop)
+        parents_a = parents.take(select_parents())
+        parents_b = parents.take(select_parents())
 
         # create the next generation
-        children = list()
-        for i in range(n_pop):
-            # store for next generation
-            children.append(mutate(selected[i]))
+        children = mutate_population(crossover(parents_a, parents_b, CROSSOVER_RATE), SEGMENT_BOUNDS)
+
+        # Only the most promising children are simulated
+        if surrogate is not None:
+            children = children.take(surrogate.select_indices_by_features(children.features()))
 
         # replace population
-        pop = children
+        pop = children.to_individuals()
 
     print("Budget done. Search is over")
     return [best, best_eval]
 
 
+def evaluate_road(individual, host='localhost', port=64256):
+    # Roads already evaluated are not simulated again
+    return fitness_cache.evaluate(partial(execute_experiment, host=host, port=port), individual)
+
+
+def main_steady_state(endpoints=SIMULATOR_ENDPOINTS, n_pop=4, budget=40):
+    """
+        Same search as main, but asynchronous: as soon as one simulator completes a test, the result enters the
+        population and the simulator gets a new mutant. So, slow tests do not stall the other simulators.
+    """
+    # Each simulator runs one test at a time, so the number of concurrent tests is the number of simulators
+    simulator_pool = SimulatorPool(endpoints)
+
+    ga = SteadyStateGA(generate=lambda: generate_random_road(10), mutate=mutate, select=selection,
+                       population_size=n_pop, budget=budget,
+                       score=record_fitness,
+                       # Invalid roads are not simulated
+                       is_valid=validation_pipeline.is_valid,
+                       # If we found a problem or there was an error the search is over
+                       stop=lambda execution: execution[0] in ("Fail", "Error"))
+
+    best, best_execution = ga.run(simulator_pool.imap_unordered, evaluate_road)
+
+    print("Validation of the roads:")
+    print(validation_pipeline.report())
+    print("Fitness cache", fitness_cache)
+    if ga.gave_up:
+        print("No valid road could be generated anymore")
+    if best_execution is None:
+        print("Search is over without any test")
+        return [None, None]
+    print("Search is over after %d tests. Best score = %.3f" % (ga.evaluated, best_execution[1]))
+    return [best, best_execution[1]]
+
+
+def delete_cached_scenarios(endpoints=SIMULATOR_ENDPOINTS):
+    print("Scenarios", scenario_cache)
+    for host, port in endpoints:
+        with simulator_connections.session(host, port, keep_scenario=True) as bng:
+            scenario_cache.delete(bng, host, port)
+
+
 if __name__ == "__main__":
     # This is the "main" Bng Client that starts and stop the simulator
     with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
-        main()
+        try:
+            # Pass --steady-state to run the asynchronous search
+            if "--steady-state" in sys.argv:
+                main_steady_state()
+            else:
+                # Pass --surrogate to simulate only the children that the surrogate model deems most promising
+                # and --multi-objective to look for roads that are also complex and diverse
+                main(use_surrogate="--surrogate" in sys.argv, multi_objective="--multi-objective" in sys.argv)
+        finally:
+            delete_cached_scenarios()
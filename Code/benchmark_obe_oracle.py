@@ -0,0 +1,89 @@
+# Compare the latency of SimpleOBEOracle.check with the plain contains check on the right lane polygon,
+# over streams of car positions.
+#
+# Usage: python benchmark_obe_oracle.py [positions.npy]
+#   Without arguments, synthetic position streams of a car driving along the right lane of a winding road
+#   and polled at 10 and 60 Hz are used. Otherwise, the given (n, 2) or (n, 3) array of recorded positions
+#   is replayed over the same road.
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+from shapely.geometry import Point
+
+from test_oracles import SimpleOBEOracle
+from benchmark_road_validation import generate_winding_road
+
+ROAD_NODES = 500
+SPEED_KMH = 70.0
+POLLING_FREQUENCIES = [10, 60]
+
+
+class ReplaySensor:
+    """Stands in for the State sensor and returns the recorded positions one after the other."""
+
+    def __init__(self):
+        self.data = {'pos': None}
+
+
+def generate_position_stream(road_nodes, polling_frequency, seed=0):
+    """Positions of a car that drives along the center of the right lane with some lateral noise and that
+    eventually leaves the road."""
+    random = np.random.RandomState(seed)
+    oracle = SimpleOBEOracle(road_nodes, None)
+    lane_center = oracle.road_polygon.right_polyline
+
+    step = SPEED_KMH / 3.6 / polling_frequency
+    positions = []
+    for distance in np.arange(0, lane_center.length, step):
+        p = lane_center.interpolate(distance)
+        positions.append((p.x + random.normal(0, 0.3), p.y + random.normal(0, 0.3)))
+    # Drift out of the road at the end
+    last_x, last_y = positions[-1]
+    positions.extend((last_x, last_y - 0.5 * i) for i in range(1, 20))
+    return np.array(positions)
+
+
+def replay(check, sensor, positions):
+    """Replays the positions, and returns the time per check and all the verdicts."""
+    verdicts = []
+    # The State sensor returns lists of floats
+    positions = positions.tolist()
+    start = timer()
+    for position in positions:
+        sensor.data['pos'] = position
+        verdicts.append(check())
+    return (timer() - start) / len(positions), verdicts
+
+
+def benchmark(road_nodes, positions, label):
+    sensor = ReplaySensor()
+    oracle = SimpleOBEOracle(road_nodes, sensor)
+    right_polygon = oracle.road_polygon.right_polygon
+    # Warm up the lazy geometries
+    oracle.road_polygon.prepared_right_polygon, oracle.road_polygon.right_lane_quads
+
+    def plain_check():
+        return not right_polygon.contains(Point(sensor.data['pos']))
+
+    plain_time, plain_verdicts = replay(plain_check, sensor, positions)
+    oracle_time, oracle_verdicts = replay(oracle.check, sensor, positions)
+    assert plain_verdicts == oracle_verdicts, "The two checks disagree!"
+
+    print("%15s %10d %15.2f %15.2f %9.1fx" % (label, len(positions), plain_time * 1e6, oracle_time * 1e6,
+                                             plain_time / oracle_time))
+
+
+def main(positions_file=None):
+    road_nodes = generate_winding_road(ROAD_NODES - 1)
+    print("%15s %10s %15s %15s %10s" % ("stream", "polls", "contains (us)", "oracle (us)", "speedup"))
+    if positions_file is not None:
+        benchmark(road_nodes, np.load(positions_file)[:, 0:2], positions_file)
+    else:
+        for polling_frequency in POLLING_FREQUENCIES:
+            positions = generate_position_stream(road_nodes, polling_frequency)
+            benchmark(road_nodes, positions, "%d Hz" % polling_frequency)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,48 @@
+# Micro-benchmark of the per-test setup of the oracles: building all the geometries of a RoadPolygon
+# (what RoadPolygon used to do in its constructor) versus building only the right lane, which is the only
+# geometry SimpleOBEOracle uses.
+#
+# Usage: python benchmark_road_polygon.py
+from timeit import repeat
+
+import numpy as np
+
+from test_oracles import RoadPolygon, SimpleOBEOracle
+from benchmark_road_validation import generate_winding_road
+
+# BeamNG returns roughly one edge every couple of meters, so these cover short and long roads
+ROAD_SIZES = [50, 200, 1000]
+NUMBER = 20
+
+
+def build_all_geometries(road_nodes):
+    road_polygon = RoadPolygon.from_nodes(road_nodes)
+    return (road_polygon.polygons, road_polygon.polygon, road_polygon.right_polygon, road_polygon.left_polygon,
+            road_polygon.polyline, road_polygon.right_polyline, road_polygon.left_polyline)
+
+
+def build_obe_oracle(road_nodes):
+    oracle = SimpleOBEOracle(road_nodes, None)
+    return oracle.road_polygon.right_polygon
+
+
+def best_time(function, road_nodes):
+    """Returns the best average time over 5 rounds of NUMBER executions."""
+    return min(repeat(lambda: function(road_nodes), number=NUMBER, repeat=5)) / NUMBER
+
+
+def main():
+    print("%10s %15s %15s %10s" % ("nodes", "all (ms)", "oracle (ms)", "speedup"))
+    for n_nodes in ROAD_SIZES:
+        road_nodes = generate_winding_road(n_nodes - 1)
+
+        # Sanity check: both ways compute the same right lane
+        assert build_all_geometries(road_nodes)[2].equals(build_obe_oracle(road_nodes))
+
+        all_time = best_time(build_all_geometries, road_nodes)
+        oracle_time = best_time(build_obe_oracle, road_nodes)
+        print("%10d %15.3f %15.3f %9.1fx" % (n_nodes, all_time * 1000, oracle_time * 1000, all_time / oracle_time))
+
+
+if __name__ == "__main__":
+    main()
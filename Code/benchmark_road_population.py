@@ -0,0 +1,69 @@
+# Compare the time to create the next generation of large populations of roads: tournament selection and mutation
+# of the individuals one at a time (like automation_example_2 did, on lists of dicts) versus the vectorized
+# operators on RoadPopulation arrays.
+#
+# Usage: python benchmark_road_population.py
+from copy import deepcopy
+from timeit import default_timer as timer
+
+import numpy as np
+from numpy.random import rand, randint
+
+from road_population import SegmentBounds, random_segments, tournament_selection, mutate
+
+POPULATION_SIZES = [1000, 10000, 50000]
+SEGMENTS = 9
+BOUNDS = SegmentBounds(5, 50, 10, 50, 10, 90)
+
+
+def python_selection(pop, scores, k=3):
+    selection_ix = randint(len(pop))
+    for ix in randint(0, len(pop), k - 1):
+        if scores[ix] > scores[selection_ix]:
+            selection_ix = ix
+    return pop[selection_ix]
+
+
+def python_mutate(individual):
+    mutant = deepcopy(individual)
+    for road_segment in mutant:
+        if rand() <= 1 / len(mutant):
+            s = road_segment['trajectory_segments'][0]
+            if s['type'] == 'straight':
+                s['length'] = randint(BOUNDS.min_length, BOUNDS.max_length)
+            elif rand() <= 0.5:
+                s['angle'] = randint(BOUNDS.min_angle, BOUNDS.max_angle) * (1.0 if rand() <= 0.5 else -1.0)
+            else:
+                s['radius'] = randint(BOUNDS.min_radius, BOUNDS.max_radius)
+    return mutant
+
+
+def python_generation(individuals, scores):
+    return [python_mutate(python_selection(individuals, scores)) for _ in range(len(individuals))]
+
+
+def vectorized_generation(population, scores):
+    return mutate(population.take(tournament_selection(scores, len(population))), BOUNDS)
+
+
+def main():
+    print("%12s %15s %15s %10s" % ("individuals", "python (ms)", "arrays (ms)", "speedup"))
+    for n in POPULATION_SIZES:
+        population = random_segments((n, SEGMENTS), BOUNDS, np.random.RandomState(0))
+        individuals = population.to_individuals()
+        scores = np.random.RandomState(1).rand(n)
+
+        start = timer()
+        python_generation(individuals, scores)
+        python_time = timer() - start
+
+        start = timer()
+        vectorized_generation(population, scores)
+        vectorized_time = timer() - start
+
+        print("%12d %15.1f %15.1f %9.1fx" % (n, python_time * 1000, vectorized_time * 1000,
+                                            python_time / vectorized_time))
+
+
+if __name__ == "__main__":
+    main()
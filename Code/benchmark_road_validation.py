@@ -0,0 +1,57 @@
+# Compare the spatial-index based RoadPolygon.is_valid against the quadratic all-pairs check
+#
+# Usage: python benchmark_road_validation.py [--all]
+#   By default, the quadratic check runs only on roads up to QUADRATIC_MAX_SEGMENTS segments because
+#   on the largest roads it takes several minutes. Pass --all to run it on every road.
+import sys
+import io
+from contextlib import redirect_stdout
+from math import sin
+from timeit import default_timer as timer
+
+from test_oracles import RoadPolygon
+
+ROAD_SIZES = [50, 100, 500, 1000, 5000]
+QUADRATIC_MAX_SEGMENTS = 500
+REPETITIONS = 3
+
+ROAD_WIDTH = 8.0
+NODE_DISTANCE = 2.0
+
+
+def generate_winding_road(n_segments):
+    """Returns the nodes of a valid (not self-intersecting) winding road made of n_segments segments."""
+    return [(NODE_DISTANCE * i, 20.0 * sin(i * 0.02), 0.0, ROAD_WIDTH) for i in range(n_segments + 1)]
+
+
+def time_validation(validate):
+    """Returns the best time over REPETITIONS runs of validate and its result."""
+    best, result = None, None
+    for _ in range(REPETITIONS):
+        # The validation methods are quite verbose
+        with redirect_stdout(io.StringIO()):
+            start = timer()
+            result = validate()
+            elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(run_all=False):
+    print("%10s %15s %15s %10s" % ("segments", "indexed (s)", "all-pairs (s)", "speedup"))
+    for n_segments in ROAD_SIZES:
+        road_polygon = RoadPolygon.from_nodes(generate_winding_road(n_segments))
+
+        indexed_time, indexed_result = time_validation(road_polygon.is_valid)
+
+        if run_all or n_segments <= QUADRATIC_MAX_SEGMENTS:
+            quadratic_time, quadratic_result = time_validation(road_polygon.is_valid_all_pairs)
+            assert indexed_result == quadratic_result, "The two checks disagree!"
+            print("%10d %15.4f %15.4f %9.1fx" % (n_segments, indexed_time, quadratic_time,
+                                                 quadratic_time / indexed_time))
+        else:
+            print("%10d %15.4f %15s %10s" % (n_segments, indexed_time, "skipped", "-"))
+
+
+if __name__ == "__main__":
+    main(run_all="--all" in sys.argv)
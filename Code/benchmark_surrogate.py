@@ -0,0 +1,70 @@
+# Measure offline how well the surrogate picks the roads to simulate, by replaying an archive of (road, fitness)
+# pairs: the archive is split in generations of children, the surrogate picks the top-k children of each generation
+# and then observes the fitness of the ones it picked, like the surrogate-assisted search does.
+#
+# The hit rate is the fraction of the actual top-k children that the surrogate picks. Picking at random, the
+# expected hit rate is k / children.
+#
+# Usage: python benchmark_surrogate.py [archive.jsonl]
+#   Without arguments, a synthetic archive of random roads is used, whose fitness grows with the sharpness of the
+#   turns (see simulator_pool.fake_outcome) plus some noise. Otherwise, the given archive (e.g., the one recorded
+#   by automation_example_2) is replayed.
+import sys
+
+import numpy as np
+
+from benchmark_trajectory_matching import generate_random_segments
+from simulator_pool import fake_outcome
+from surrogate import SurrogateSelector, load_archive
+
+CHILDREN = 12
+TOP_K = [1, 4]
+SYNTHETIC_ROADS = 1200
+SEGMENTS = 9
+
+
+def generate_synthetic_archive(n_roads, seed=0):
+    random = np.random.RandomState(seed)
+    roads, fitness_values = [], []
+    for i in range(n_roads):
+        road = [{'trajectory_segments': [s]} for s in generate_random_segments(SEGMENTS, seed=seed * n_roads + i)]
+        roads.append(road)
+        fitness_values.append(fake_outcome(road)[1] + random.normal(0, 0.1))
+    return roads, fitness_values
+
+
+def replay(roads, fitness_values, top_k):
+    """Returns the hit rate and the average ratio between the best fitness picked and the best fitness available,
+    over the generations in which the surrogate was trained."""
+    selector = SurrogateSelector(top_k)
+    hit_rates, best_ratios = [], []
+    for start in range(0, len(roads) - CHILDREN + 1, CHILDREN):
+        children = list(range(start, start + CHILDREN))
+        trained = selector.is_trained()
+        picked = [children[i] for i in selector.select_indices([roads[i] for i in children])]
+        actual_top = sorted(children, key=lambda i: fitness_values[i], reverse=True)[0:top_k]
+        if trained:
+            hit_rates.append(len(set(picked) & set(actual_top)) / top_k)
+            best_ratios.append(max(fitness_values[i] for i in picked) / max(fitness_values[i] for i in children))
+
+        # Only the picked children are simulated, so only their fitness is known
+        selector.observe([roads[i] for i in picked], [fitness_values[i] for i in picked])
+    return np.mean(hit_rates), np.mean(best_ratios), len(hit_rates)
+
+
+def main(archive_file=None):
+    if archive_file is not None:
+        roads, fitness_values = load_archive(archive_file)
+    else:
+        roads, fitness_values = generate_synthetic_archive(SYNTHETIC_ROADS)
+
+    print("%d roads, generations of %d children" % (len(roads), CHILDREN))
+    print("%6s %12s %12s %12s %12s" % ("top-k", "generations", "hit rate", "random", "best ratio"))
+    for top_k in TOP_K:
+        hit_rate, best_ratio, generations = replay(roads, fitness_values, top_k)
+        print("%6d %12d %11.1f%% %11.1f%% %12.3f" % (top_k, generations, hit_rate * 100, top_k / CHILDREN * 100,
+                                                     best_ratio))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
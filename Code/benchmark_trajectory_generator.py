@@ -0,0 +1,45 @@
+# Measure the road generation throughput (roads/second): building the segment polylines with Shapely
+# transformations versus a single NumPy affine matrix per segment, and the whole generate_trajectory,
+# either with spline interpolation or with the analytic resampling.
+#
+# Usage: python benchmark_trajectory_generator.py
+from timeit import default_timer as timer
+
+from shapely.geometry import Point
+
+from trajectory_generator import generate_trajectory, _generate_segment_lines, _generate_segment_lines_shapely
+from benchmark_trajectory_matching import generate_random_segments
+
+SEGMENT_COUNTS = [10, 50]
+ROADS = 50
+
+
+def roads_per_second(generate, roads):
+    start = timer()
+    for segments in roads:
+        generate(segments)
+    return len(roads) / (timer() - start)
+
+
+def main():
+    initial_location = Point(0, 0)
+    approaches = [
+        ("segments (Shapely)", lambda segments: _generate_segment_lines_shapely(initial_location, 0, segments)),
+        ("segments (NumPy)", lambda segments: _generate_segment_lines(initial_location, 0, segments)),
+        ("trajectory (spline)", lambda segments: generate_trajectory(
+            initial_location, 0, [{'trajectory_segments': segments}])),
+        ("trajectory (analytic)", lambda segments: generate_trajectory(
+            initial_location, 0, [{'trajectory_segments': segments}], analytic=True)),
+    ]
+    print("%25s" % "roads/second" + "".join("%12s" % ("%d segm." % n) for n in SEGMENT_COUNTS))
+    for name, generate in approaches:
+        throughputs = []
+        for n_segments in SEGMENT_COUNTS:
+            # Different roads every time, so the interpolation cache does not help
+            roads = [generate_random_segments(n_segments, seed) for seed in range(ROADS)]
+            throughputs.append(roads_per_second(generate, roads))
+        print("%25s" % name + "".join("%12.1f" % throughput for throughput in throughputs))
+
+
+if __name__ == "__main__":
+    main()
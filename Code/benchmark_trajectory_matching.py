@@ -0,0 +1,53 @@
+# Compare the vectorized matching of the interpolated points to the segments of a trajectory, which ends
+# generate_trajectory, against the original loop over all the (segment, point) pairs.
+#
+# Usage: python benchmark_trajectory_matching.py
+from timeit import default_timer as timer
+
+from numpy.random import RandomState
+from shapely.geometry import Point
+
+import common
+from trajectory_generator import _generate_segment_lines, _match_points_to_segments, \
+    _match_points_to_segments_all_pairs
+
+SEGMENT_COUNTS = [10, 25, 50, 100, 200]
+SAMPLING_UNIT = 5
+
+
+def generate_random_segments(n_segments, seed=0):
+    """Random straight and turn segments, with the same ranges used by automation_example_2."""
+    random = RandomState(seed)
+    segments = []
+    for _ in range(n_segments):
+        if random.rand() <= 0.3:
+            segments.append({'type': 'straight', 'length': random.randint(5, 50)})
+        else:
+            sign = 1 if random.rand() <= 0.5 else -1
+            segments.append({'type': 'turn', 'angle': sign * random.randint(10, 90), 'radius': random.randint(10, 50)})
+    return segments
+
+
+def time_matching(match, interpolated_points, segment_lines):
+    start = timer()
+    result = match(interpolated_points, segment_lines)
+    return timer() - start, result
+
+
+def main():
+    print("%10s %10s %15s %15s %10s" % ("segments", "points", "vectorized (s)", "all-pairs (s)", "speedup"))
+    for n_segments in SEGMENT_COUNTS:
+        the_trajectory, segment_lines = _generate_segment_lines(Point(0, 0), 0, generate_random_segments(n_segments))
+        interpolated_points = common.interpolate(the_trajectory, sampling_unit=SAMPLING_UNIT, as_tuples=True)
+
+        vectorized_time, vectorized_result = time_matching(_match_points_to_segments, interpolated_points,
+                                                           segment_lines)
+        all_pairs_time, all_pairs_result = time_matching(_match_points_to_segments_all_pairs, interpolated_points,
+                                                         segment_lines)
+        assert vectorized_result == all_pairs_result, "The two matchings disagree!"
+        print("%10d %10d %15.4f %15.4f %9.1fx" % (n_segments, len(interpolated_points), vectorized_time,
+                                                 all_pairs_time, all_pairs_time / vectorized_time))
+
+
+if __name__ == "__main__":
+    main()
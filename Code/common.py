@@ -1,6 +1,7 @@
 from scipy.interpolate import splev, splprep
-from numpy import repeat, array, sqrt, inf, cross, dot
-from numpy.ma import arange
+from numpy import array, sqrt, inf, cross, dot, column_stack, zeros, frombuffer
+from functools import lru_cache
+from numpy import arange
 from shapely.geometry import LineString, Point
 from shapely.affinity import translate, rotate
 from math import degrees, atan2, copysign
@@ -10,6 +11,8 @@ rounding_precision = 3
 interpolation_distance = 1
 smoothness = 0
 min_num_nodes = 20
+# How many interpolated roads are kept in memory
+interpolation_cache_size = 1024
 CRASHED = 1
 NO_CRASH = 0
 
@@ -36,15 +39,31 @@ def find_radius_and_center(p1, p2, p3):
     return radius, Point(cx, cy)
 
 
-def interpolate(road_nodes, sampling_unit=interpolation_distance):
+def interpolate(road_nodes, sampling_unit=interpolation_distance, as_tuples=False):
     """
-        Interpolate the road points using cubic splines and ensure we handle 4F tuples for compatibility
+        Interpolate the road points using cubic splines and ensure we handle 4F tuples for compatibility.
+
+        Returns a (n, 2) array or, if the nodes have a width, a (n, 4) array with default z and the interpolated
+        road width. Use as_tuples=True to get a list of tuples instead.
+
+        The same roads are interpolated over and over, so the results are cached (see interpolation_cache_size).
+        The returned arrays are shared with the cache, hence they are read-only.
     """
-    old_x_vals = [t[0] for t in road_nodes]
-    old_y_vals = [t[1] for t in road_nodes]
+    nodes = array([t[0:4] if len(t) > 3 else t[0:2] for t in road_nodes], dtype=float)
+    interpolated_points = _cached_interpolate(nodes.tobytes(), nodes.shape, sampling_unit)
+    if as_tuples:
+        return [tuple(p) for p in interpolated_points.tolist()]
+    return interpolated_points
+
+
+@lru_cache(maxsize=interpolation_cache_size)
+def _cached_interpolate(nodes_bytes, nodes_shape, sampling_unit):
+    road_nodes = frombuffer(nodes_bytes).reshape(nodes_shape)
+    old_x_vals = road_nodes[:, 0]
+    old_y_vals = road_nodes[:, 1]
 
     # This is an approximation based on whatever input is given
-    road_length = LineString([(t[0], t[1]) for t in road_nodes]).length
+    road_length = LineString(road_nodes[:, 0:2]).length
 
     num_nodes = int(road_length / sampling_unit)
     if num_nodes < min_num_nodes:
@@ -60,29 +79,28 @@ def interpolate(road_nodes, sampling_unit=interpolation_distance):
         # With three points we use an arc, using linear interpolation will result in invalid road tests
         k = 2
     else:
-        # Otheriwse, use cubic splines
+        # Otherwise, use cubic splines
         k = 3
 
     pos_tck, pos_u = splprep([old_x_vals, old_y_vals], s=smoothness, k=k)
     step_size = 1 / num_nodes
     unew = arange(0, 1 + step_size, step_size)
     new_x_vals, new_y_vals = splev(unew, pos_tck)
-    new_z_vals = repeat(0.0, len(unew))
 
-    if len(road_nodes[0]) > 2:
+    if road_nodes.shape[1] > 2:
         # Recompute width
-        old_width_vals = [t[3] for t in road_nodes]
+        old_width_vals = road_nodes[:, 3]
         width_tck, width_u = splprep([pos_u, old_width_vals], s=smoothness, k=k)
         _, new_width_vals = splev(unew, width_tck)
 
-        # Return the 4-tuple with default z and defatul road width
-        return list(zip([round(v, rounding_precision) for v in new_x_vals],
-                        [round(v, rounding_precision) for v in new_y_vals],
-                        [round(v, rounding_precision) for v in new_z_vals],
-                        [round(v, rounding_precision) for v in new_width_vals]))
+        # The 4-tuple with default z and the interpolated road width
+        interpolated_points = column_stack((new_x_vals, new_y_vals, zeros(len(unew)), new_width_vals))
     else:
-        return list(zip([round(v, rounding_precision) for v in new_x_vals],
-                        [round(v, rounding_precision) for v in new_y_vals]))
+        interpolated_points = column_stack((new_x_vals, new_y_vals))
+
+    interpolated_points = interpolated_points.round(rounding_precision)
+    interpolated_points.setflags(write=False)
+    return interpolated_points
 
 
 def compute_initial_state(driving_actions):
@@ -156,51 +174,3 @@ def remove_duplicates(seq):
     seen_add = seen.add
     return [x for x in seq if not (x in seen or seen_add(x))]
 
-
-def interpolate(road_nodes, sampling_unit=interpolation_distance):
-    """
-        Interpolate the road points using cubic splines and ensure we handle 4F tuples for compatibility
-    """
-    old_x_vals = [t[0] for t in road_nodes]
-    old_y_vals = [t[1] for t in road_nodes]
-
-    # This is an approximation based on whatever input is given
-    road_length = LineString([(t[0], t[1]) for t in road_nodes]).length
-
-    num_nodes = int(road_length / sampling_unit)
-    if num_nodes < min_num_nodes:
-        num_nodes = min_num_nodes
-
-    assert len(old_x_vals) >= 2, "You need at leas two road points to define a road"
-    assert len(old_y_vals) >= 2, "You need at leas two road points to define a road"
-
-    if len(old_x_vals) == 2:
-        # With two points the only option is a straight segment
-        k = 1
-    elif len(old_x_vals) == 3:
-        # With three points we use an arc, using linear interpolation will result in invalid road tests
-        k = 2
-    else:
-        # Otherwise, use cubic splines
-        k = 3
-
-    pos_tck, pos_u = splprep([old_x_vals, old_y_vals], s=smoothness, k=k)
-    step_size = 1 / num_nodes
-    unew = arange(0, 1 + step_size, step_size)
-    new_x_vals, new_y_vals = splev(unew, pos_tck)
-    new_z_vals = repeat(0.0, len(unew))
-
-    if len(road_nodes[0]) > 2:
-        # Recompute width
-        old_width_vals = [t[3] for t in road_nodes]
-        width_tck, width_u = splprep([pos_u, old_width_vals], s=smoothness, k=k)
-        _, new_width_vals = splev(unew, width_tck)
-
-        # Return the 4-tuple with default z and default road width
-        return list(zip([round(v, rounding_precision) for v in new_x_vals],
-                        [round(v, rounding_precision) for v in new_y_vals],
-                        [round(v, rounding_precision) for v in new_z_vals],
-                        [round(v, rounding_precision) for v in new_width_vals]))
-    else:
-        return list(zip([round(v, rounding_precision) for v in new_x_vals],
-                        [round(v, rounding_precision) for v in new_y_vals]))
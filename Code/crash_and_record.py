@@ -8,6 +8,8 @@ from time import sleep
 import numpy as np
 from scipy.spatial.transform import Rotation as R
 
+from image_sink import ImageSink
+
 # Specify where BeamNG home and user are
 BNG_HOME = "C:\\BeamNG.tech.v0.21.3.0"
 BNG_USER = "C:\\BeamNG.tech_userpath"
@@ -125,45 +127,17 @@ output_folder = mkdtemp()
 print("Storing OUTPUT to ", output_folder)
 
 def store_images(camera_name, frame_id, image_color, image_annotation):
-    # Convert images to arrays
-    array_color = np.asarray(image_color.convert('RGB'))
-    array_annotation = np.asarray(image_annotation.convert('RGB'))
-    # Store the arrays into target folder using camera_name and frame_id as identifiers
-
-    output_file_color = os.path.join(
-            output_folder,
-            "_".join([camera_name, str(frame_id), "color"])+".npy"
-            )
-    with open(output_file_color, 'wb') as f:
-        np.save(f, array_color)
-
-    output_file_annotation = os.path.join(
-        output_folder,
-        "_".join([camera_name, str(frame_id), "annotation"])+".npy"
-    )
-
-    with open(output_file_annotation, 'wb') as f:
-        np.save(f, array_annotation)
-
-    if frame_id % 10 == 0:
-        # Store the images as JPEG
-        output_file_color = os.path.join(
-            output_folder,
-            "_".join([camera_name, str(frame_id), "color"]) + ".jpeg"
-        )
-        plt.imsave(output_file_color, array_color)
-
-        output_file_annotation = os.path.join(
-            output_folder,
-            "_".join([camera_name, str(frame_id), "annotation"]) + ".jpeg"
-        )
-        plt.imsave(output_file_annotation, array_annotation)
-
-        print("Stored to", output_file_color, output_file_annotation)
+    # Queue the images using camera_name and frame_id as identifiers
+    image_sink.submit(camera_name + "_color", frame_id, image_color)
+    image_sink.submit(camera_name + "_annotation", frame_id, image_annotation)
 
 PLOT = False
 
-with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
+# Images are converted and stored in the background, so the simulation does not wait for the disk. If the disk
+# falls behind, the simulation waits (set drop_frames=True to drop the frames instead). The queued images are stored
+# when the simulation ends, also when it fails
+with ImageSink(output_folder, max_queued=64, preview_every=10) as image_sink, \
+        BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
 
     scenario.make(bng)
 
@@ -244,4 +218,6 @@ with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
                 figure.canvas.flush_events()
 
                 plt.draw()
-                plt.pause(0.001)
\ No newline at end of file
+                plt.pause(0.001)
+
+print("Images", image_sink)
@@ -0,0 +1,245 @@
+# Policies to stop simulations as soon as they are not worth running anymore
+#
+# Like the test oracles, the policies read the sensors of the vehicle and their check() method is called after each
+# poll: when it returns True, the simulation can stop. Each policy stores in reason why it stopped the simulation.
+#
+# Run this module to test it
+#   python -m unittest early_stop
+import unittest
+from collections import deque
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def curvatures(points):
+    """Returns the curvature (1/radius) of the circles passing by each three consecutive (x, y) points.
+    The curvature of the first and last points is the one of their neighbour."""
+    points = np.asarray(points, dtype=float)[:, 0:2]
+    if len(points) < 3:
+        return np.zeros(len(points))
+    a = points[1:-1] - points[:-2]
+    b = points[2:] - points[1:-1]
+    c = points[2:] - points[:-2]
+    cross = np.abs(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0])
+    lengths = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) * np.linalg.norm(c, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inner = np.where(lengths > 0, 2.0 * cross / lengths, 0.0)
+    return np.concatenate(([inner[0]], inner, [inner[-1]]))
+
+
+class EarlyStop:
+    """Combines the policies: stops as soon as one of them does, and takes its reason."""
+
+    def __init__(self, *policies):
+        self.policies = policies
+        self.reason = None
+
+    def check(self):
+        for policy in self.policies:
+            if policy.check():
+                self.reason = policy.reason
+                return True
+        return False
+
+
+class StationaryPolicy:
+    """Stops when the vehicle moved less than min_distance over the last k polls (e.g., it got stuck)."""
+
+    def __init__(self, state_sensor, k=5, min_distance=0.5):
+        assert k > 0, "At least one poll is needed"
+        self.state_sensor = state_sensor
+        self.k = k
+        self.min_distance = min_distance
+        self.positions = deque(maxlen=k + 1)
+        self.reason = None
+
+    def check(self):
+        self.positions.append(tuple(self.state_sensor.data['pos'][0:2]))
+        if len(self.positions) <= self.k:
+            return False
+        (x0, y0), (x1, y1) = self.positions[0], self.positions[-1]
+        distance = ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5
+        if distance < self.min_distance:
+            self.reason = "Stationary: moved %.2f m in the last %d polls" % (distance, self.k)
+            return True
+        return False
+
+
+class RemainingCurvaturePolicy:
+    """
+        Stops when the fitness of the simulation (the higher, the better) cannot plausibly beat the best fitness
+        found so far.
+
+        The fitness that can still be reached is estimated with fitness_bound(curvatures, speeds), given the
+        curvature of each node of the road ahead of the vehicle and the speed the vehicle can have there: straight
+        roads do not push vehicles far from the lane, sharp turns at high speed do. Vehicles can keep their current
+        speed and can accelerate by max_acceleration (m/s^2) up to max_speed (e.g., the speed limit), so the nodes
+        far ahead can be reached faster than the ones close by. The policy does not stop anything during the first
+        warmup_polls, while the sensors settle.
+
+        current_fitness() and best_fitness() return the fitness reached so far in this simulation and the best
+        fitness found so far by the search.
+    """
+
+    def __init__(self, road_nodes, state_sensor, current_fitness, best_fitness, fitness_bound, max_speed,
+                 max_acceleration=3.0, warmup_polls=5):
+        points = np.asarray([node[0:2] for node in road_nodes], dtype=float)
+        self.curvatures = curvatures(points)
+        # The distance along the road from the first node to each node
+        self.arc_lengths = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))))
+        self.tree = cKDTree(points)
+        self.state_sensor = state_sensor
+        self.current_fitness = current_fitness
+        self.best_fitness = best_fitness
+        self.fitness_bound = fitness_bound
+        self.max_speed = max_speed
+        self.max_acceleration = max_acceleration
+        self.warmup_polls = warmup_polls
+        self.polls = 0
+        self.reason = None
+
+    def reachable_speeds(self, nearest, speed):
+        """The highest speed the vehicle can have at each node from the nearest one on, given its current speed."""
+        distances = self.arc_lengths[nearest:] - self.arc_lengths[nearest]
+        return np.sqrt(np.maximum(speed ** 2, np.minimum(self.max_speed ** 2,
+                                                         speed ** 2 + 2 * self.max_acceleration * distances)))
+
+    def check(self):
+        self.polls += 1
+        best = self.best_fitness()
+        if best is None or self.polls <= self.warmup_polls:
+            return False
+        position = self.state_sensor.data['pos']
+        _, nearest = self.tree.query(position[0:2])
+        speeds = self.reachable_speeds(nearest, float(np.linalg.norm(self.state_sensor.data['vel'])))
+        bounds = self.fitness_bound(self.curvatures[nearest:], speeds)
+        worst = int(np.argmax(bounds))
+        reachable = max(self.current_fitness(), bounds[worst])
+        if reachable <= best:
+            self.reason = "Cannot beat the best fitness %.3f: at most %.3f with curvature ahead %.4f at %.1f m/s" % \
+                          (best, reachable, self.curvatures[nearest + worst], speeds[worst])
+            return True
+        return False
+
+
+class ScriptedSensor:
+    """Stands in for the State sensor and returns the scripted positions and velocities one after the other."""
+
+    def __init__(self, positions, velocities):
+        self.script = iter(zip(positions, velocities))
+        self.data = {}
+
+    def poll(self):
+        self.data['pos'], self.data['vel'] = next(self.script)
+
+
+class EarlyStopTest(unittest.TestCase):
+
+    # A straight road followed by a sharp turn
+    ROAD = [(x, 0.0, 0.0, 8.0) for x in range(0, 100, 5)] + [(100 + 10 * np.sin(a), 10 - 10 * np.cos(a), 0.0, 8.0)
+                                                              for a in np.linspace(0.3, np.pi / 2, 6)]
+
+    def fitness_bound(self, curvature, speed):
+        return curvature * speed ** 2 * 0.1
+
+    def test_curvature_of_a_circle(self):
+        angles = np.linspace(0, np.pi, 20)
+        circle = np.column_stack((20 * np.cos(angles), 20 * np.sin(angles)))
+
+        np.testing.assert_allclose(curvatures(circle), 1 / 20.0)
+
+    def test_stationary_vehicles_are_stopped(self):
+        sensor = ScriptedSensor([(0, 0, 0)] * 3 + [(1, 0, 0)] * 10, [(0, 0, 0)] * 13)
+        policy = StationaryPolicy(sensor, k=4)
+
+        stopped_at = None
+        for poll in range(13):
+            sensor.poll()
+            if policy.check():
+                stopped_at = poll
+                break
+
+        self.assertEqual(7, stopped_at)
+        self.assertIn("Stationary", policy.reason)
+
+    def test_simulations_stop_only_when_the_road_ahead_cannot_beat_the_best(self):
+        positions = [(x, 0.0, 0.0) for x in range(0, 100, 10)]
+        sensor = ScriptedSensor(positions, [(20.0, 0, 0)] * len(positions))
+        policy = RemainingCurvaturePolicy(self.ROAD, sensor, lambda: 0.5, lambda: 3.0, self.fitness_bound,
+                                          max_speed=5.0, warmup_polls=0)
+
+        # The sharp turn ahead could push the vehicle out of the lane
+        sensor.poll()
+        self.assertFalse(policy.check())
+        self.assertIsNone(policy.reason)
+
+        # But not if it cannot go faster than 5 m/s
+        sensor.data['vel'] = (5.0, 0, 0)
+        self.assertTrue(policy.check())
+        self.assertIn("Cannot beat the best fitness 3.000", policy.reason)
+
+    def test_hopeless_simulations_are_stopped_with_the_settings_of_automation_example_2(self):
+        # DEVIATION_PER_LATERAL_ACCELERATION, SPEED_LIMIT_KMH and MAX_ACCELERATION of automation_example_2
+        def plausible_distance(curvature, speed):
+            return 0.2 * speed ** 2 * curvature
+
+        # A straight road, a turn of minimum radius (10 m) to the right and another straight road
+        road = [(0.0, y, 0.0, 8.0) for y in range(0, 50, 5)] + \
+               [(10 - 10 * np.cos(a), 50 + 10 * np.sin(a), 0.0, 8.0) for a in np.linspace(0, np.pi / 2, 10)[1:]] + \
+               [(x, 60.0, 0.0, 8.0) for x in range(15, 65, 5)]
+        # The vehicle slowed down to 6 m/s and is halfway through the turn, 1.9 m is the best fitness so far
+        sensor = ScriptedSensor([(10 - 10 * np.cos(np.pi / 4), 50 + 10 * np.sin(np.pi / 4), 0.0), (0.0, 30.0, 0.0)],
+                                [(6.0, 0, 0), (70.0 / 3.6, 0, 0)])
+
+        def policy():
+            return RemainingCurvaturePolicy(road, sensor, lambda: 0.5, lambda: 1.9, plausible_distance,
+                                            max_speed=70.0 / 3.6, max_acceleration=3.0, warmup_polls=0)
+
+        sensor.poll()
+        self.assertTrue(policy().check())
+
+        # But a vehicle at the speed limit before the turn can still beat it
+        sensor.poll()
+        self.assertFalse(policy().check())
+
+    def test_vehicles_starting_from_rest_are_not_stopped(self):
+        # The vehicle is still at rest before a sharp turn, but it can reach 20 m/s
+        positions = [(0.0, 0.0, 0.0)] * 3 + [(x, 0.0, 0.0) for x in range(0, 90, 10)]
+        sensor = ScriptedSensor(positions, [(0.0, 0, 0)] * 3 + [(x / 5.0, 0, 0) for x in range(0, 90, 10)])
+        policy = RemainingCurvaturePolicy(self.ROAD, sensor, lambda: 0.0, lambda: 3.0, self.fitness_bound,
+                                          max_speed=20.0, warmup_polls=0)
+
+        for _ in positions:
+            sensor.poll()
+            self.assertFalse(policy.check())
+
+    def test_nothing_is_stopped_during_the_warmup(self):
+        sensor = ScriptedSensor([(0.0, 0.0, 0.0)] * 4, [(0.0, 0, 0)] * 4)
+        policy = RemainingCurvaturePolicy(self.ROAD, sensor, lambda: 0.0, lambda: 3.0, self.fitness_bound,
+                                          max_speed=1.0, warmup_polls=3)
+
+        verdicts = []
+        for _ in range(4):
+            sensor.poll()
+            verdicts.append(policy.check())
+
+        self.assertEqual([False, False, False, True], verdicts)
+
+    def test_combined_policies_take_the_reason_of_the_first_that_stops(self):
+        sensor = ScriptedSensor([(0, 0, 0)] * 3, [(0, 0, 0)] * 3)
+        early_stop = EarlyStop(RemainingCurvaturePolicy(self.ROAD, sensor, lambda: 0.0, lambda: None,
+                                                        self.fitness_bound, max_speed=20.0),
+                               StationaryPolicy(sensor, k=2))
+
+        verdicts = []
+        for _ in range(3):
+            sensor.poll()
+            verdicts.append(early_stop.check())
+
+        self.assertEqual([False, False, True], verdicts)
+        self.assertIn("Stationary", early_stop.reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+# Remember the fitness of the individuals that have been already evaluated
+#
+# Mutation often produces individuals that have been already evaluated, and evaluating them again costs a full
+# simulation. FitnessCache stores the results of the evaluations in a SQLite database, keyed by a canonical hash
+# of the individuals, so they survive across search runs. The cache has a bounded size: the least recently used
+# results are evicted first. Results that do not tell the actual fitness of the individual (e.g., simulations that
+# timed out or stopped early) must not be cached, or the individual would never be evaluated again: callers tell
+# which results can be cached with cacheable(result).
+#
+# Run this module to test it
+#   python -m unittest fitness_cache
+import hashlib
+import json
+import numbers
+import os
+import sqlite3
+import tempfile
+import unittest
+from threading import Lock
+
+# Individuals that differ less than this (e.g., in the position of the nodes) are the same individual
+DEFAULT_NDIGITS = 3
+
+
+def canonical_form(value, ndigits=DEFAULT_NDIGITS):
+    """Converts the individual into plain lists, dicts with sorted keys and numbers rounded to ndigits."""
+    if isinstance(value, dict):
+        return {str(k): canonical_form(value[k], ndigits) for k in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [canonical_form(v, ndigits) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    # NumPy numbers (e.g., the ones generated by numpy.random) are numbers as well. Integers are floats too,
+    # so 10 and 10.0 are the same
+    if isinstance(value, numbers.Real):
+        # Avoid -0.0 and 0.0 being different
+        return round(float(value), ndigits) + 0.0
+    if hasattr(value, 'tolist'):
+        return canonical_form(value.tolist(), ndigits)
+    raise TypeError("Cannot hash individuals that contain %s" % type(value).__name__)
+
+
+def canonical_hash(individual, ndigits=DEFAULT_NDIGITS):
+    """Individuals with the same canonical form have the same hash."""
+    encoded = json.dumps(canonical_form(individual, ndigits), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+class FitnessCache:
+    """
+        Bounded LRU cache of the results of the evaluations. Results must be JSON serializable, and tuples
+        are returned as lists.
+
+        If path is None, the cache lives in memory only, otherwise it is stored in that SQLite file.
+
+        If cacheable is given, only the results for which cacheable(result) is True are stored, and the other ones
+        found in the cache (e.g., stored by previous runs) are ignored.
+    """
+
+    def __init__(self, path=None, max_size=10000, ndigits=DEFAULT_NDIGITS, cacheable=None):
+        assert max_size > 0, "The cache must hold at least one result"
+        self.path = path
+        self.max_size = max_size
+        self.ndigits = ndigits
+        self.cacheable = cacheable if cacheable is not None else (lambda result: True)
+        self.hits, self.misses = 0, 0
+        self.lock = Lock()
+        # Results can be stored from the threads that run the experiments
+        self.connection = sqlite3.connect(path if path is not None else ':memory:', check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS fitness ("
+                                    "key TEXT PRIMARY KEY, result TEXT NOT NULL, last_used INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS fitness_last_used ON fitness (last_used)")
+        # Continue the logical clock of the previous runs
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM fitness").fetchone()[0]
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def key(self, individual):
+        return canonical_hash(individual, self.ndigits)
+
+    def get(self, individual, default=None):
+        """Returns the result of the individual, or default if it was never evaluated (or has been evicted)."""
+        key = self.key(individual)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT result FROM fitness WHERE key = ?", (key,)).fetchone()
+            result = json.loads(row[0]) if row is not None else None
+            if row is None or not self.cacheable(result):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.connection.execute("UPDATE fitness SET last_used = ? WHERE key = ?", (self._tick(), key))
+            return result
+
+    def put(self, individual, result):
+        """Stores the result of the individual, if it is cacheable, and evicts the least recently used results if
+        needed. Returns whether the result has been stored."""
+        if not self.cacheable(result):
+            return False
+        key = self.key(individual)
+        encoded = json.dumps(result)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO fitness (key, result, last_used) VALUES (?, ?, ?)",
+                                    (key, encoded, self._tick()))
+            self.connection.execute("DELETE FROM fitness WHERE key IN ("
+                                    "SELECT key FROM fitness ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                    (self.max_size,))
+        return True
+
+    def evaluate(self, function, individual):
+        """Returns the cached result of the individual, or evaluates it with function and stores its result."""
+        return self.map(function, [individual])[0]
+
+    def map(self, function, individuals, map_function=None):
+        """
+            Like map_function(function, individuals), but evaluates only the individuals that are not in the
+            cache, each one only once. map_function must return a list (e.g., SimulatorPool.map).
+        """
+        individuals = list(individuals)
+        results = [None] * len(individuals)
+        # Individuals to evaluate, and the positions of their duplicates
+        missing = {}
+        for index, individual in enumerate(individuals):
+            key = self.key(individual)
+            if key in missing:
+                missing[key][1].append(index)
+                continue
+            cached = self.get(individual, default=self)
+            if cached is self:
+                missing[key] = (individual, [index])
+            else:
+                results[index] = cached
+
+        to_evaluate = [individual for individual, _ in missing.values()]
+        if to_evaluate:
+            if map_function is None:
+                evaluated = [function(individual) for individual in to_evaluate]
+            else:
+                evaluated = map_function(function, to_evaluate)
+            for (individual, indices), result in zip(missing.values(), evaluated):
+                self.put(individual, result)
+                # Return the results in the same form the cache returns them
+                result = json.loads(json.dumps(result))
+                for index in indices:
+                    results[index] = result
+        return results
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM fitness").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __str__(self):
+        return "hits: %d, misses: %d" % (self.hits, self.misses)
+
+
+class FitnessCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.evaluated = []
+
+    def fitness(self, individual):
+        self.evaluated.append(individual)
+        return ["Pass", sum(node['x'] for node in individual)]
+
+    def test_the_canonical_hash_ignores_key_order_and_tiny_differences(self):
+        self.assertEqual(canonical_hash([{'x': 1.0, 'y': 2}]), canonical_hash([{'y': 2.0, 'x': 1.0000001}]))
+        self.assertNotEqual(canonical_hash([{'x': 1.0, 'y': 2}]), canonical_hash([{'x': 1.1, 'y': 2}]))
+
+    def test_individuals_are_evaluated_once(self):
+        cache = FitnessCache()
+        population = [[{'x': 1.0}], [{'x': 2.0}], [{'x': 1.0}]]
+
+        self.assertEqual([["Pass", 1.0], ["Pass", 2.0], ["Pass", 1.0]], cache.map(self.fitness, population))
+        self.assertEqual([["Pass", 1.0]], cache.map(self.fitness, population[0:1]))
+        self.assertEqual(2, len(self.evaluated))
+
+    def test_results_that_are_not_cacheable_are_evaluated_again(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'fitness.sqlite')
+            # A previous run cached everything, including the results of the simulations that timed out
+            cache = FitnessCache(path)
+            cache.put([{'x': 1.0}], ["Error", -1.0])
+            cache.close()
+
+            cache = FitnessCache(path, cacheable=lambda result: result[0] in ("Pass", "Fail"))
+            self.assertEqual([["Pass", 1.0]], cache.map(self.fitness, [[{'x': 1.0}]]))
+            self.assertFalse(cache.put([{'x': 2.0}], ["Stopped", 0.5]))
+            self.assertIsNone(cache.get([{'x': 2.0}]))
+            cache.close()
+
+        self.assertEqual(1, len(self.evaluated))
+
+    def test_least_recently_used_results_are_evicted(self):
+        cache = FitnessCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_results_survive_across_runs(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'fitness.sqlite')
+            cache = FitnessCache(path)
+            cache.evaluate(self.fitness, [{'x': 1.0}])
+            cache.close()
+
+            cache = FitnessCache(path)
+            self.assertEqual(["Pass", 1.0], cache.evaluate(self.fitness, [{'x': 1.0}]))
+            cache.close()
+
+        self.assertEqual(1, len(self.evaluated))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+# Store the images of the cameras in the background, while the simulation goes on
+#
+# Converting and writing the images of each frame inside the simulation loop stalls the simulation until the disk
+# is done. ImageSink queues the frames instead, and a writer thread converts them and appends them to the archive of
+# the run: for each camera, compressed chunks of frames (.npz) with the ids of their frames, and optionally a JPEG
+# preview every few frames.
+#
+#   <folder>/<camera>/chunk_00000.npz   frames (n, height, width, 3), frame_ids (n,)
+#   <folder>/<camera>/<frame id>.jpeg   previews
+#
+# The queue is bounded. When the disk falls behind and the queue is full, the sink either blocks the simulation
+# until there is room (backpressure, the default) or drops the frame (drop_frames=True).
+#
+# Run this module to test it
+#   python -m unittest image_sink
+import os
+import tempfile
+import unittest
+from queue import Queue, Full
+from threading import Thread, Event
+
+import numpy as np
+from PIL import Image
+
+# Tells the writer that there are no more frames
+_STOP = object()
+
+
+class ImageSink:
+
+    def __init__(self, folder, max_queued=32, drop_frames=False, chunk_size=16, preview_every=None):
+        self.folder = folder
+        self.drop_frames = drop_frames
+        self.chunk_size = chunk_size
+        self.preview_every = preview_every
+        self.queue = Queue(maxsize=max_queued)
+        self.written, self.dropped = 0, 0
+        self.error = None
+        # For each camera, the frames not yet written and how many chunks have been written
+        self.pending = {}
+        self.chunks = {}
+        os.makedirs(folder, exist_ok=True)
+        self.writer = Thread(target=self._write_frames, daemon=True)
+        self.writer.start()
+
+    def submit(self, camera, frame_id, image):
+        """
+            Queues the image (a PIL image or an array) of the camera. Returns False if the frame has been dropped
+            because the queue is full.
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.drop_frames:
+            self.queue.put((camera, frame_id, image))
+            return True
+        try:
+            self.queue.put_nowait((camera, frame_id, image))
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def _write_frames(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            if self.error is not None:
+                # Keep draining the queue, so the simulation is not blocked
+                continue
+            try:
+                self._add_frame(*item)
+            except Exception as e:
+                self.error = e
+        try:
+            for camera in list(self.pending):
+                self._write_chunk(camera)
+        except Exception as e:
+            self.error = e
+
+    def _add_frame(self, camera, frame_id, image):
+        array = np.asarray(image.convert('RGB')) if isinstance(image, Image.Image) else np.asarray(image)
+        frames = self.pending.setdefault(camera, [])
+        frames.append((frame_id, array))
+        if self.preview_every is not None and frame_id % self.preview_every == 0:
+            os.makedirs(os.path.join(self.folder, camera), exist_ok=True)
+            Image.fromarray(array).save(os.path.join(self.folder, camera, "%d.jpeg" % frame_id))
+        if len(frames) == self.chunk_size:
+            self._write_chunk(camera)
+
+    def _write_chunk(self, camera):
+        frames = self.pending.pop(camera, [])
+        if not frames:
+            return
+        chunk = self.chunks.get(camera, 0)
+        os.makedirs(os.path.join(self.folder, camera), exist_ok=True)
+        np.savez_compressed(os.path.join(self.folder, camera, 'chunk_%05d.npz' % chunk),
+                            frames=np.stack([array for _, array in frames]),
+                            frame_ids=np.array([frame_id for frame_id, _ in frames]))
+        self.chunks[camera] = chunk + 1
+        self.written += len(frames)
+
+    def close(self):
+        """Waits until all the queued frames are written."""
+        self.queue.put(_STOP)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return "written: %d, dropped: %d" % (self.written, self.dropped)
+
+
+def load_frames(folder, camera):
+    """Returns the ids of the frames of the camera, and the frames as an (n, height, width, 3) array."""
+    folder = os.path.join(folder, camera)
+    chunks = sorted(name for name in os.listdir(folder) if name.endswith('.npz'))
+    frame_ids, frames = [], []
+    for chunk in chunks:
+        with np.load(os.path.join(folder, chunk)) as data:
+            frame_ids.append(data['frame_ids'])
+            frames.append(data['frames'])
+    return np.concatenate(frame_ids), np.concatenate(frames)
+
+
+class SlowSink(ImageSink):
+    """Does not write anything until it is allowed to."""
+
+    def __init__(self, *args, **kwargs):
+        self.allowed = Event()
+        super().__init__(*args, **kwargs)
+
+    def _add_frame(self, *args):
+        self.allowed.wait()
+        super()._add_frame(*args)
+
+
+class ImageSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def frame(self, i):
+        return np.full((8, 8, 3), i, dtype=np.uint8)
+
+    def test_frames_are_written_in_chunks_per_camera(self):
+        with ImageSink(self.folder.name, chunk_size=4, preview_every=5) as sink:
+            for i in range(10):
+                sink.submit('ego_camera', i, self.frame(i))
+                sink.submit('bird_view', i, Image.fromarray(self.frame(100 + i)).convert('RGBA'))
+
+        frame_ids, frames = load_frames(self.folder.name, 'ego_camera')
+        np.testing.assert_array_equal(np.arange(10), frame_ids)
+        np.testing.assert_array_equal(np.arange(10), frames[:, 0, 0, 0])
+        _, frames = load_frames(self.folder.name, 'bird_view')
+        self.assertEqual((10, 8, 8, 3), frames.shape)
+        self.assertEqual(3, len([name for name in os.listdir(os.path.join(self.folder.name, 'bird_view'))
+                                 if name.endswith('.npz')]))
+        self.assertTrue(os.path.exists(os.path.join(self.folder.name, 'bird_view', '5.jpeg')))
+        self.assertEqual(20, sink.written)
+
+    def test_frames_are_dropped_when_the_queue_is_full(self):
+        sink = SlowSink(self.folder.name, max_queued=2, drop_frames=True)
+        accepted = [i for i in range(10) if sink.submit('camera', i, self.frame(i))]
+        sink.allowed.set()
+        sink.close()
+
+        self.assertLess(len(accepted), 10)
+        self.assertEqual(10 - len(accepted), sink.dropped)
+        np.testing.assert_array_equal(accepted, load_frames(self.folder.name, 'camera')[0])
+
+    def test_the_simulation_waits_when_the_queue_is_full(self):
+        sink = SlowSink(self.folder.name, max_queued=2)
+        submitter = Thread(target=lambda: [sink.submit('camera', i, self.frame(i)) for i in range(10)])
+        submitter.start()
+        submitter.join(0.2)
+        self.assertTrue(submitter.is_alive())
+
+        sink.allowed.set()
+        submitter.join()
+        sink.close()
+        self.assertEqual(0, sink.dropped)
+        np.testing.assert_array_equal(np.arange(10), load_frames(self.folder.name, 'camera')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
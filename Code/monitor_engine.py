@@ -0,0 +1,169 @@
+# Runtime monitoring driven by the simulation steps
+#
+# Instead of waiting a fixed (wall-clock) time between two checks of the oracles, MonitorEngine checks them right
+# after each sensor update, that is, after the simulation advanced by some steps. So, oracles react within the
+# given number of steps, whatever the speed of the simulation.
+#
+# Verdicts are published as soon as the oracles trigger, to a callback and/or to a queue (e.g., to monitor the
+# simulation from another thread).
+#
+# Run this module to test it against scripted sensor streams
+#   python -m unittest monitor_engine
+import unittest
+from collections import namedtuple
+from queue import Queue
+
+from test_oracles import TargetAreaOracle, DamagedOracle
+
+# The oracle that triggered, after how many simulation steps, and whether this ends the test
+MonitorVerdict = namedtuple('MonitorVerdict', ['oracle', 'steps', 'terminal'])
+
+
+class MonitorEngine:
+    """
+        Checks the registered oracles after each update of the sensors of the vehicles. Oracles are objects with a
+        check() method that returns True when they trigger, like the ones in test_oracles.
+    """
+
+    def __init__(self, vehicles, callback=None, queue=None):
+        self.vehicles = list(vehicles)
+        self.callback = callback
+        self.queue = queue
+        self.oracles = []
+        self.steps = 0
+
+    def register(self, name, oracle, terminal=True):
+        """Registers the oracle. When terminal oracles trigger, run stops."""
+        self.oracles.append((name, oracle, terminal))
+        return self
+
+    def _publish(self, verdict):
+        if self.callback is not None:
+            self.callback(verdict)
+        if self.queue is not None:
+            self.queue.put(verdict)
+
+    def evaluate(self):
+        """Checks all the oracles against the current sensor data, and publishes and returns the verdicts of the
+        ones that triggered."""
+        verdicts = []
+        for name, oracle, terminal in self.oracles:
+            if oracle.check():
+                verdict = MonitorVerdict(name, self.steps, terminal)
+                self._publish(verdict)
+                verdicts.append(verdict)
+        return verdicts
+
+    def update(self):
+        """Polls the sensors of the vehicles and checks the oracles."""
+        for vehicle in self.vehicles:
+            vehicle.poll_sensors()
+        return self.evaluate()
+
+    def step(self, bng, steps):
+        """Advances the (paused) simulation by the given steps, then polls the sensors and checks the oracles."""
+        bng.step(steps)
+        self.steps += steps
+        return self.update()
+
+    def run(self, bng, steps, max_steps):
+        """
+            Advances the simulation steps at a time, until a terminal oracle triggers or max_steps are done.
+            Returns the verdict of the terminal oracle, or None if the simulation timed out.
+        """
+        while self.steps < max_steps:
+            for verdict in self.step(bng, steps):
+                if verdict.terminal:
+                    return verdict
+        return None
+
+
+class ScriptedSimulation:
+    """
+        Stands in for BeamNGpy: frames[i] holds the data of the sensors (by name) after i steps of the simulation.
+        After the last frame, the simulation stays in the last frame.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.steps = 0
+
+    def step(self, steps):
+        self.steps += steps
+
+    def frame(self):
+        return self.frames[min(self.steps, len(self.frames) - 1)]
+
+
+class ScriptedVehicle:
+    """Stands in for a Vehicle: polling its sensors returns the current frame of the scripted simulation."""
+
+    def __init__(self, simulation, sensors):
+        self.simulation = simulation
+        self.sensors = sensors
+        self.polls = 0
+
+    def poll_sensors(self):
+        self.polls += 1
+        for name, sensor in self.sensors.items():
+            sensor.data = dict(self.simulation.frame()[name])
+
+
+class ScriptedSensor:
+
+    def __init__(self):
+        self.data = {}
+
+
+class MonitorEngineTest(unittest.TestCase):
+
+    def drive(self, n_steps, crash_at=None):
+        """Frames of a car that drives along the x axis at 0.5 m per step and stops at x = 50, and possibly crashes
+        at some step."""
+        return [{'state': {'pos': (min(0.5 * i, 50.0), 0.0, 0.0)},
+                 'damage': {'part_damage': {'bumper': 1.0} if crash_at is not None and i >= crash_at else {}}}
+                for i in range(n_steps)]
+
+    def setup_engine(self, frames, **kwargs):
+        simulation = ScriptedSimulation(frames)
+        state, damage = ScriptedSensor(), ScriptedSensor()
+        vehicle = ScriptedVehicle(simulation, {'state': state, 'damage': damage})
+        engine = MonitorEngine([vehicle], **kwargs)
+        engine.register('damage', DamagedOracle(damage))
+        engine.register('target', TargetAreaOracle((50.0, 0.0, 0.0), 1.0, state))
+        return simulation, vehicle, engine
+
+    def test_verdicts_come_within_one_step_size(self):
+        for steps in (1, 10, 30):
+            simulation, _, engine = self.setup_engine(self.drive(300))
+
+            verdict = engine.run(simulation, steps, max_steps=300)
+
+            # The car is within 1 meter from the target after 99 steps
+            self.assertEqual('target', verdict.oracle)
+            self.assertTrue(99 <= verdict.steps < 99 + steps)
+
+    def test_terminal_verdicts_stop_the_simulation_and_are_published(self):
+        published = []
+        verdicts = Queue()
+        simulation, vehicle, engine = self.setup_engine(self.drive(300, crash_at=42), callback=published.append,
+                                                        queue=verdicts)
+
+        verdict = engine.run(simulation, 5, max_steps=300)
+
+        self.assertEqual(MonitorVerdict('damage', 45, True), verdict)
+        self.assertEqual([verdict], published)
+        self.assertEqual(verdict, verdicts.get_nowait())
+        self.assertEqual(9, vehicle.polls)
+
+    def test_non_terminal_oracles_do_not_stop_the_simulation(self):
+        published = []
+        simulation, _, engine = self.setup_engine(self.drive(100), callback=published.append)
+        engine.oracles = [(name, oracle, False) for name, oracle, _ in engine.oracles]
+
+        self.assertIsNone(engine.run(simulation, 10, max_steps=110))
+        self.assertEqual(['target', 'target'], [verdict.oracle for verdict in published])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# Multi-objective selection (NSGA-II): non-dominated sorting and crowding distance
+#
+# Objectives are (n, m) arrays with the m objectives of n individuals, all to maximize. Individuals are ranked by
+# their Pareto front (0 is the best front), and within a front by their crowding distance, which favours the
+# individuals in the less crowded regions of the objective space, hence diverse ones.
+#
+# Run this module to test it
+#   python -m unittest multi_objective
+import unittest
+
+import numpy as np
+
+# How many individuals are compared against all the others at once, to bound the memory of the dominance matrix
+DOMINANCE_CHUNK_SIZE = 1024
+
+
+def dominance_matrix(objectives):
+    """Returns the (n, n) boolean matrix D where D[i, j] is True if individual i dominates individual j, that is, if
+    it is at least as good in all the objectives and strictly better in at least one."""
+    objectives = np.asarray(objectives, dtype=float)
+    n = len(objectives)
+    dominates = np.empty((n, n), dtype=bool)
+    for start in range(0, n, DOMINANCE_CHUNK_SIZE):
+        chunk = objectives[start:start + DOMINANCE_CHUNK_SIZE]
+        # One objective at a time, so no (chunk, n, m) arrays are created
+        at_least_as_good = np.ones((len(chunk), n), dtype=bool)
+        better = np.zeros((len(chunk), n), dtype=bool)
+        for k in range(objectives.shape[1]):
+            at_least_as_good &= chunk[:, k, np.newaxis] >= objectives[np.newaxis, :, k]
+            better |= chunk[:, k, np.newaxis] > objectives[np.newaxis, :, k]
+        dominates[start:start + DOMINANCE_CHUNK_SIZE] = at_least_as_good & better
+    return dominates
+
+
+def non_dominated_sort(objectives):
+    """Returns the front (rank) of each individual: O(m n^2), vectorized. Individuals of front 0 are not dominated by
+    any other individual, individuals of front 1 only by the ones of front 0, and so on."""
+    dominates = dominance_matrix(objectives)
+    # How many individuals not yet ranked dominate each individual
+    dominated_by = dominates.sum(axis=0)
+    ranks = np.full(len(dominated_by), -1)
+    front = np.flatnonzero(dominated_by == 0)
+    rank = 0
+    while len(front) > 0:
+        ranks[front] = rank
+        dominated_by -= dominates[front].sum(axis=0)
+        # Individuals already ranked must not be picked again
+        dominated_by[front] = -1
+        front = np.flatnonzero(dominated_by == 0)
+        rank += 1
+    return ranks
+
+
+def crowding_distance(objectives, ranks):
+    """Returns the crowding distance of each individual within its front. The extremes of the fronts have an
+    infinite distance, so they are always preferred."""
+    objectives = np.asarray(objectives, dtype=float)
+    distances = np.zeros(len(objectives))
+    for rank in np.unique(ranks):
+        members = np.flatnonzero(ranks == rank)
+        if len(members) <= 2:
+            distances[members] = np.inf
+            continue
+        front = objectives[members]
+        order = np.argsort(front, axis=0, kind='stable')
+        for k in range(front.shape[1]):
+            values = front[order[:, k], k]
+            span = values[-1] - values[0]
+            distances[members[order[[0, -1], k]]] = np.inf
+            if span > 0 and np.isfinite(span):
+                distances[members[order[1:-1, k]]] += (values[2:] - values[:-2]) / span
+    return distances
+
+
+def select_survivors(objectives, n):
+    """Returns the indices of the n best individuals: lower front first, then higher crowding distance."""
+    ranks = non_dominated_sort(objectives)
+    distances = crowding_distance(objectives, ranks)
+    return np.lexsort((-distances, ranks))[0:n]
+
+
+def crowded_tournament(ranks, distances, n, random=np.random):
+    """Returns the indices of the winners of n binary tournaments: the lower front wins, then the higher crowding
+    distance."""
+    contestants = random.randint(0, len(ranks), (n, 2))
+    a, b = contestants[:, 0], contestants[:, 1]
+    a_wins = (ranks[a] < ranks[b]) | ((ranks[a] == ranks[b]) & (distances[a] >= distances[b]))
+    return np.where(a_wins, a, b)
+
+
+class MultiObjectiveTest(unittest.TestCase):
+
+    def naive_ranks(self, objectives):
+        remaining, ranks, rank = set(range(len(objectives))), np.full(len(objectives), -1), 0
+        while remaining:
+            front = [i for i in remaining if not any(
+                all(objectives[j] >= objectives[i]) and any(objectives[j] > objectives[i]) for j in remaining)]
+            ranks[front] = rank
+            remaining -= set(front)
+            rank += 1
+        return ranks
+
+    def test_non_dominated_sort_matches_the_definition(self):
+        objectives = np.random.RandomState(0).randint(0, 10, (300, 3)).astype(float)
+
+        np.testing.assert_array_equal(self.naive_ranks(objectives), non_dominated_sort(objectives))
+
+    def test_fronts(self):
+        objectives = [(1, 5), (5, 1), (3, 3), (2, 2), (1, 1), (3, 3)]
+
+        np.testing.assert_array_equal([0, 0, 0, 1, 2, 0], non_dominated_sort(objectives))
+
+    def test_crowding_distance_prefers_extremes_and_isolated_individuals(self):
+        objectives = np.array([(0, 10), (1, 9), (2, 8), (8, 2), (10, 0)], dtype=float)
+        distances = crowding_distance(objectives, np.zeros(5, dtype=int))
+
+        self.assertTrue(np.isinf(distances[0]) and np.isinf(distances[4]))
+        # (8, 2) is farther from its neighbours than (1, 9)
+        self.assertGreater(distances[3], distances[1])
+
+    def test_survivors_come_from_the_best_fronts(self):
+        objectives = [(1, 5), (5, 1), (3, 3), (2, 2), (1, 1)]
+
+        self.assertEqual({0, 1, 2}, set(select_survivors(objectives, 3).tolist()))
+        self.assertEqual(3, select_survivors(objectives, 4)[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+# Populations of roads encoded as arrays, with vectorized genetic operators
+#
+# Individuals of automation_example_2 are lists of nested dicts, one per road segment. Selecting, copying and
+# mutating them one at a time in Python is fine for a handful of individuals, but with large populations (e.g.,
+# screened by the surrogate model) the bookkeeping becomes the bottleneck. RoadPopulation stores n individuals made
+# of m segments as (n, m) arrays, and the operators below work on the whole population at once.
+#
+# Run this module to test it
+#   python -m unittest road_population
+import unittest
+from collections import namedtuple
+
+import numpy as np
+
+STRAIGHT, TURN = 0, 1
+
+SegmentBounds = namedtuple('SegmentBounds', ['min_length', 'max_length', 'min_radius', 'max_radius',
+                                             'min_angle', 'max_angle'])
+
+
+class RoadPopulation:
+    """
+        n individuals of m segments each: the type (STRAIGHT or TURN) of the segments, and their length (straight
+        segments), angle and radius (turns). Unused attributes are 0.
+    """
+
+    def __init__(self, types, lengths, angles, radii):
+        assert types.shape == lengths.shape == angles.shape == radii.shape and types.ndim == 2
+        self.types = types
+        self.lengths = lengths
+        self.angles = angles
+        self.radii = radii
+
+    @classmethod
+    def from_individuals(cls, individuals):
+        """Encodes individuals made of the same number of road segments, each with one trajectory segment."""
+        n, m = len(individuals), len(individuals[0]) if len(individuals) > 0 else 0
+        types = np.zeros((n, m), dtype=np.int8)
+        lengths, angles, radii = np.zeros((n, m)), np.zeros((n, m)), np.zeros((n, m))
+        for i, individual in enumerate(individuals):
+            assert len(individual) == m, "All the individuals must have the same number of segments"
+            for j, road_segment in enumerate(individual):
+                s, = road_segment['trajectory_segments']
+                if s['type'] == 'straight':
+                    lengths[i, j] = s['length']
+                else:
+                    types[i, j] = TURN
+                    angles[i, j], radii[i, j] = s['angle'], s['radius']
+        return cls(types, lengths, angles, radii)
+
+    def to_individuals(self):
+        individuals = []
+        for types, lengths, angles, radii in zip(self.types.tolist(), self.lengths.tolist(), self.angles.tolist(),
+                                                 self.radii.tolist()):
+            individual = []
+            for segment_type, length, angle, radius in zip(types, lengths, angles, radii):
+                if segment_type == STRAIGHT:
+                    s = {'type': 'straight', 'length': length}
+                else:
+                    s = {'type': 'turn', 'angle': angle, 'radius': radius}
+                individual.append({'trajectory_segments': [s]})
+            individuals.append(individual)
+        return individuals
+
+    def __len__(self):
+        return len(self.types)
+
+    def take(self, indices):
+        """Returns a new population with (copies of) the given individuals."""
+        return RoadPopulation(self.types[indices], self.lengths[indices], self.angles[indices], self.radii[indices])
+
+    def features(self):
+        """Same features as surrogate.road_features, for all the individuals: a (n, 4) array."""
+        is_turn = self.types == TURN
+        angles = np.radians(np.abs(self.angles))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(is_turn, angles / self.radii, 0.0)
+        total_curvature = np.where(is_turn, angles, 0.0).sum(axis=1)
+        length = np.where(is_turn, angles * self.radii, self.lengths).sum(axis=1)
+        # Direction changes: consecutive turns (ignoring the straight segments in between) with opposite sides
+        sides = np.where(is_turn, np.sign(self.angles), 0.0)
+        # Carry the side of the last turn over the straight segments
+        last_turn = np.maximum.accumulate(np.where(is_turn, np.arange(sides.shape[1]), -1), axis=1)
+        carried = np.where(last_turn >= 0, np.take_along_axis(sides, np.maximum(last_turn, 0), axis=1), 0.0)
+        changes = (is_turn[:, 1:] & (carried[:, :-1] != 0) & (sides[:, 1:] != carried[:, :-1])).sum(axis=1)
+        return np.column_stack((total_curvature, ratios.max(axis=1, initial=0.0), length, changes))
+
+
+def random_segments(shape, bounds, random):
+    """Random segments like automation_example_2.generate_random_road_segment: 30% straight, then left and right
+    turns are equally likely."""
+    types = np.where(random.rand(*shape) <= 0.3, STRAIGHT, TURN).astype(np.int8)
+    is_turn = types == TURN
+    lengths = np.where(is_turn, 0, random.randint(bounds.min_length, bounds.max_length, shape))
+    signs = np.where(random.rand(*shape) <= 0.5, -1, 1)
+    angles = np.where(is_turn, signs * random.randint(bounds.min_angle, bounds.max_angle, shape), 0)
+    radii = np.where(is_turn, random.randint(bounds.min_radius, bounds.max_radius, shape), 0)
+    return RoadPopulation(types, lengths.astype(float), angles.astype(float), radii.astype(float))
+
+
+def tournament_selection(scores, n, k=3, random=np.random):
+    """Returns the indices of n winners of tournaments among k random individuals (the highest score wins)."""
+    scores = np.asarray(scores)
+    contestants = random.randint(0, len(scores), (n, k))
+    return contestants[np.arange(n), np.argmax(scores[contestants], axis=1)]
+
+
+def mutate(population, bounds, random=np.random):
+    """
+        Returns the mutants of the population. Like automation_example_2.mutate, each segment mutates with
+        probability 1/m: half of the times it is replaced by a random segment, otherwise one of its attributes
+        changes (the length of straight segments, the angle or the radius of turns).
+    """
+    n, m = population.types.shape
+    mutated = random.rand(n, m) <= 1.0 / m
+    replaced = mutated & (random.rand(n, m) <= 0.5)
+    changed = mutated & ~replaced
+
+    new = random_segments((n, m), bounds, random)
+    is_turn = population.types == TURN
+    change_angle = random.rand(n, m) <= 0.5
+    new_angles = np.where(random.rand(n, m) <= 0.5, 1.0, -1.0) * random.randint(bounds.min_angle, bounds.max_angle,
+                                                                                  (n, m))
+    new_lengths = random.randint(bounds.min_length, bounds.max_length, (n, m))
+    new_radii = random.randint(bounds.min_radius, bounds.max_radius, (n, m))
+
+    lengths = np.where(changed & ~is_turn, new_lengths, population.lengths)
+    angles = np.where(changed & is_turn & change_angle, new_angles, population.angles)
+    radii = np.where(changed & is_turn & ~change_angle, new_radii, population.radii)
+
+    return RoadPopulation(np.where(replaced, new.types, population.types),
+                          np.where(replaced, new.lengths, lengths),
+                          np.where(replaced, new.angles, angles),
+                          np.where(replaced, new.radii, radii))
+
+
+def crossover(parents_a, parents_b, rate=1.0, random=np.random):
+    """
+        One-point crossover of the pairs of parents: with probability rate, the children take the segments of
+        parents_a before a random cut point and the ones of parents_b after it. Otherwise, they copy parents_a.
+    """
+    n, m = parents_a.types.shape
+    cuts = np.where(random.rand(n) <= rate, random.randint(1, max(m, 2), n), m)
+    from_b = np.arange(m)[np.newaxis, :] >= cuts[:, np.newaxis]
+    return RoadPopulation(*(np.where(from_b, b, a) for a, b in
+                            ((parents_a.types, parents_b.types), (parents_a.lengths, parents_b.lengths),
+                             (parents_a.angles, parents_b.angles), (parents_a.radii, parents_b.radii))))
+
+
+class RoadPopulationTest(unittest.TestCase):
+
+    BOUNDS = SegmentBounds(5, 50, 10, 50, 10, 90)
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+        self.population = random_segments((200, 9), self.BOUNDS, self.random)
+
+    def assert_within_bounds(self, population):
+        is_turn = population.types == TURN
+        self.assertTrue(np.all((population.lengths[~is_turn] >= 5) & (population.lengths[~is_turn] < 50)))
+        self.assertTrue(np.all((np.abs(population.angles[is_turn]) >= 10) & (np.abs(population.angles[is_turn]) < 90)))
+        self.assertTrue(np.all((population.radii[is_turn] >= 10) & (population.radii[is_turn] < 50)))
+
+    def test_individuals_round_trip(self):
+        individuals = self.population.to_individuals()
+        again = RoadPopulation.from_individuals(individuals)
+
+        self.assertEqual(individuals, again.to_individuals())
+
+    def test_features_match_the_surrogate_ones(self):
+        # Imported here, so the module does not depend on the surrogate
+        from surrogate import road_features
+
+        expected = np.array([road_features(individual) for individual in self.population.to_individuals()])
+
+        np.testing.assert_allclose(self.population.features(), expected)
+
+    def test_tournament_selection_picks_the_best_contestant(self):
+        scores = np.arange(10.0)
+        random = np.random.RandomState(1)
+        winners = tournament_selection(scores, 1000, k=3, random=random)
+
+        random = np.random.RandomState(1)
+        contestants = random.randint(0, 10, (1000, 3))
+        np.testing.assert_array_equal(contestants.max(axis=1), winners)
+
+    def test_mutants_stay_within_bounds_and_parents_do_not_change(self):
+        before = self.population.to_individuals()
+        mutants = mutate(self.population, self.BOUNDS, self.random)
+
+        self.assertEqual(before, self.population.to_individuals())
+        self.assertNotEqual(before, mutants.to_individuals())
+        self.assert_within_bounds(mutants)
+        # On average, one segment per individual mutates
+        changed = (mutants.types != self.population.types) | (mutants.lengths != self.population.lengths) | \
+                  (mutants.angles != self.population.angles) | (mutants.radii != self.population.radii)
+        self.assertLess(changed.sum(), 2 * len(self.population))
+
+    def test_crossover_takes_a_prefix_and_a_suffix(self):
+        a, b = self.population.take(np.arange(0, 100)), self.population.take(np.arange(100, 200))
+        children = crossover(a, b, random=self.random)
+
+        for child, parent_a, parent_b in zip(children.to_individuals(), a.to_individuals(), b.to_individuals()):
+            cut = next(j for j in range(len(child) + 1) if j == len(child) or child[j] != parent_a[j])
+            self.assertEqual(parent_b[cut:], child[cut:])
+
+
+if __name__ == '__main__':
+    unittest.main()
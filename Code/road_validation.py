@@ -0,0 +1,238 @@
+# Reject invalid roads before they reach the simulator
+#
+# ValidationPipeline runs a sequence of checks, from the cheapest to the most expensive one, and stops at the first
+# check that rejects the road. Each check keeps track of how many roads it checked and rejected, and of how much
+# time it took, so the pipeline can report which checks are worth running (and in which order).
+#
+# Run this module to test it
+#   python -m unittest road_validation
+import unittest
+from math import radians
+from timeit import default_timer as timer
+
+from shapely.geometry import Point
+
+from common import find_radius_and_center
+from test_oracles import RoadPolygon, lazy_property
+from trajectory_generator import generate_trajectory, generate_trajectories
+
+
+class RoadCandidate:
+    """
+        A road to validate. The individual is converted to the road nodes, and then to the RoadPolygon, only if
+        the checks need them, and at most once.
+    """
+
+    def __init__(self, individual, to_road_nodes):
+        self.individual = individual
+        self.to_road_nodes = to_road_nodes
+
+    @lazy_property
+    def road_nodes(self):
+        return self.to_road_nodes(self.individual)
+
+    @lazy_property
+    def road_polygon(self):
+        return RoadPolygon.from_nodes(self.road_nodes)
+
+
+class SegmentBoundsCheck:
+    """Checks that all the trajectory segments of the individual have their parameters within the bounds."""
+
+    name = "segment bounds"
+
+    def __init__(self, min_length, max_length, min_radius, max_radius, min_angle, max_angle):
+        self.min_length, self.max_length = min_length, max_length
+        self.min_radius, self.max_radius = min_radius, max_radius
+        self.min_angle, self.max_angle = min_angle, max_angle
+
+    def _is_valid_segment(self, s):
+        if s['type'] == 'straight':
+            return self.min_length <= s['length'] <= self.max_length
+        if s['type'] == 'turn':
+            return self.min_radius <= s['radius'] <= self.max_radius and \
+                   self.min_angle <= abs(s['angle']) <= self.max_angle
+        return False
+
+    def check(self, candidate):
+        return all(self._is_valid_segment(s)
+                   for road_segment in candidate.individual for s in road_segment['trajectory_segments'])
+
+
+class LengthAndMapBoundsCheck:
+    """
+        Checks that the road is not too long and that the whole road (including its width) lies within the map
+        bounds (min_x, min_y, max_x, max_y).
+    """
+
+    name = "length and map bounds"
+
+    def __init__(self, max_length, map_bounds):
+        self.max_length = max_length
+        self.map_bounds = map_bounds
+
+    def check(self, candidate):
+        length = 0.0
+        for road_segment in candidate.individual:
+            for s in road_segment['trajectory_segments']:
+                length += s['length'] if s['type'] == 'straight' else s['radius'] * radians(abs(s['angle']))
+        if length > self.max_length:
+            return False
+
+        min_x, min_y, max_x, max_y = self.map_bounds
+        for x, y, _, width in candidate.road_nodes:
+            half_width = width * 0.5
+            if x - half_width < min_x or x + half_width > max_x or y - half_width < min_y or y + half_width > max_y:
+                return False
+        return True
+
+
+class CurvatureCheck:
+    """Checks that the radius of the circle passing by any three consecutive road nodes is at least min_radius."""
+
+    name = "curvature"
+
+    def __init__(self, min_radius):
+        self.min_radius = min_radius
+
+    def check(self, candidate):
+        points = [Point(node[0], node[1]) for node in candidate.road_nodes]
+        for p1, p2, p3 in zip(points, points[1:], points[2:]):
+            radius, _ = find_radius_and_center(p1, p2, p3)
+            if radius < self.min_radius:
+                return False
+        return True
+
+
+class SelfIntersectionCheck:
+    """Checks that the road does not intersect with itself, using RoadPolygon.is_valid."""
+
+    name = "self intersection"
+
+    def check(self, candidate):
+        return candidate.road_polygon.is_valid()
+
+
+class ValidationPipeline:
+    """
+        Runs the checks in the given order and stops at the first one that rejects the road.
+        to_road_nodes converts the individuals into the (x, y, z, width) nodes of their road. If given,
+        to_batch_road_nodes converts many individuals at once (e.g., with trajectory_generator.generate_trajectories),
+        and it is used to validate whole populations.
+    """
+
+    def __init__(self, checks, to_road_nodes, to_batch_road_nodes=None):
+        self.checks = list(checks)
+        self.to_road_nodes = to_road_nodes
+        self.to_batch_road_nodes = to_batch_road_nodes
+        self.checked = {check.name: 0 for check in self.checks}
+        self.rejected = {check.name: 0 for check in self.checks}
+        self.elapsed = {check.name: 0.0 for check in self.checks}
+
+    def validate(self, individual):
+        """Returns None if the individual is valid, otherwise the name of the check that rejected it."""
+        return self._run_checks(RoadCandidate(individual, self.to_road_nodes))
+
+    def validate_all(self, individuals):
+        """Same as validate, for all the individuals. Their road nodes are generated in one batch."""
+        individuals = list(individuals)
+        if self.to_batch_road_nodes is None or not individuals:
+            return [self.validate(individual) for individual in individuals]
+        batch_road_nodes = self.to_batch_road_nodes(individuals)
+        return [self._run_checks(RoadCandidate(individual, lambda _, road_nodes=road_nodes: road_nodes))
+                for individual, road_nodes in zip(individuals, batch_road_nodes)]
+
+    def _run_checks(self, candidate):
+        for check in self.checks:
+            start = timer()
+            is_valid = check.check(candidate)
+            self.elapsed[check.name] += timer() - start
+            self.checked[check.name] += 1
+            if not is_valid:
+                self.rejected[check.name] += 1
+                return check.name
+        return None
+
+    def is_valid(self, individual):
+        return self.validate(individual) is None
+
+    def are_valid(self, individuals):
+        return [rejected_by is None for rejected_by in self.validate_all(individuals)]
+
+    def report(self):
+        lines = ["%25s %10s %10s %10s %12s" % ("check", "checked", "rejected", "rate", "time (ms)")]
+        for check in self.checks:
+            checked, rejected = self.checked[check.name], self.rejected[check.name]
+            rate = rejected / checked if checked > 0 else 0.0
+            lines.append("%25s %10d %10d %9.1f%% %12.3f" % (check.name, checked, rejected, rate * 100,
+                                                            self.elapsed[check.name] * 1000))
+        return "\n".join(lines)
+
+
+class ValidationPipelineTest(unittest.TestCase):
+
+    ROAD_WIDTH = 8.0
+
+    def road_nodes(self, individual):
+        return [(p[0], p[1], 0.0, self.ROAD_WIDTH) for p in
+                generate_trajectory(Point(0, 0), 0, individual, analytic=True)]
+
+    def batch_road_nodes(self, individuals):
+        self.batches += 1
+        return [[(p[0], p[1], 0.0, self.ROAD_WIDTH) for p in points.tolist()]
+                for points in generate_trajectories(Point(0, 0), 0, individuals)]
+
+    def pipeline(self):
+        self.batches = 0
+        return ValidationPipeline([
+            SegmentBoundsCheck(5, 50, 10, 50, 10, 360),
+            LengthAndMapBoundsCheck(500, (-200, -200, 200, 200)),
+            CurvatureCheck(self.ROAD_WIDTH),
+            SelfIntersectionCheck()
+        ], self.road_nodes, self.batch_road_nodes)
+
+    def road(self, *segments):
+        return [{'trajectory_segments': [s]} for s in segments]
+
+    def test_valid_road(self):
+        pipeline = self.pipeline()
+        road = self.road({'type': 'straight', 'length': 20}, {'type': 'turn', 'angle': 45, 'radius': 30})
+
+        self.assertIsNone(pipeline.validate(road))
+        self.assertEqual(1, pipeline.checked["self intersection"])
+
+    def test_each_check_rejects_its_roads_and_stops_the_pipeline(self):
+        pipeline = self.pipeline()
+        # Too short segment
+        self.assertEqual("segment bounds", pipeline.validate(self.road({'type': 'straight', 'length': 1})))
+        # Out of the map
+        too_far = self.road(*[{'type': 'straight', 'length': 50}] * 5)
+        self.assertEqual("length and map bounds", pipeline.validate(too_far))
+        # A loop, which crosses its beginning
+        loop = self.road({'type': 'straight', 'length': 20},
+                         *[{'type': 'turn', 'angle': 90, 'radius': 20}] * 3,
+                         {'type': 'straight', 'length': 40})
+        self.assertEqual("self intersection", pipeline.validate(loop))
+        self.assertEqual(3, pipeline.checked["segment bounds"])
+        self.assertEqual(2, pipeline.checked["length and map bounds"])
+        self.assertEqual(1, pipeline.checked["self intersection"])
+
+    def test_populations_are_validated_in_one_batch(self):
+        roads = [self.road({'type': 'straight', 'length': 20}, {'type': 'turn', 'angle': 45, 'radius': 30}),
+                 self.road(*[{'type': 'straight', 'length': 50}] * 5),
+                 self.road({'type': 'straight', 'length': 20}, *[{'type': 'turn', 'angle': 90, 'radius': 20}] * 3,
+                           {'type': 'straight', 'length': 40})]
+        pipeline = self.pipeline()
+
+        self.assertEqual([pipeline.validate(road) for road in roads], self.pipeline().validate_all(roads))
+        self.assertEqual(1, self.batches)
+        self.assertEqual([True, False, False], self.pipeline().are_valid(roads))
+
+    def test_sharp_turns_are_rejected(self):
+        pipeline = ValidationPipeline([CurvatureCheck(self.ROAD_WIDTH)], self.road_nodes)
+
+        self.assertEqual("curvature", pipeline.validate(self.road({'type': 'turn', 'angle': 90, 'radius': 5})))
+
+
+if __name__ == '__main__':
+    unittest.main()
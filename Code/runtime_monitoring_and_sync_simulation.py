@@ -12,6 +12,10 @@ from shapely.geometry import Point, LineString, Polygon
 from shapely.affinity import translate, rotate
 
 from time import sleep
+
+from monitor_engine import MonitorEngine
+from telemetry_recorder import TelemetryRecorder
+import test_oracles
 # Specify where BeamNG home and user are
 BNG_HOME = "C:\\BeamNG.tech.v0.21.3.0"
 BNG_USER = "C:\\BeamNG.tech_userpath"
@@ -38,45 +42,36 @@ class DamagedOracle():
         return len(self.damage_sensor.data['part_damage']) > 0
 
 
-def runtime_monitor(vehicle_id, target_position, radius):
-    bng = BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER)
-    bng = bng.open(launch=False, deploy=False)
+def channel_monitor(channel_name, target_position, radius):
+    """
+        Checks the oracles on the sensor data that the process driving the simulation shares through the channel, so
+        the monitor does not need its own connection (and sensors) to the simulator
+    """
+    # Shared memory needs Python 3.8
+    from sensor_channel import SensorChannel
+    channel = SensorChannel.attach(channel_name)
     try:
-        active_vehicles = bng.get_current_vehicles()
-        vehicle = active_vehicles[vehicle_id]
-        # Define the sensors
-        timer = Timer()
-        vehicle.attach_sensor('timer', timer)
-        # Get current position and velocity via State
-        state = State()
-        vehicle.attach_sensor('state', state)
-        target_position_reached = TargetAreaOracle(target_position, radius, state)
-        # Report damaged components via Damage
-        damage = Damage()
-        vehicle.attach_sensor('damage', damage)
-        has_crashed = DamagedOracle(damage)
-
-        # Make sure the bng client also connects to the vehicle VM
-        vehicle.connect(bng)
-
+        # Checking the samples in batches does not need the sensors
+        target_position_reached = test_oracles.TargetAreaOracle(target_position, radius, None)
+        has_crashed = test_oracles.DamagedOracle(None)
+        next_sample = 0
         while True:
-            sleep(1)
-            # Poll
-            vehicle.poll_sensors()
-            # Print
-            if has_crashed.check():
+            finished = channel.finished
+            samples, next_sample = channel.read_since(next_sample)
+            crashed = has_crashed.check_batch(samples['damaged_parts'], first_only=True)
+            reached = target_position_reached.check_batch(samples['pos'], first_only=True)
+            if crashed is not None and (reached is None or crashed <= reached):
                 print("Car has damaged components")
                 return (False, "Car has damaged components")
-
-            if target_position_reached.check():
+            if reached is not None:
                 print("Target Position Reached")
                 return (True, "Target Position Reached")
-
-    except Exception as e:
-        print("Exception insider runtime monitor", e)
+            if finished:
+                return (False, "Simulation ended before any oracle triggered")
+            if len(samples) == 0:
+                sleep(0.01)
     finally:
-        if bng:
-            bng.skt.close()
+        channel.close()
 
 
 class PassTestException(Exception):
@@ -84,6 +79,11 @@ class PassTestException(Exception):
 
 
 TIMEOUT = 30
+# Oracles are checked every STEPS_PER_CHECK simulation steps, at STEPS_PER_SECOND
+STEPS_PER_SECOND = 60
+STEPS_PER_CHECK = 6
+# Where the telemetry of the synchronous simulations is recorded
+TELEMETRY_FOLDER = 'telemetry'
 
 class RuntimeMonitoringTest(unittest.TestCase):
 
@@ -165,44 +165,65 @@ class RuntimeMonitoringTest(unittest.TestCase):
             # Add some detailed
             bng.add_debug_spheres([target_position], [radius], [(1, 1, 1, 0.2)])
 
+            bng.set_steps_per_second(STEPS_PER_SECOND)
+            bng.set_deterministic()
+
             self.scenario.make(bng)
             bng.load_scenario(self.scenario)
             bng.start_scenario()
-            for i in range(1,TIMEOUT):
-                # Wait
-                sleep(11)
-                # Poll
-                self.ego_vehicle.poll_sensors()
-                # Check Oracles
-                if damage_oracle.check():
-                    self.fail("Damaged Components")
-
-                if target_area_reached_oracle.check():
-                    print("Car reached target location")
-                    return
+            # Drive the simulation, so the oracles are checked as soon as the sensors are updated
+            bng.pause()
+
+            engine = MonitorEngine([self.ego_vehicle])
+            engine.register("Damaged Components", damage_oracle)
+            engine.register("Car reached target location", target_area_reached_oracle)
+
+            verdict = engine.run(bng, STEPS_PER_CHECK, max_steps=TIMEOUT * STEPS_PER_SECOND)
+            if verdict is None:
+                self.fail("Test did not finished within time")
+            if verdict.oracle == "Damaged Components":
+                self.fail(verdict.oracle)
+            print(verdict.oracle)
 
     def test_monitor_ego_car_main_from_another_process(self):
+        # Shared memory needs Python 3.8
+        from sensor_channel import SensorChannel
+
         lane_width = 4.0
         target_position = (60, 30, 0)
         radius = 2*lane_width+0.2
 
+        # The main process polls the sensors and shares their data with the monitor
+        timer = Timer()
+        self.ego_vehicle.attach_sensor('timer', timer)
+        state = State()
+        self.ego_vehicle.attach_sensor('state', state)
+        damage = Damage()
+        self.ego_vehicle.attach_sensor('damage', damage)
+
         try:
-            with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng:
+            with BeamNGpy('localhost', 64256, home=BNG_HOME, user=BNG_USER) as bng, SensorChannel.create() as channel:
+                bng.set_steps_per_second(STEPS_PER_SECOND)
+                bng.set_deterministic()
+
                 self.scenario.make(bng)
                 bng.load_scenario(self.scenario)
                 # Start the runtime monitor after the scenario starts
                 pool = Pool()
                 # We cannot use the callback here to trigger a test fail, because there are different threads involved
-                oracle_result = pool.apply_async(runtime_monitor,
-                                                 args=(self.ego_vehicle.vid, target_position, radius,))
+                oracle_result = pool.apply_async(channel_monitor, args=(channel.name, target_position, radius,))
                 # Do not accept more work
                 pool.close()
 
                 # Start the actual execution
                 bng.start_scenario()
+                bng.pause()
                 # Do other stuff, but remember to check if the any of the oracles triggered in the meanwhile
-                for i in range(1,TIMEOUT):
-                    sleep(1)
+                for i in range(0, TIMEOUT * STEPS_PER_SECOND, STEPS_PER_CHECK):
+                    bng.step(STEPS_PER_CHECK)
+                    self.ego_vehicle.poll_sensors()
+                    channel.write_sensors(timer, state, damage)
+
                     if oracle_result.ready():
                         print("Test finished")
                         is_pass, msg = oracle_result.get()
@@ -280,34 +301,19 @@ class SynchronousSimulationTest(unittest.TestCase):
             # Pause the simulation
             bng.pause()
 
-            ele = self.electrics_sensor.data
-            g_forces = self.gforces_sensor.data
-
-            for i in range(1,10):
-                # Progress it for 1/10 sec
-                bng.step(60)
-                # Get data from sensors
-                self.ego_vehicle.poll_sensors()
-                self.ego_vehicle.update_vehicle()
-                st = self.ego_vehicle.state
-                print(st)
-                #
-                # timer = self.timer_sensor.data['time']
-                # damage = self.damage_sensors.data['damage']
-                # pos= self.state_sensor.data['pos']
-                # dir = self.state_sensor.data['dir']
-                # vel=self.state_sensor.data['vel']
-                # gforces=(g_forces.get('gx', None), g_forces.get('gy', None), g_forces.get('gz', None))
-                # gforces2=(g_forces.get('gx2', None), g_forces.get('gy2', None), g_forces.get('gz2', None))
-                # steering=ele.get('steering', None)
-                # steering_input=ele.get('steering_input', None)
-                # brake=ele.get('brake', None)
-                # brake_input=ele.get('brake_input', None)
-                # throttle=ele.get('throttle', None)
-                # throttle_input=ele.get('throttle_input', None)
-                # throttleFactor=ele.get('throttleFactor', None)
-                # engineThrottle=ele.get('engineThrottle', None)
-                # wheelspeed=ele.get('wheelspeed', None)
+            # Record the signals of each step, e.g., to compute fitness functions later without simulating again
+            with TelemetryRecorder(TELEMETRY_FOLDER, test='test_synch_simulation') as recorder:
+                for i in range(1,10):
+                    # Progress it for 1/10 sec
+                    bng.step(60)
+                    # Get data from sensors
+                    self.ego_vehicle.poll_sensors()
+                    self.ego_vehicle.update_vehicle()
+                    st = self.ego_vehicle.state
+                    print(st)
+                    recorder.record_sensors(timer=self.timer_sensor, state=self.state_sensor,
+                                            electrics=self.electrics_sensor, gforces=self.gforces_sensor,
+                                            damage=self.damage_sensors)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+# Reuse the scenarios that are already made and loaded in the simulators
+#
+# Making a scenario (writing its prefab and json files), loading it and deleting it afterwards takes a large
+# fraction of short tests. ScenarioCache keeps one scenario (the template) for each simulator and uses the
+# content hash of the scenarios to decide what to do:
+#   - same content as the loaded template: restart it, so only the per-test settings (e.g., NPC scripts,
+#     AI configuration) must be applied
+#   - same content, but the template is not loaded (e.g., after a reconnection): load it, without making it
+#   - different content (e.g., other road nodes or checkpoints, which are part of the prefab): make it again
+#     by overwriting the template files, and load it
+import hashlib
+import json
+from threading import Lock
+
+
+def content_hash(scenario):
+    """
+        Hashes everything that goes into the files of the scenario (map, vehicles and their placement, roads,
+        objects and checkpoints) and the sensors of its vehicles. The name of the scenario is not included.
+    """
+    vehicles = []
+    for vehicle_dict in sorted(scenario._get_vehicles_list(), key=lambda v: v['vid']):
+        sensors = scenario.get_vehicle(vehicle_dict['vid']).sensors
+        vehicles.append((vehicle_dict, sorted((name, type(sensor).__name__) for name, sensor in sensors.items())))
+
+    info = scenario._get_info_dict()
+    content = {
+        'level': scenario._get_level_name(),
+        'vehicles': vehicles,
+        'roads': scenario._get_roads_list(),
+        'objects': scenario._get_objects_list(),
+        'checkpoints': info['lapConfig'],
+        'options': scenario.options,
+    }
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ScenarioCache:
+    """
+        Keeps track of the scenario (template) made and loaded in each simulator, identified by its host and port.
+
+        Experiments describe their scenario as usual, but instead of making and loading it, they call load and
+        continue with the scenario it returns: when the template is reused, its vehicles (and their sensors)
+        are the ones connected to the simulator, so experiments must get them with scenario.get_vehicle.
+    """
+
+    def __init__(self, prefix='cached_scenario'):
+        self.prefix = prefix
+        self.templates = {}
+        self.lock = Lock()
+        self.made, self.loaded, self.restarted = 0, 0, 0
+
+    def _template_name(self, host, port):
+        # Simulators running on the same host might share the same user folder
+        return "%s_%s_%d" % (self.prefix, host.replace('.', '_'), port)
+
+    def load(self, bng, scenario, host='localhost', port=64256):
+        """
+            Makes the scenario available in the simulator, (re)starts it and returns the running scenario, which
+            might be the template instead of the given one. The simulator is left paused.
+        """
+        scenario.name = self._template_name(host, port)
+        scenario_hash = content_hash(scenario)
+
+        with self.lock:
+            template_hash, template = self.templates.get((host, port), (None, None))
+
+        if template_hash == scenario_hash and bng.scenario is template:
+            bng.restart_scenario()
+            with self.lock:
+                self.restarted += 1
+        else:
+            made = template_hash != scenario_hash
+            if made:
+                scenario.make(bng)
+            else:
+                scenario.path = template.path
+            bng.load_scenario(scenario)
+            bng.start_scenario()
+            template = scenario
+            with self.lock:
+                self.made += int(made)
+                self.loaded += 1
+                self.templates[(host, port)] = (scenario_hash, template)
+
+        bng.pause()
+        return template
+
+    def forget(self, host, port):
+        """Forces the next load on the simulator to make the scenario again, e.g., if its files are broken."""
+        with self.lock:
+            self.templates.pop((host, port), None)
+
+    def delete(self, bng, host, port):
+        """Deletes the files of the template from the simulator."""
+        with self.lock:
+            _, template = self.templates.pop((host, port), (None, None))
+        if template is not None:
+            if bng.scenario is template:
+                bng.stop_scenario()
+            bng.delete_scenario(template.path)
+
+    def __str__(self):
+        return "made: %d, loaded: %d, restarted: %d" % (self.made, self.loaded, self.restarted)
@@ -0,0 +1,173 @@
+# Share the sensor data of a vehicle between the simulation process and the monitor processes
+#
+# Monitors that run in other processes used to open their own connection to BeamNG and attach their own (duplicate)
+# sensors to the vehicle, doubling the requests to the simulator. Instead, the process that drives the simulation
+# writes the data it polls into a ring buffer in shared memory, and any number of monitors read it from there.
+#
+# Samples have a fixed layout (SAMPLE_DTYPE), and the buffer keeps the last `capacity` ones. Monitors that fall
+# behind more than that lose the oldest samples, they never block the simulation.
+#
+# Requires Python 3.8 (multiprocessing.shared_memory)
+#
+# Run this module to test it
+#   python -m unittest sensor_channel
+import unittest
+from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype([('time', np.float64),
+                         ('pos', np.float64, 3),
+                         ('vel', np.float64, 3),
+                         ('damage', np.float64),
+                         ('damaged_parts', np.int32)])
+
+# The header holds the capacity of the buffer, the number of samples written so far and whether the writer finished
+HEADER_DTYPE = np.dtype([('capacity', np.int64), ('count', np.int64), ('finished', np.int64)])
+
+
+class SensorChannel:
+    """
+        Ring buffer of samples in shared memory. The process that creates the channel writes it, the processes that
+        attach to it (by name) read it. Samples are numbered from 0 in the order they are written.
+    """
+
+    def __init__(self, shared_memory, owner):
+        self.shared_memory = shared_memory
+        self.owner = owner
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shared_memory.buf)
+        # Shared memory can be larger than requested, so readers cannot tell the capacity from its size
+        capacity = self.capacity = int(self.header['capacity'][0])
+        self.samples = np.ndarray((capacity,), dtype=SAMPLE_DTYPE, buffer=shared_memory.buf,
+                                  offset=HEADER_DTYPE.itemsize)
+
+    @classmethod
+    def create(cls, capacity=1024, name=None):
+        shared_memory = SharedMemory(name=name, create=True,
+                                     size=HEADER_DTYPE.itemsize + capacity * SAMPLE_DTYPE.itemsize)
+        np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shared_memory.buf)[0] = (capacity, 0, 0)
+        return cls(shared_memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    @property
+    def count(self):
+        return int(self.header['count'][0])
+
+    @property
+    def finished(self):
+        return bool(self.header['finished'][0])
+
+    def write(self, time, pos, vel, damage, damaged_parts):
+        count = self.count
+        self.samples[count % self.capacity] = (time, pos, vel, damage, damaged_parts)
+        # Publish the sample only after it is complete
+        self.header['count'] = count + 1
+
+    def write_sensors(self, timer, state, damage):
+        """Writes the data of the Timer, State and Damage sensors of a vehicle, as returned by poll_sensors."""
+        self.write(timer.data['time'], state.data['pos'], state.data['vel'], damage.data['damage'],
+                   len(damage.data['part_damage']))
+
+    def read_since(self, start):
+        """
+            Returns the samples written from the start-th one on, and the number to read from next time. If the
+            writer overwrote some of them already, only the ones still in the buffer are returned.
+        """
+        end = self.count
+        start = max(start, end - self.capacity)
+        samples = self.samples[np.arange(start, end) % self.capacity]
+        # The writer may have overwritten the oldest samples while they were being copied
+        overwritten = self.count - self.capacity - start
+        if overwritten > 0:
+            samples = samples[overwritten:]
+        return samples, end
+
+    def latest(self):
+        """Returns the last sample written, or None if there is none."""
+        count = self.count
+        if count == 0:
+            return None
+        samples, _ = self.read_since(count - 1)
+        return samples[-1] if len(samples) > 0 else None
+
+    def finish(self):
+        """Tells the readers that there are no more samples."""
+        self.header['finished'] = 1
+
+    def close(self):
+        """Readers detach from the channel. The writer also finishes it and releases the shared memory."""
+        if self.owner:
+            self.finish()
+        # The views on the buffer must go before the shared memory can be closed
+        del self.header, self.samples
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_all(name, results):
+    channel = SensorChannel.attach(name)
+    times, next_sample = [], 0
+    while True:
+        finished = channel.finished
+        samples, next_sample = channel.read_since(next_sample)
+        times.extend(samples['time'].tolist())
+        if finished:
+            break
+    results.put(times)
+    channel.close()
+
+
+class SensorChannelTest(unittest.TestCase):
+
+    def test_samples_are_read_in_order(self):
+        with SensorChannel.create(capacity=8) as channel:
+            self.assertIsNone(channel.latest())
+            for i in range(5):
+                channel.write(i, (i, 0, 0), (1, 0, 0), 0.0, 0)
+
+            samples, next_sample = channel.read_since(0)
+            self.assertEqual([0, 1, 2, 3, 4], samples['time'].tolist())
+            self.assertEqual(5, next_sample)
+            self.assertEqual(4.0, channel.latest()['pos'][0])
+            self.assertEqual(0, len(channel.read_since(next_sample)[0]))
+
+    def test_readers_that_fall_behind_lose_the_oldest_samples(self):
+        with SensorChannel.create(capacity=4) as channel:
+            for i in range(10):
+                channel.write(i, (0, 0, 0), (0, 0, 0), 0.0, 0)
+
+            samples, next_sample = channel.read_since(2)
+            self.assertEqual([6, 7, 8, 9], samples['time'].tolist())
+            self.assertEqual(10, next_sample)
+
+    def test_another_process_reads_the_samples(self):
+        results = Queue()
+        with SensorChannel.create(capacity=10000) as channel:
+            reader = Process(target=_read_all, args=(channel.name, results))
+            reader.start()
+            for i in range(5000):
+                channel.write(i, (i, 0, 0), (0, 0, 0), 0.0, 0)
+            channel.finish()
+            times = results.get(timeout=30)
+            reader.join()
+
+        self.assertEqual(list(range(5000)), times)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# Poll the sensors of all the vehicles concurrently
+#
+# Vehicle.poll_sensors is a blocking round-trip to the simulator, so polling the sensors of several vehicles one
+# after the other makes the time of each step grow with the number of vehicles. Each vehicle has its own connection
+# to the simulator, so SensorGateway sends the requests of all the vehicles at once from a thread pool, and gathers
+# their responses into one snapshot. Requests of the sensors handled by the simulator itself (e.g., Timer) go through
+# the (only) connection to BeamNG, so those are still sent one at a time.
+#
+# Run this module to test it against simulated vehicles
+#   python -m unittest sensor_gateway
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+from timeit import default_timer as timer
+
+
+class SensorGateway:
+    """
+        Polls the sensors of the vehicles concurrently. Snapshots map the id of the vehicles to the data of their
+        sensors (by name). Like Vehicle.poll_sensors, polling also updates the data of the sensors.
+
+        Polling after bng.step (i.e., while the simulation is paused) returns consistent snapshots, since all the
+        sensors report the same simulation step.
+    """
+
+    def __init__(self, vehicles, max_workers=None):
+        self.vehicles = list(vehicles)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max(len(self.vehicles), 1))
+        # Guards the connection to BeamNG, which all the vehicles share
+        self.lock = Lock()
+
+    def _poll(self, vehicle):
+        """Same as Vehicle.poll_sensors, but it can run concurrently for different vehicles of the same simulation."""
+        engine_requests, vehicle_requests = vehicle.encode_sensor_requests()
+        sensor_data = dict()
+        if engine_requests['sensors']:
+            with self.lock:
+                vehicle.bng.send(engine_requests)
+                response = vehicle.bng.recv()
+            assert response['type'] == 'SensorData'
+            sensor_data.update(response['data'])
+        if vehicle_requests['sensors']:
+            vehicle.send(vehicle_requests)
+            response = vehicle.recv()
+            assert response['type'] == 'SensorData'
+            sensor_data.update(response['data'])
+
+        result = vehicle.decode_sensor_response(sensor_data)
+        for sensor, data in result.items():
+            vehicle.sensors[sensor].data = data
+        vehicle.sensor_cache = result
+        return result
+
+    async def poll_all(self):
+        """Polls the sensors of all the vehicles and returns the snapshot."""
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(self.executor, self._poll, vehicle)
+                                         for vehicle in self.vehicles])
+        return {vehicle.vid: result for vehicle, result in zip(self.vehicles, results)}
+
+    def poll(self):
+        """Same as poll_all, for code that does not run in an event loop."""
+        results = self.executor.map(self._poll, self.vehicles)
+        return {vehicle.vid: result for vehicle, result in zip(self.vehicles, results)}
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SimulatedBeamNG:
+    """Replies to the requests of the engine sensors after some latency, and records how many are in flight."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight, self.max_in_flight = 0, 0
+        self.requests = []
+
+    def send(self, data):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.requests.append(data)
+
+    def recv(self):
+        sleep(self.latency)
+        request = self.requests.pop()
+        self.in_flight -= 1
+        return {'type': 'SensorData', 'data': {name: {'time': 1.0} for name in request['sensors']}}
+
+
+class SimulatedVehicle:
+    """A vehicle with a 'timer' (engine) sensor and a 'state' (vehicle) sensor, whose replies take some time."""
+
+    class Sensor:
+        def __init__(self, engine):
+            self.engine = engine
+            self.data = None
+
+    def __init__(self, vid, bng, latency, position):
+        self.vid = vid
+        self.bng = bng
+        self.latency = latency
+        self.position = position
+        self.sensors = {'timer': self.Sensor(True), 'state': self.Sensor(False)}
+        self.sensor_cache = None
+
+    def encode_sensor_requests(self):
+        return ({'type': 'SensorRequest', 'sensors': {n: {} for n, s in self.sensors.items() if s.engine}},
+                {'type': 'SensorRequest', 'sensors': {n: {} for n, s in self.sensors.items() if not s.engine}})
+
+    def send(self, data):
+        self.request = data
+
+    def recv(self):
+        sleep(self.latency)
+        return {'type': 'SensorData', 'data': {name: {'pos': self.position} for name in self.request['sensors']}}
+
+    def decode_sensor_response(self, sensor_data):
+        return dict(sensor_data)
+
+
+class SensorGatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bng = SimulatedBeamNG(latency=0.001)
+        self.vehicles = [SimulatedVehicle('car_%d' % i, self.bng, 0.1, (i, 0, 0)) for i in range(4)]
+
+    def test_poll_all_gathers_one_snapshot(self):
+        with SensorGateway(self.vehicles) as gateway:
+            snapshot = asyncio.run(gateway.poll_all())
+
+        self.assertEqual(['car_0', 'car_1', 'car_2', 'car_3'], list(snapshot))
+        self.assertEqual({'timer': {'time': 1.0}, 'state': {'pos': (2, 0, 0)}}, snapshot['car_2'])
+        self.assertEqual({'pos': (3, 0, 0)}, self.vehicles[3].sensors['state'].data)
+
+    def test_vehicles_are_polled_concurrently(self):
+        with SensorGateway(self.vehicles) as gateway:
+            start = timer()
+            gateway.poll()
+            elapsed = timer() - start
+
+        # Polling them one at a time would take 0.4 seconds
+        self.assertLess(elapsed, 0.3)
+
+    def test_requests_to_beamng_are_not_interleaved(self):
+        with SensorGateway(self.vehicles) as gateway:
+            for _ in range(3):
+                asyncio.run(gateway.poll_all())
+
+        self.assertEqual(1, self.bng.max_in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Keep the connections to the simulators open across experiments
+#
+# Opening a new BeamNGpy connection (and the handshake that comes with it) for each test is measurable overhead
+# when running many short tests. SimulatorConnections keeps one open connection per simulator, hands it to the
+# experiments and resets the scenario state after each of them.
+import socket
+from contextlib import contextmanager
+from threading import Lock
+
+from beamngpy import BeamNGpy
+from beamngpy.beamngcommon import BNGDisconnectedError
+
+# The errors we get when the socket to the simulator is dead. Other errors (e.g., failed assertions in the oracles)
+# are bugs of the experiments, and reconnecting would only hide them
+CONNECTION_ERRORS = (ConnectionError, socket.timeout, OSError, BNGDisconnectedError)
+
+
+class SimulatorConnections:
+    """
+        Keeps one open connection (BeamNGpy) for each simulator, identified by its host and port.
+        The simulators must be already running.
+    """
+
+    def __init__(self, home=None, user=None):
+        self.home = home
+        self.user = user
+        self.connections = {}
+        self.lock = Lock()
+
+    def _connect(self, host, port):
+        bng = BeamNGpy(host, port, home=self.home, user=self.user)
+        return bng.open(launch=False, deploy=False)
+
+    def _is_alive(self, bng):
+        try:
+            bng.get_gamestate()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+        except ValueError:
+            # A dead socket returns empty messages, which BeamNGpy fails to parse
+            return False
+
+    def _disconnect(self, bng):
+        try:
+            bng.skt.close()
+        except CONNECTION_ERRORS:
+            pass
+
+    def get(self, host, port):
+        """Returns an open connection to the simulator. Dead connections are transparently replaced."""
+        with self.lock:
+            bng = self.connections.get((host, port))
+            if bng is not None and not self._is_alive(bng):
+                print("Connection to", (host, port), "is dead. Reconnecting")
+                self._disconnect(bng)
+                bng = None
+            if bng is None:
+                bng = self._connect(host, port)
+                self.connections[(host, port)] = bng
+            return bng
+
+    def reset(self, bng):
+        """Stops the current scenario, if any, so the next experiment starts from a clean state."""
+        if bng.scenario is not None:
+            bng.stop_scenario()
+
+    def drop(self, host, port):
+        """Closes the connection to the simulator. The next call to get opens a new one."""
+        with self.lock:
+            bng = self.connections.pop((host, port), None)
+        if bng is not None:
+            self._disconnect(bng)
+
+    @contextmanager
+    def session(self, host='localhost', port=64256, keep_scenario=False):
+        """
+            Hands the connection to the simulator to an experiment and resets the scenario state afterwards.
+            If the experiment fails because of the connection, the connection is dropped. Experiments that reuse
+            the loaded scenario (see scenario_cache) pass keep_scenario=True to not stop it.
+        """
+        bng = self.get(host, port)
+        try:
+            yield bng
+        except CONNECTION_ERRORS:
+            self.drop(host, port)
+            raise
+        if keep_scenario:
+            return
+        try:
+            self.reset(bng)
+        except CONNECTION_ERRORS:
+            self.drop(host, port)
+
+    def close_all(self):
+        """Closes all the connections. This does not stop the simulators."""
+        for host, port in list(self.connections):
+            self.drop(host, port)
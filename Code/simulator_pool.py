@@ -0,0 +1,247 @@
+# Run experiments on a pool of simulator instances (e.g., many BeamNG.tech running on different hosts/ports)
+#
+# Each experiment goes to whichever instance is free, results are collected as soon as they complete and
+# experiments that fail on one instance are retried on another one.
+#
+# For local testing, FakeSimulator processes can stand in for BeamNG: run this module to see how it works
+#   python -m unittest simulator_pool
+import unittest
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+from time import sleep
+
+# Authentication key used by the fake simulators
+FAKE_SIMULATOR_AUTHKEY = b'sbst-2021-tutorial'
+
+
+class SimulatorPoolError(Exception):
+    pass
+
+
+class SimulatorPool:
+    """
+        Dispatches experiments to a pool of simulator instances identified by (host, port) endpoints.
+
+        The experiment function is invoked as function(item, host=host, port=port) and must raise an
+        exception if the simulator fails. The failed item is retried on another instance, up to max_attempts
+        times. Instances that fail max_failures times in a row are not used anymore.
+    """
+
+    def __init__(self, endpoints, max_attempts=None, max_failures=3):
+        assert len(endpoints) > 0, "At least one simulator is needed"
+        self.endpoints = list(endpoints)
+        self.max_attempts = max_attempts if max_attempts is not None else len(self.endpoints) + 1
+        self.max_failures = max_failures
+
+    def imap_unordered(self, function, items):
+        """
+            Yields the (index, result) pairs of the items as soon as their experiments complete.
+            Items are taken from the iterable only when a simulator is free, so they can be generated on the fly
+            based on the results received so far (e.g., in a steady-state search).
+        """
+        new_items = enumerate(items)
+        more_items = True
+        # Failed items that must be retried
+        pending = deque()
+        free = deque(self.endpoints)
+        alive = set(self.endpoints)
+        failures = {endpoint: 0 for endpoint in self.endpoints}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+
+            def submit(endpoint, index, item, tried, attempts):
+                free.remove(endpoint)
+                host, port = endpoint
+                future = executor.submit(function, item, host=host, port=port)
+                running[future] = (endpoint, index, item, tried, attempts + 1)
+
+            try:
+                while True:
+                    # Assign the pending items to the free simulators. Experiments wait for simulators that
+                    # did not fail them yet, unless they have been tried on all the simulators left
+                    for _ in range(len(pending)):
+                        if not free:
+                            break
+                        index, item, tried, attempts = pending.popleft()
+                        candidates = [e for e in free if e not in tried]
+                        if not candidates:
+                            if any(e not in tried for e in alive):
+                                pending.append((index, item, tried, attempts))
+                                continue
+                            candidates = list(free)
+                        submit(candidates[0], index, item, tried, attempts)
+
+                    # New items take the simulators left
+                    while free and more_items:
+                        try:
+                            index, item = next(new_items)
+                        except StopIteration:
+                            more_items = False
+                        else:
+                            submit(free[0], index, item, set(), 0)
+
+                    if not running:
+                        if pending:
+                            raise SimulatorPoolError("No simulator left to run %d experiments" % len(pending))
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        endpoint, index, item, tried, attempts = running.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            print("Experiment", index, "failed on simulator", endpoint, ":", e)
+                            tried.add(endpoint)
+                            failures[endpoint] += 1
+                            if failures[endpoint] < self.max_failures:
+                                free.append(endpoint)
+                            else:
+                                print("Simulator", endpoint, "failed too many times. Removing it from the pool")
+                                alive.remove(endpoint)
+
+                            if attempts >= self.max_attempts:
+                                raise SimulatorPoolError("Experiment %d failed %d times" % (index, attempts)) from e
+                            # Retry as soon as possible
+                            pending.appendleft((index, item, tried, attempts))
+                        else:
+                            failures[endpoint] = 0
+                            free.append(endpoint)
+                            yield index, result
+            finally:
+                for future in running:
+                    future.cancel()
+
+    def map(self, function, items):
+        """Returns the results of the experiments in the same order as the items."""
+        items = list(items)
+        results = [None] * len(items)
+        for index, result in self.imap_unordered(function, items):
+            results[index] = result
+        return results
+
+
+class FakeSimulator:
+    """
+        Stands in for a simulator instance: listens on (host, port) and, for each experiment, waits for a random
+        latency and replies with an outcome computed from the individual. With probability failure_rate, it
+        drops the connection instead, like a crashed simulator.
+    """
+
+    def __init__(self, host, port, min_latency=0.0, max_latency=0.1, failure_rate=0.0, seed=None):
+        self.address = (host, port)
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+
+    def serve_forever(self):
+        rnd = random.Random(self.seed)
+        with Listener(self.address, authkey=FAKE_SIMULATOR_AUTHKEY) as listener:
+            while True:
+                with listener.accept() as connection:
+                    individual = connection.recv()
+                    sleep(rnd.uniform(self.min_latency, self.max_latency))
+                    if rnd.random() < self.failure_rate:
+                        continue
+                    connection.send(fake_outcome(individual))
+
+    def start(self):
+        """Starts the fake simulator in a new (daemon) process, and returns the process."""
+        process = Process(target=self.serve_forever, daemon=True)
+        process.start()
+        return process
+
+
+def fake_outcome(individual):
+    """A deterministic (outcome, fitness) pair for road individuals like the ones of automation_example_2:
+    the sharper the turns, the higher the fitness."""
+    fitness = 0.0
+    for road_segment in individual:
+        for s in road_segment['trajectory_segments']:
+            if s['type'] == 'turn':
+                fitness += abs(s['angle']) / s['radius']
+    return "Pass", fitness
+
+
+def execute_fake_experiment(individual, host='localhost', port=64256):
+    """Same interface as execute_experiment, but runs the experiment on a FakeSimulator."""
+    with Client((host, port), authkey=FAKE_SIMULATOR_AUTHKEY) as connection:
+        connection.send(individual)
+        try:
+            return connection.recv()
+        except EOFError:
+            raise ConnectionError("The simulator closed the connection")
+
+
+class SimulatorPoolTest(unittest.TestCase):
+
+    BASE_PORT = 64300
+
+    def setUp(self):
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+    def start_simulators(self, failure_rates):
+        endpoints = []
+        for i, failure_rate in enumerate(failure_rates):
+            endpoint = ('localhost', self.BASE_PORT + i)
+            self.processes.append(FakeSimulator(*endpoint, failure_rate=failure_rate, seed=i).start())
+            endpoints.append(endpoint)
+        # Give the simulators the time to start listening
+        sleep(0.5)
+        return endpoints
+
+    def generate_individuals(self, n):
+        return [[{'trajectory_segments': [{'type': 'turn', 'angle': 10 + i, 'radius': 20}]}] for i in range(n)]
+
+    def test_all_the_experiments_complete_in_order(self):
+        pool = SimulatorPool(self.start_simulators([0.0, 0.0, 0.0]))
+        individuals = self.generate_individuals(30)
+
+        results = pool.map(execute_fake_experiment, individuals)
+
+        self.assertEqual([fake_outcome(individual) for individual in individuals], results)
+
+    def test_failed_experiments_are_retried_on_another_simulator(self):
+        # The first simulator always crashes, the other one never does
+        pool = SimulatorPool(self.start_simulators([1.0, 0.0]))
+        individuals = self.generate_individuals(10)
+
+        results = pool.map(execute_fake_experiment, individuals)
+
+        self.assertEqual([fake_outcome(individual) for individual in individuals], results)
+
+    def test_items_are_taken_only_when_a_simulator_is_free(self):
+        pool = SimulatorPool(self.start_simulators([0.0, 0.0]))
+        individuals = self.generate_individuals(6)
+        taken = []
+
+        def items():
+            for individual in individuals:
+                taken.append(individual)
+                yield individual
+
+        for completed, _ in enumerate(pool.imap_unordered(execute_fake_experiment, items()), start=1):
+            # Two simulators run the experiments taken so far, and the one that completed is free again
+            self.assertLessEqual(len(taken), completed + 2)
+
+        self.assertEqual(individuals, taken)
+
+    def test_pool_gives_up_when_all_the_simulators_fail(self):
+        pool = SimulatorPool(self.start_simulators([1.0]), max_failures=2)
+
+        with self.assertRaises(SimulatorPoolError):
+            pool.map(execute_fake_experiment, self.generate_individuals(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
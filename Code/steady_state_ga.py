@@ -0,0 +1,202 @@
+# Steady-state (asynchronous) genetic algorithm
+#
+# A generational GA waits for the whole population to be evaluated before selecting and mutating, so one slow test
+# stalls all the simulators. SteadyStateGA instead creates a new individual as soon as an evaluation completes:
+# the result immediately enters the population (replacing the worst individual if better), and the free simulator
+# gets a mutant of the current population.
+#
+# Evaluations run through any imap_unordered(function, items) that takes the items only when it can run them,
+# like SimulatorPool.imap_unordered or ConcurrentEvaluator.imap_unordered.
+#
+# Run this module to test it with a mock evaluator
+#   python -m unittest steady_state_ga
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import sleep
+
+
+class ConcurrentEvaluator:
+    """Runs up to max_concurrent evaluations at the same time in local threads."""
+
+    def __init__(self, max_concurrent):
+        assert max_concurrent > 0, "At least one evaluation must run"
+        self.max_concurrent = max_concurrent
+
+    def imap_unordered(self, function, items):
+        """Yields the (index, result) pairs as soon as the evaluations complete. Items are taken only when
+        an evaluation slot is free."""
+        new_items = enumerate(items)
+        more_items = True
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            try:
+                while True:
+                    while more_items and len(running) < self.max_concurrent:
+                        try:
+                            index, item = next(new_items)
+                        except StopIteration:
+                            more_items = False
+                        else:
+                            running[executor.submit(function, item)] = index
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield running.pop(future), future.result()
+            finally:
+                for future in running:
+                    future.cancel()
+
+
+class SteadyStateGA:
+    """
+        generate() creates a random individual, mutate(individual) returns a mutant of the individual,
+        select(population, scores) picks one individual of the population, and score(result) tells how good the
+        result of an evaluation is (the higher, the better).
+
+        If given, is_valid(individual) filters the individuals before they are evaluated, and stop(result) ends
+        the search as soon as it returns True. If max_rejections mutants in a row are invalid, random individuals are
+        tried instead, and if max_rejections random individuals in a row are invalid as well, the search gives up:
+        no more individuals are evaluated and gave_up is True.
+    """
+
+    def __init__(self, generate, mutate, select, population_size, budget, score=lambda result: result,
+                 is_valid=None, stop=None, max_rejections=10):
+        assert population_size > 0, "The population cannot be empty"
+        self.generate = generate
+        self.mutate = mutate
+        self.select = select
+        self.population_size = population_size
+        self.budget = budget
+        self.score = score
+        self.is_valid = is_valid if is_valid is not None else (lambda individual: True)
+        self.stop = stop if stop is not None else (lambda result: False)
+        self.max_rejections = max_rejections
+
+        self.population, self.scores = [], []
+        self.best, self.best_result, self.best_score = None, None, None
+        self.evaluated = 0
+        self.rejected = 0
+        self.gave_up = False
+
+    def _new_individual(self, index):
+        """Returns a new valid individual, or None if none could be found."""
+        rejections, random_rejections = 0, 0
+        while random_rejections < self.max_rejections:
+            # The initial population is random, then individuals are mutants of the ones evaluated so far.
+            # If mutants keep being invalid, random individuals are tried instead
+            is_random = index < self.population_size or not self.population or rejections >= self.max_rejections
+            individual = self.generate() if is_random else self.mutate(self.select(self.population, self.scores))
+            if self.is_valid(individual):
+                return individual
+            self.rejected += 1
+            rejections += 1
+            random_rejections += 1 if is_random else 0
+        return None
+
+    def _candidates(self, submitted):
+        # Candidates are created only when there is a free evaluation slot, so they come from the latest population
+        for index in range(self.budget):
+            individual = self._new_individual(index)
+            if individual is None:
+                self.gave_up = True
+                return
+            submitted[index] = individual
+            yield individual
+
+    def _insert(self, individual, result):
+        score = self.score(result)
+        if self.best_score is None or score > self.best_score:
+            self.best, self.best_result, self.best_score = individual, result, score
+        if len(self.population) < self.population_size:
+            self.population.append(individual)
+            self.scores.append(score)
+            return
+        # Replace the worst individual, if the new one is better
+        worst = min(range(len(self.scores)), key=self.scores.__getitem__)
+        if score > self.scores[worst]:
+            self.population[worst] = individual
+            self.scores[worst] = score
+
+    def run(self, imap_unordered, evaluate):
+        """Runs the search, evaluating the individuals with imap_unordered(evaluate, individuals), and returns
+        the best individual and its result."""
+        submitted = {}
+        for index, result in imap_unordered(evaluate, self._candidates(submitted)):
+            individual = submitted.pop(index)
+            self.evaluated += 1
+            self._insert(individual, result)
+            if self.stop(result):
+                break
+        return self.best, self.best_result
+
+
+class SteadyStateGATest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = Lock()
+        self.concurrent, self.max_concurrent = 0, 0
+        self.random = random.Random(0)
+
+    def mock_evaluate(self, individual):
+        # The fitness is the individual itself, but evaluations take a random time
+        with self.lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            latency = self.random.uniform(0.001, 0.02)
+        sleep(latency)
+        with self.lock:
+            self.concurrent -= 1
+        return float(individual)
+
+    def ga(self, budget, **kwargs):
+        return SteadyStateGA(generate=lambda: self.random.uniform(0, 10),
+                             mutate=lambda individual: individual + self.random.uniform(0, 5),
+                             select=lambda population, scores: population[scores.index(max(scores))],
+                             population_size=4, budget=budget, **kwargs)
+
+    def test_the_search_improves_the_individuals_and_keeps_all_the_slots_busy(self):
+        ga = self.ga(100)
+
+        best, best_result = ga.run(ConcurrentEvaluator(4).imap_unordered, self.mock_evaluate)
+
+        self.assertEqual(100, ga.evaluated)
+        self.assertEqual(4, self.max_concurrent)
+        self.assertEqual(4, len(ga.population))
+        self.assertGreater(best_result, 20.0)
+        self.assertEqual(max(ga.scores), best_result)
+
+    def test_invalid_individuals_are_not_evaluated(self):
+        evaluated = []
+        ga = self.ga(50, is_valid=lambda individual: int(individual) % 2 == 0)
+
+        ga.run(ConcurrentEvaluator(2).imap_unordered, lambda individual: evaluated.append(individual) or individual)
+
+        self.assertEqual(50, len(evaluated))
+        self.assertTrue(all(int(individual) % 2 == 0 for individual in evaluated))
+        self.assertGreater(ga.rejected, 0)
+
+    def test_the_search_gives_up_when_no_valid_individual_can_be_found(self):
+        # Only the first 6 individuals are valid, then all the (random and mutated) ones are rejected
+        verdicts = iter([True] * 6)
+        ga = self.ga(100, is_valid=lambda individual: next(verdicts, False), max_rejections=5)
+
+        best, best_result = ga.run(ConcurrentEvaluator(2).imap_unordered, self.mock_evaluate)
+
+        self.assertTrue(ga.gave_up)
+        self.assertEqual(6, ga.evaluated)
+        self.assertEqual(max(ga.scores), best_result)
+
+    def test_the_search_stops_as_soon_as_asked(self):
+        ga = self.ga(1000, stop=lambda result: result > 30.0)
+
+        best, best_result = ga.run(ConcurrentEvaluator(3).imap_unordered, self.mock_evaluate)
+
+        self.assertGreater(best_result, 30.0)
+        self.assertLess(ga.evaluated, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# Surrogate model that predicts the fitness of roads from cheap features of their segments
+#
+# Simulating a road takes minutes, computing its features takes microseconds. SurrogateSelector learns online how
+# the features relate to the fitness observed in the simulations, and picks the children that look most promising,
+# so only those are simulated.
+#
+# The (road, fitness) pairs observed by the search can be recorded in an archive (JSON lines) and replayed with
+# benchmark_surrogate.py to measure offline how often the surrogate picks the best roads.
+#
+# Run this module to test it
+#   python -m unittest surrogate
+import json
+import unittest
+from math import radians
+
+import numpy as np
+
+from fitness_cache import canonical_form
+
+FEATURE_NAMES = ["total curvature", "max angle/radius", "length", "direction changes"]
+
+
+def road_features(individual):
+    """
+        Returns the features of the road defined by the segments of the individual: the total curvature (sum of
+        the absolute angles, in radians), the maximum angle/radius ratio, the length and the number of times the
+        road turns to the other side.
+    """
+    total_curvature, max_ratio, length, direction_changes = 0.0, 0.0, 0.0, 0
+    last_side = 0
+    for road_segment in individual:
+        for s in road_segment['trajectory_segments']:
+            if s['type'] == 'straight':
+                length += s['length']
+                continue
+            angle = radians(abs(s['angle']))
+            total_curvature += angle
+            max_ratio = max(max_ratio, angle / s['radius'])
+            length += angle * s['radius']
+            side = 1 if s['angle'] > 0 else -1
+            if last_side != 0 and side != last_side:
+                direction_changes += 1
+            last_side = side
+    return np.array([total_curvature, max_ratio, length, direction_changes], dtype=float)
+
+
+class OnlineRidgeRegressor:
+    """
+        Linear regression with L2 regularization on standardized features, trained incrementally: only the sums
+        needed to solve the normal equations are kept, so each update costs O(features^2) whatever the number of
+        observations.
+    """
+
+    def __init__(self, n_features, alpha=1.0):
+        self.alpha = alpha
+        self.n = 0
+        self.sum_x = np.zeros(n_features)
+        self.sum_y = 0.0
+        self.sum_xx = np.zeros((n_features, n_features))
+        self.sum_xy = np.zeros(n_features)
+        self.coefficients, self.intercept = np.zeros(n_features), 0.0
+
+    def partial_fit(self, X, y):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        y = np.asarray(y, dtype=float)
+        self.n += len(y)
+        self.sum_x += X.sum(axis=0)
+        self.sum_y += y.sum()
+        self.sum_xx += X.T @ X
+        self.sum_xy += X.T @ y
+        self._solve()
+        return self
+
+    def _solve(self):
+        mean_x, mean_y = self.sum_x / self.n, self.sum_y / self.n
+        covariance = self.sum_xx / self.n - np.outer(mean_x, mean_x)
+        cross_covariance = self.sum_xy / self.n - mean_x * mean_y
+        # Standardize, so all the features are equally regularized. Constant features get no weight
+        scale = np.sqrt(np.clip(np.diag(covariance), 0.0, None))
+        scale[scale == 0.0] = np.inf
+        standardized = covariance / np.outer(scale, scale)
+        # With few observations the system might be singular
+        coefficients, _, _, _ = np.linalg.lstsq(standardized + self.alpha / self.n * np.eye(len(scale)),
+                                                cross_covariance / scale, rcond=None)
+        self.coefficients = coefficients / scale
+        self.intercept = mean_y - mean_x @ self.coefficients
+
+    def predict(self, X):
+        return np.atleast_2d(np.asarray(X, dtype=float)) @ self.coefficients + self.intercept
+
+
+class SurrogateSelector:
+    """
+        Picks the top_k individuals with the highest predicted fitness. Until min_observations fitness values have
+        been observed, the predictions are not reliable, so the first top_k individuals are picked instead.
+    """
+
+    def __init__(self, top_k, min_observations=10, alpha=1.0, features=road_features, n_features=len(FEATURE_NAMES)):
+        self.top_k = top_k
+        self.min_observations = min_observations
+        self.features = features
+        self.model = OnlineRidgeRegressor(n_features, alpha)
+
+    def is_trained(self):
+        return self.model.n >= self.min_observations
+
+    def predict(self, individuals):
+        return self.model.predict([self.features(individual) for individual in individuals])
+
+    def select_indices(self, individuals):
+        """Returns the positions of the top_k individuals to simulate."""
+        return self.select_indices_by_features([self.features(individual) for individual in individuals])
+
+    def select_indices_by_features(self, features):
+        """Same as select_indices, given the (n, features) array of the individuals (e.g., RoadPopulation.features)."""
+        if not self.is_trained():
+            return list(range(min(self.top_k, len(features))))
+        predictions = self.model.predict(features)
+        # Stable, so ties keep the order of the individuals
+        return np.argsort(-predictions, kind='stable')[0:self.top_k].tolist()
+
+    def select(self, individuals):
+        """Returns the top_k individuals to simulate."""
+        return [individuals[i] for i in self.select_indices(individuals)]
+
+    def observe(self, individuals, fitness_values):
+        """Trains the model with the fitness observed in the simulations."""
+        if len(individuals) > 0:
+            self.model.partial_fit([self.features(individual) for individual in individuals], fitness_values)
+
+
+def append_to_archive(path, individuals, fitness_values):
+    """Appends the (road, fitness) pairs to the archive, one JSON object per line."""
+    with open(path, 'a') as archive:
+        for individual, fitness in zip(individuals, fitness_values):
+            archive.write(json.dumps({'road': canonical_form(individual), 'fitness': float(fitness)}) + "\n")
+
+
+def load_archive(path):
+    """Returns the roads and their fitness values recorded in the archive."""
+    roads, fitness_values = [], []
+    with open(path) as archive:
+        for line in archive:
+            if line.strip():
+                entry = json.loads(line)
+                roads.append(entry['road'])
+                fitness_values.append(entry['fitness'])
+    return roads, fitness_values
+
+
+class SurrogateTest(unittest.TestCase):
+
+    def road(self, *segments):
+        return [{'trajectory_segments': [s]} for s in segments]
+
+    def test_features(self):
+        road = self.road({'type': 'straight', 'length': 10},
+                         {'type': 'turn', 'angle': 90, 'radius': 10},
+                         {'type': 'turn', 'angle': -45, 'radius': 20},
+                         {'type': 'turn', 'angle': -45, 'radius': 20})
+
+        total_curvature, max_ratio, length, direction_changes = road_features(road)
+
+        self.assertAlmostEqual(radians(180), total_curvature)
+        self.assertAlmostEqual(radians(90) / 10, max_ratio)
+        self.assertAlmostEqual(10 + radians(90) * 10 + 2 * radians(45) * 20, length)
+        self.assertEqual(1, direction_changes)
+
+    def test_the_online_regressor_matches_the_batch_solution(self):
+        rnd = np.random.RandomState(0)
+        X = rnd.uniform(0, 100, (200, 4))
+        y = X @ np.array([1.0, -2.0, 0.5, 0.0]) + 3.0 + rnd.normal(0, 0.1, 200)
+
+        model = OnlineRidgeRegressor(4, alpha=0.0)
+        for start in range(0, 200, 7):
+            model.partial_fit(X[start:start + 7], y[start:start + 7])
+        expected, _, _, _ = np.linalg.lstsq(np.column_stack((X, np.ones(200))), y, rcond=None)
+
+        np.testing.assert_allclose(model.coefficients, expected[0:4], atol=1e-6)
+        self.assertAlmostEqual(expected[4], model.intercept, places=4)
+
+    def test_the_selector_picks_the_most_promising_roads(self):
+        selector = SurrogateSelector(top_k=2, min_observations=3)
+        roads = [self.road({'type': 'turn', 'angle': angle, 'radius': 20}) for angle in (10, 30, 50, 70, 90)]
+
+        # Not trained yet
+        self.assertEqual(roads[0:2], selector.select(roads))
+
+        # The sharper the turn, the higher the fitness
+        selector.observe(roads[0:3], [0.1, 0.3, 0.5])
+        self.assertEqual([roads[4], roads[3]], selector.select(roads))
+
+
+if __name__ == '__main__':
+    unittest.main()
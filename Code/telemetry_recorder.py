@@ -0,0 +1,216 @@
+# Record the telemetry of every run, so it can be analysed later without simulating the tests again
+#
+# Samples are appended to preallocated NumPy buffers, one per signal (column), and the buffers are written to the
+# run folder in compressed chunks (.npz) when they are full. So, the memory used while recording does not depend on
+# the length of the run. When the run ends, it is appended to the run index (one JSON object per line), together
+# with its metadata (e.g., the fitness), so runs can be selected without opening their chunks.
+#
+#   <folder>/index.jsonl
+#   <folder>/<run id>/chunk_00000.npz, chunk_00001.npz, ...
+#
+# Run this module to test it
+#   python -m unittest telemetry_recorder
+import json
+import os
+import tempfile
+import unittest
+import uuid
+from threading import Lock
+
+import numpy as np
+
+# The signals of the Timer, State, Electrics, GForces and Damage sensors worth recording: name -> shape of a sample
+TELEMETRY_COLUMNS = {
+    'time': (),
+    'pos': (3,),
+    'dir': (3,),
+    'vel': (3,),
+    'gforces': (3,),
+    'steering': (),
+    'steering_input': (),
+    'throttle': (),
+    'throttle_input': (),
+    'brake': (),
+    'brake_input': (),
+    'wheelspeed': (),
+    'damage': (),
+}
+
+INDEX_FILE = 'index.jsonl'
+
+# Runs may be recorded by the threads that run the experiments
+_index_lock = Lock()
+
+
+class TelemetryRecorder:
+    """
+        Records the samples of one run. Signals that are not given (or not available) are recorded as NaN. Use
+        it as a context manager, or call close to write the last chunk and index the run.
+    """
+
+    def __init__(self, folder, run_id=None, columns=None, chunk_size=1024, **metadata):
+        self.folder = folder
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex
+        self.columns = dict(columns if columns is not None else TELEMETRY_COLUMNS)
+        self.chunk_size = chunk_size
+        self.metadata = metadata
+        self.buffers = {name: np.full((chunk_size,) + shape, np.nan) for name, shape in self.columns.items()}
+        self.size = 0
+        self.samples = 0
+        self.chunks = 0
+        os.makedirs(os.path.join(folder, self.run_id), exist_ok=False)
+
+    def append(self, **values):
+        """Records one sample: values maps the names of the columns to their value."""
+        for name, buffer in self.buffers.items():
+            buffer[self.size] = values.get(name, np.nan)
+        self.size += 1
+        self.samples += 1
+        if self.size == self.chunk_size:
+            self.flush()
+
+    def record_sensors(self, timer=None, state=None, electrics=None, gforces=None, damage=None, **values):
+        """Records one sample from the data of the sensors of a vehicle (after poll_sensors), and other values."""
+        if timer is not None:
+            values['time'] = timer.data['time']
+        if state is not None:
+            values.update(pos=state.data['pos'], dir=state.data['dir'], vel=state.data['vel'])
+        if electrics is not None:
+            for name in ('steering', 'steering_input', 'throttle', 'throttle_input', 'brake', 'brake_input',
+                         'wheelspeed'):
+                values[name] = _or_nan(electrics.data.get(name))
+        if gforces is not None:
+            values['gforces'] = tuple(_or_nan(gforces.data.get(name)) for name in ('gx', 'gy', 'gz'))
+        if damage is not None:
+            values['damage'] = damage.data['damage']
+        self.append(**values)
+
+    def flush(self):
+        """Writes the samples recorded since the last chunk, if any, into a new chunk."""
+        if self.size == 0:
+            return
+        path = os.path.join(self.folder, self.run_id, 'chunk_%05d.npz' % self.chunks)
+        np.savez_compressed(path, **{name: buffer[0:self.size] for name, buffer in self.buffers.items()})
+        self.chunks += 1
+        self.size = 0
+        for buffer in self.buffers.values():
+            buffer.fill(np.nan)
+
+    def close(self, **metadata):
+        """Writes the last chunk and appends the run to the index. metadata is added to the one of the run."""
+        self.flush()
+        self.metadata.update(metadata)
+        entry = {'run_id': self.run_id, 'samples': self.samples, 'chunks': self.chunks,
+                 'columns': list(self.columns), 'metadata': self.metadata}
+        with _index_lock, open(os.path.join(self.folder, INDEX_FILE), 'a') as index:
+            index.write(json.dumps(entry) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _or_nan(value):
+    return np.nan if value is None else value
+
+
+class TelemetryStore:
+    """Reads the runs recorded in the folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def runs(self, predicate=None):
+        """Returns the index entries of the runs (optionally, only the ones whose entry satisfies the predicate)."""
+        path = os.path.join(self.folder, INDEX_FILE)
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path) as index:
+            for line in index:
+                if line.strip():
+                    entry = json.loads(line)
+                    if predicate is None or predicate(entry):
+                        entries.append(entry)
+        return entries
+
+    def load(self, run_id, columns=None):
+        """Returns the recorded columns (all of them by default) of the run, as arrays of samples."""
+        folder = os.path.join(self.folder, run_id)
+        chunks = sorted(name for name in os.listdir(folder) if name.endswith('.npz'))
+        parts = {}
+        for chunk in chunks:
+            with np.load(os.path.join(folder, chunk)) as data:
+                for name in (columns if columns is not None else data.files):
+                    parts.setdefault(name, []).append(data[name])
+        return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+class TelemetryRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_runs_are_written_in_chunks_and_read_back(self):
+        with TelemetryRecorder(self.folder.name, run_id='run', chunk_size=16) as recorder:
+            for i in range(40):
+                recorder.append(time=i / 60, pos=(i, 0, 0), throttle=1.0)
+
+        store = TelemetryStore(self.folder.name)
+        entry, = store.runs()
+        self.assertEqual(('run', 40, 3), (entry['run_id'], entry['samples'], entry['chunks']))
+
+        data = store.load('run', columns=['pos', 'throttle', 'brake'])
+        np.testing.assert_array_equal(np.arange(40), data['pos'][:, 0])
+        self.assertTrue(np.all(data['throttle'] == 1.0))
+        # Signals not recorded are NaN
+        self.assertTrue(np.all(np.isnan(data['brake'])))
+
+    def test_memory_does_not_grow_with_the_length_of_the_run(self):
+        recorder = TelemetryRecorder(self.folder.name, chunk_size=8)
+        for i in range(100):
+            recorder.append(time=i)
+            self.assertLess(recorder.size, 8)
+        recorder.close()
+
+        self.assertEqual(8, len(recorder.buffers['time']))
+        self.assertEqual(13, recorder.chunks)
+
+    def test_runs_are_selected_by_their_metadata(self):
+        for fitness in (1.0, 5.0, 3.0):
+            with TelemetryRecorder(self.folder.name, chunk_size=4, columns={'time': ()}) as recorder:
+                recorder.append(time=0.0)
+                recorder.metadata['fitness'] = fitness
+
+        store = TelemetryStore(self.folder.name)
+        selected = store.runs(lambda entry: entry['metadata']['fitness'] > 2.0)
+
+        self.assertEqual([5.0, 3.0], [entry['metadata']['fitness'] for entry in selected])
+
+    def test_sensors_data(self):
+        class Sensor:
+            def __init__(self, data):
+                self.data = data
+
+        with TelemetryRecorder(self.folder.name, run_id='run') as recorder:
+            recorder.record_sensors(timer=Sensor({'time': 1.5}),
+                                    state=Sensor({'pos': (1, 2, 3), 'dir': (0, 1, 0), 'vel': (0, 5, 0)}),
+                                    electrics=Sensor({'steering': 0.1, 'wheelspeed': 5.0}),
+                                    gforces=Sensor({'gx': 0.0, 'gy': 0.2}),
+                                    damage=Sensor({'damage': 0.0, 'part_damage': {}}))
+
+        data = TelemetryStore(self.folder.name).load('run')
+        self.assertEqual(1.5, data['time'][0])
+        np.testing.assert_array_equal([0, 5, 0], data['vel'][0])
+        self.assertEqual(5.0, data['wheelspeed'][0])
+        self.assertTrue(np.isnan(data['throttle'][0]))
+        self.assertTrue(np.isnan(data['gforces'][0][2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
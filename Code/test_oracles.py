@@ -1,6 +1,48 @@
 from shapely.geometry import Point, Polygon, LineString
+from shapely.strtree import STRtree
+from shapely.prepared import prep
+from scipy.spatial import cKDTree
+from functools import wraps
+import logging
 import numpy as np
 
+# How many positions are checked at once against all the edges of a polygon, to bound the memory
+BATCH_CHUNK_SIZE = 4096
+
+
+def _first_violation(verdicts):
+    """Returns the index of the first True verdict, or None if there is none."""
+    violations = np.flatnonzero(verdicts)
+    return int(violations[0]) if len(violations) > 0 else None
+
+
+def _points_in_polygon(points, vertices):
+    """Returns a boolean array that tells which of the (n, 2) points are inside the polygon defined
+    by the (m, 2) vertices (even-odd rule)."""
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, 1), np.roll(y0, 1)
+    inside = np.empty(len(points), dtype=bool)
+    for start in range(0, len(points), BATCH_CHUNK_SIZE):
+        x = points[start:start + BATCH_CHUNK_SIZE, 0:1]
+        y = points[start:start + BATCH_CHUNK_SIZE, 1:2]
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_intersection = (x1 - x0) * (y - y0) / (y1 - y0) + x0
+        inside[start:start + BATCH_CHUNK_SIZE] = np.count_nonzero(crosses & (x < x_intersection), axis=1) % 2 == 1
+    return inside
+
+
+def _points_in_quads(points, quads):
+    """Returns a boolean array that tells if each of the (n, 2) points is inside the corresponding
+    quadrilateral of the (n, 4, 2) quads (even-odd rule)."""
+    x, y = points[:, 0:1], points[:, 1:2]
+    x0, y0 = quads[:, :, 0], quads[:, :, 1]
+    x1, y1 = np.roll(x0, 1, axis=1), np.roll(y0, 1, axis=1)
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_intersection = (x1 - x0) * (y - y0) / (y1 - y0) + x0
+    return np.count_nonzero(crosses & (x < x_intersection), axis=1) % 2 == 1
+
 
 class TargetAreaOracle():
 
@@ -14,6 +56,14 @@ class TargetAreaOracle():
         # print("Distance to target", distance_to_goal)
         return distance_to_goal < self.radius
 
+    def check_batch(self, positions, first_only=False):
+        """Checks all the (n, 2) or (n, 3) recorded positions at once. Like check, it ignores the z coordinate.
+        Returns a boolean array, or the index of the first position in the target area (None if there is none)."""
+        positions = np.asarray(positions, dtype=float)
+        distances_to_goal = np.hypot(positions[:, 0] - self.targer_position.x, positions[:, 1] - self.targer_position.y)
+        verdicts = distances_to_goal < self.radius
+        return _first_violation(verdicts) if first_only else verdicts
+
 
 class DamagedOracle():
     def __init__(self, damage_sensor):
@@ -22,83 +72,137 @@ class DamagedOracle():
     def check(self):
         return len(self.damage_sensor.data['part_damage']) > 0
 
+    def check_batch(self, damaged_parts, first_only=False):
+        """Checks all the recorded samples at once. damaged_parts contains the number of damaged parts
+        (i.e., len(part_damage)) of each sample.
+        Returns a boolean array, or the index of the first damaged sample (None if there is none)."""
+        verdicts = np.asarray(damaged_parts) > 0
+        return _first_violation(verdicts) if first_only else verdicts
+
+
+
+def lazy_property(compute):
+    """Turns the given method into a read-only property that is computed on first access and then cached."""
+    attribute = '_lazy_' + compute.__name__
+
+    @wraps(compute)
+    def getter(self):
+        if attribute not in self.__dict__:
+            self.__dict__[attribute] = compute(self)
+        return self.__dict__[attribute]
+
+    return property(getter)
 
 
 class RoadPolygon:
     """A class that represents the road as a geometrical object
-    (a polygon or a sequence of polygons)."""
+    (a polygon or a sequence of polygons).
+
+    All the geometries are computed only when they are accessed for the first time
+    and then cached, so users pay only for the geometries they need."""
 
     @classmethod
     def from_nodes(cls, nodes):
+        assert all(len(x) == 4 for x in nodes)
         return RoadPolygon(RoadPoints.from_nodes(nodes))
 
+    @classmethod
+    def from_arrays(cls, middle, road_width):
+        """Creates a RoadPolygon from a (n, 2) array with the middle points of the road and its width.
+        Neither tuples nor geometries are created upfront, so accessing only one lane (e.g., right_polygon)
+        builds only that lane."""
+        return RoadPolygon(RoadPoints.from_arrays(middle, road_width))
+
     def __init__(self, road_points):
-        assert len(road_points.left) == len(road_points.right) == len(road_points.middle)
-        assert len(road_points.left) >= 2
-        assert all(len(x) == 4 for x in road_points.middle)
-        assert all(len(x) == 2 for x in road_points.left)
-        assert all(len(x) == 2 for x in road_points.right)
-        assert all(x[3] == road_points.middle[0][3] for x in
-                   road_points.middle), "The width of the road should be equal everywhere."
+        assert road_points.left_array.shape == road_points.right_array.shape == road_points.middle_array.shape
+        assert road_points.n >= 2
+        assert road_points.middle_array.shape[1] == 2
+        assert np.all(road_points.widths == road_points.widths[0]), \
+            "The width of the road should be equal everywhere."
         self.road_points = road_points
-        self.road_width = road_points.middle[0][3]
-        self.polygons = self._compute_polygons()
-        self.polygon = self._compute_polygon()
-        self.right_polygon = self._compute_right_polygon()
-        self.left_polygon = self._compute_left_polygon()
-        self.polyline = self._compute_polyline()
-        self.right_polyline = self._compute_right_polyline()
-        self.left_polyline = self._compute_left_polyline()
-        self.num_polygons = len(self.polygons)
+        self.road_width = road_points.widths[0]
+        self.num_polygons = road_points.n - 1
+
+    @lazy_property
+    def polygons(self):
+        return self._compute_polygons()
+
+    @lazy_property
+    def polygon(self):
+        return self._compute_polygon()
+
+    @lazy_property
+    def right_polygon(self):
+        return self._compute_right_polygon()
+
+    @lazy_property
+    def left_polygon(self):
+        return self._compute_left_polygon()
+
+    @lazy_property
+    def prepared_right_polygon(self):
+        """The right lane as prepared geometry, which makes repeated contains checks faster."""
+        return prep(self.right_polygon)
+
+    @lazy_property
+    def right_lane_quads(self):
+        return self._compute_right_lane_quads()
+
+    @lazy_property
+    def polyline(self):
+        return self._compute_polyline()
+
+    @lazy_property
+    def right_polyline(self):
+        return self._compute_right_polyline()
+
+    @lazy_property
+    def left_polyline(self):
+        return self._compute_left_polyline()
 
     def _compute_polygons(self):
         """Creates and returns a list of Polygon objects that represent the road.
         Each polygon represents a segment of the road. Two objects adjacent in
         the returned list represent adjacent segments of the road."""
-        polygons = []
-        for left, right, left1, right1, in zip(self.road_points.left,
-                                               self.road_points.right,
-                                               self.road_points.left[1:],
-                                               self.road_points.right[1:]):
-            assert len(left) >= 2 and len(right) >= 2 and len(left1) >= 2 and len(right1) >= 2
-            # Ignore the z coordinate.
-            polygons.append(Polygon([left[:2], left1[:2], right1[:2], right[:2]]))
-        return polygons
+        left = self.road_points.left_array.tolist()
+        right = self.road_points.right_array.tolist()
+        return [Polygon([left0, left1, right1, right0]) for left0, right0, left1, right1, in
+                zip(left, right, left[1:], right[1:])]
 
     def _compute_polygon(self):
         """Returns a single polygon that represents the whole road."""
-        road_poly = self.road_points.left.copy()
-        road_poly.extend(self.road_points.right[::-1])
-        return Polygon(road_poly)
+        return Polygon(np.vstack((self.road_points.left_array, self.road_points.right_array[::-1])))
 
     def _compute_right_polygon(self):
         """Returns a single polygon that represents the right lane of the road."""
-        road_poly = [(p[0], p[1]) for p in self.road_points.middle]
-        road_poly.extend(self.road_points.right[::-1])
-        return Polygon(road_poly)
+        return Polygon(np.vstack((self.road_points.middle_array, self.road_points.right_array[::-1])))
 
     def _compute_left_polygon(self):
         """Returns a single polygon that represents the left lane of the road."""
-        road_poly = self.road_points.left.copy()
-        road_poly.extend([(p[0], p[1]) for p in self.road_points.middle][::-1])
-        return Polygon(road_poly)
+        return Polygon(np.vstack((self.road_points.left_array, self.road_points.middle_array[::-1])))
+
+    def _compute_right_lane_quads(self):
+        """Returns, for each segment of the road, the four corners of the right lane as a tuple of (x, y) tuples.
+        Those are plain tuples and not Polygon objects, so that we can check them without calling Shapely."""
+        middle = self.road_points.middle_array.tolist()
+        right = self.road_points.right_array.tolist()
+        return [(tuple(middle0), tuple(middle1), tuple(right1), tuple(right0)) for middle0, right0, middle1, right1, in
+                zip(middle, right, middle[1:], right[1:])]
 
     def _compute_polyline(self):
         """Computes and returns a LineString representing the polyline
         of the spin (or middle) of the road."""
-        return LineString([(n[0], n[1]) for n in self.road_points.middle])
+        return LineString(self.road_points.middle_array)
 
     def _compute_right_polyline(self):
         """Computes and returns a LineString representing the polyline
         of the spin (or middle) of the right lane of the road."""
-        return LineString([((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2) for p1, p2 in
-                           zip(self.road_points.middle, self.road_points.right)])
+        return LineString((self.road_points.middle_array + self.road_points.right_array) / 2)
 
     def _compute_left_polyline(self):
         """Computes and returns a LineString representing the polyline
         of the spin (or middle) of the left lane of the road."""
-        return LineString([((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2) for p1, p2 in
-                           zip(self.road_points.left, self.road_points.middle)])
+        return LineString((self.road_points.left_array + self.road_points.middle_array) / 2)
 
     def _get_neighbouring_polygons(self, i: int):
         """Returns the indices of the neighbouring polygons of the polygon
@@ -119,18 +223,75 @@ class RoadPolygon:
         """Returns true if the polygons represented by the indices i and j are adjacent."""
         return j in self._get_neighbouring_polygons(i)
 
+    def _query_candidates(self, tree, polygon, index_by_id):
+        """Returns the indices of the polygons whose bounding box overlaps the one of the given polygon.
+        Shapely 2 returns the indices directly, older versions return the indexed geometries."""
+        for item in tree.query(polygon):
+            if isinstance(item, (int, np.integer)):
+                yield int(item)
+            else:
+                yield index_by_id[id(item)]
+
+    def _are_invalid_polygons(self, i: int, j: int):
+        """Returns true if the polygons represented by the indices i and j violate the validity rules."""
+        polygon, other = self.polygons[i], self.polygons[j]
+        if polygon.contains(other) or other.contains(polygon):
+            # logging.debug("No polygon should contain any other polygon.")
+            return True
+        if self._are_neighbouring_polygons(i, j):
+            # logging.debug("The neighbouring polygons %s and %s have an intersection of type %s." % (
+            #     polygon, other, type(other.intersection(polygon))))
+            return not isinstance(other.intersection(polygon), LineString)
+        # logging.debug("The non-neighbouring polygons %s and %s intersect." % (polygon, other))
+        return other.intersects(polygon)
+
     def is_valid(self):
         """Returns true if the current RoadPolygon representation of the road is valid,
         that is, if there are no intersections between non-adjacent polygons and if
-        the adjacent polygons have as intersection a LineString (a line or segment)."""
+        the adjacent polygons have as intersection a LineString (a line or segment).
+
+        Instead of comparing all the pairs of polygons, this uses a spatial index (STRtree)
+        over the bounding boxes of the polygons and checks only the pairs of polygons whose
+        bounding boxes overlap. The check stops at the first violation. It runs for every road generated by
+        the search (see road_validation), so the verdicts are logged at debug level only."""
         if self.num_polygons == 0:
-            print("No polygon constructed.")
+            logging.debug("No polygon constructed.")
             return False
 
         for i, polygon in enumerate(self.polygons):
             if not polygon.is_valid:
-                # logging.debug("Polygon %s is invalid." % polygon)
-                print("Polygon is invalid")
+                logging.debug("Polygon %s is invalid." % polygon)
+                return False
+
+        # Adjacent polygons always share an edge, so we check them explicitly
+        for i in range(self.num_polygons - 1):
+            if self._are_invalid_polygons(i, i + 1):
+                logging.debug("The road is not valid.")
+                return False
+
+        tree = STRtree(self.polygons)
+        index_by_id = {id(polygon): i for i, polygon in enumerate(self.polygons)}
+        for i, polygon in enumerate(self.polygons):
+            for j in self._query_candidates(tree, polygon, index_by_id):
+                # Each pair is checked only once, and adjacent polygons have been checked already
+                if j <= i + 1:
+                    continue
+                if self._are_invalid_polygons(i, j):
+                    logging.debug("The road is not valid.")
+                    return False
+        logging.debug("The road is apparently valid.")
+        return True
+
+    def is_valid_all_pairs(self):
+        """Same as is_valid, but compares every polygon against every other polygon.
+        This is quadratic in the number of polygons, so use it only as reference."""
+        if self.num_polygons == 0:
+            logging.debug("No polygon constructed.")
+            return False
+
+        for i, polygon in enumerate(self.polygons):
+            if not polygon.is_valid:
+                logging.debug("Polygon %s is invalid." % polygon)
                 return False
 
         for i, polygon in enumerate(self.polygons):
@@ -140,23 +301,23 @@ class RoadPolygon:
                     assert i == j
                     continue
                 if polygon.contains(other) or other.contains(polygon):
-                    # logging.debug("No polygon should contain any other polygon.")
-                    print("The road is apparently valid.")
+                    logging.debug("No polygon should contain any other polygon.")
                     return False
                 if not self._are_neighbouring_polygons(i, j) and other.intersects(polygon):
-                    # logging.debug("The non-neighbouring polygons %s and %s intersect." % (polygon, other))
-                    print("The road is apparently valid.")
+                    logging.debug("The non-neighbouring polygons %s and %s intersect." % (polygon, other))
                     return False
                 if self._are_neighbouring_polygons(i, j) and not isinstance(other.intersection(polygon), LineString):
-                    # logging.debug("The neighbouring polygons %s and %s have an intersection of type %s." % (
-                    #     polygon, other, type(other.intersection(polygon))))
-                    print("The road is apparently valid.")
+                    logging.debug("The neighbouring polygons %s and %s have an intersection of type %s." % (
+                        polygon, other, type(other.intersection(polygon))))
                     return False
-        print("The road is apparently valid.")
+        logging.debug("The road is apparently valid.")
         return True
 
 
 class RoadPoints:
+    """The middle, left and right points of a road. The points are stored in contiguous (n, 2) arrays
+    and the left and right edges are computed for all the nodes at once. The lists of tuples used by
+    RoadPolygon are created only when requested."""
 
     @classmethod
     def from_nodes(cls, middle_nodes):
@@ -164,35 +325,118 @@ class RoadPoints:
         res.add_middle_nodes(middle_nodes)
         return res
 
+    @classmethod
+    def from_arrays(cls, middle, road_width):
+        """Creates the road points from a (n, 2) array of middle points and the road width,
+        which is either a scalar or a (n,) array. The middle nodes have z = 0."""
+        middle = np.asarray(middle, dtype=float)[:, 0:2]
+        n = len(middle)
+        assert n >= 2, f'At least, two nodes are needed'
+        res = RoadPoints()
+        res._ensure_capacity(n)
+        res._middle_array[:n] = middle
+        res._widths[:n] = road_width
+        res.n = n
+        res._middle = None
+        res._recalculate_nodes()
+        return res
+
     def __init__(self):
-        self.middle = []
-        self.right = []
-        self.left = []
+        self._middle = []
         self.n = 0
+        # Preallocated buffers, only the first n rows are meaningful
+        self._middle_array = np.empty((0, 2))
+        self._widths = np.empty(0)
+        self._left_array = np.empty((0, 2))
+        self._right_array = np.empty((0, 2))
+        self._left = None
+        self._right = None
+
+    @property
+    def middle_array(self):
+        return self._middle_array[:self.n]
+
+    @property
+    def left_array(self):
+        return self._left_array[:self.n]
+
+    @property
+    def right_array(self):
+        return self._right_array[:self.n]
+
+    @property
+    def widths(self):
+        return self._widths[:self.n]
+
+    @property
+    def middle(self):
+        if self._middle is None:
+            self._middle = [(x, y, 0.0, w) for (x, y), w in zip(self.middle_array.tolist(), self.widths.tolist())]
+        return self._middle
+
+    @property
+    def left(self):
+        if self._left is None:
+            self._left = [tuple(p) for p in self.left_array.tolist()]
+        return self._left
+
+    @property
+    def right(self):
+        if self._right is None:
+            self._right = [tuple(p) for p in self.right_array.tolist()]
+        return self._right
+
+    def _ensure_capacity(self, n):
+        capacity = len(self._widths)
+        if n <= capacity:
+            return
+        # Double the capacity so that many small appends do not copy the buffers every time
+        capacity = max(n, 2 * capacity)
+        for name, shape in (('_middle_array', (capacity, 2)), ('_widths', (capacity,)),
+                            ('_left_array', (capacity, 2)), ('_right_array', (capacity, 2))):
+            buffer = np.empty(shape)
+            buffer[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, buffer)
 
     def add_middle_nodes(self, middle_nodes):
-        n = len(self.middle) + len(middle_nodes)
+        n = self.n + len(middle_nodes)
 
         assert n >= 2, f'At least, two nodes are needed'
 
         assert all(len(point) >= 4 for point in middle_nodes), \
             f'A node is a tuple of 4 elements (x,y,z,road_width)'
 
+        old_n = self.n
+        self._ensure_capacity(n)
+        if len(middle_nodes) > 0:
+            nodes = np.array([point[:4] for point in middle_nodes], dtype=float)
+            self._middle_array[old_n:n] = nodes[:, 0:2]
+            self._widths[old_n:n] = nodes[:, 3]
+
+        self.middle.extend(middle_nodes)
         self.n = n
-        self.middle += list(middle_nodes)
-        self.left += [None] * len(middle_nodes)
-        self.right += [None] * len(middle_nodes)
-        self._recalculate_nodes()
+        # Only the new nodes and the previous last node (that now has a successor) change
+        self._recalculate_nodes(max(old_n - 1, 0))
         return self
 
-    def _recalculate_nodes(self):
-        for i in range(self.n - 1):
-            l, r = self.calc_point_edges(self.middle[i], self.middle[i + 1])
-            self.left[i] = l
-            self.right[i] = r
+    def _recalculate_nodes(self, start=0):
+        """Recomputes the left and right edges of the nodes from start to the end of the road."""
+        middle = self.middle_array
+        # Each node points towards the next one, the last node keeps the direction of the last segment
+        directions = np.empty((self.n - start, 2))
+        directions[:-1] = middle[start + 1:] - middle[start:-1]
+        directions[-1] = middle[-1] - middle[-2]
+
+        # calculate the vectors which length is half the road width
+        v = directions / np.linalg.norm(directions, axis=1)[:, np.newaxis] * (self.widths[start:] / 2)[:, np.newaxis]
+        # add normal vectors
+        normals = np.column_stack((-v[:, 1], v[:, 0]))
+        self._left_array[start:self.n] = middle[start:] + normals
+        self._right_array[start:self.n] = middle[start:] - normals
 
-        # the last middle point
-        self.right[-1], self.left[-1] = self.calc_point_edges(self.middle[-1], self.middle[-2])
+        # Invalidate the views
+        self._left = None
+        self._right = None
 
     @classmethod
     def calc_point_edges(cls, p1, p2):
@@ -208,17 +452,83 @@ class RoadPoints:
         r = origin + np.array([v[1], -v[0]])
         return tuple(l), tuple(r)
 
+def _quad_contains(quad, x, y):
+    """Returns true if the point (x, y) is inside the quadrilateral (even-odd rule)."""
+    inside = False
+    x0, y0 = quad[3]
+    for x1, y1 in quad:
+        if (y1 > y) != (y0 > y) and x < (x0 - x1) * (y - y1) / (y0 - y1) + x1:
+            inside = not inside
+        x0, y0 = x1, y1
+    return inside
+
+
 class SimpleOBEOracle():
     """
         Returns true if the car is out of the right lane out-of-bound (OOB).
         It assumes a road formed with two lanes
+
+        Since the car moves only a little between two checks, the oracle remembers the segment of the road
+        where the car was last found and checks first the few segments around it. Only if the car is not
+        there, the oracle checks the whole (prepared) right lane polygon.
     """
 
+    # How many segments before and after the last known one are checked first
+    SEARCH_WINDOW = 2
+
     def __init__(self, road_nodes, state_sensor):
         self.state_sensor = state_sensor
         # Extract Polygon of the right lane
-        self.road_polygon = RoadPolygon.from_nodes(road_nodes)
+        road_nodes = np.asarray(road_nodes, dtype=float)
+        # Only the right lane is built, and only when the oracle is first checked
+        self.road_polygon = RoadPolygon.from_arrays(road_nodes[:, 0:2], road_nodes[0][3])
+        # Index of the segment that contained the car at the last check
+        self.last_segment = None
 
     def check(self):
-        car_position = Point(self.state_sensor.data['pos'])
-        return not self.road_polygon.right_polygon.contains(car_position)
+        return self.is_out_of_bound(self.state_sensor.data['pos'])
+
+    def is_out_of_bound(self, position):
+        x, y = float(position[0]), float(position[1])
+        quads = self.road_polygon.right_lane_quads
+
+        if self.last_segment is not None:
+            start = max(self.last_segment - self.SEARCH_WINDOW, 0)
+            end = min(self.last_segment + self.SEARCH_WINDOW + 1, len(quads))
+            for i in range(start, end):
+                if _quad_contains(quads[i], x, y):
+                    self.last_segment = i
+                    return False
+
+        # Fall back to the full test
+        if not self.road_polygon.prepared_right_polygon.contains(Point(x, y)):
+            return True
+
+        # The car is in the lane, but far from where it was. Look for the segment closest to it
+        distances = np.sum((self.road_polygon.road_points.middle_array - (x, y)) ** 2, axis=1)
+        self.last_segment = min(int(np.argmin(distances)), len(quads) - 1)
+        return False
+
+    def check_batch(self, positions, first_only=False):
+        """Checks all the (n, 2) or (n, 3) recorded positions at once.
+        Returns a boolean array, or the index of the first position out of the lane (None if there is none).
+
+        Like check, each position is first tested against the segments next to the closest middle point,
+        and only the positions that are not there are tested against the whole right lane."""
+        positions = np.asarray(positions, dtype=float)[:, 0:2]
+        road_points = self.road_polygon.road_points
+        middle, right = road_points.middle_array, road_points.right_array
+
+        _, closest = cKDTree(middle).query(positions)
+        in_lane = np.zeros(len(positions), dtype=bool)
+        for segments in (np.clip(closest - 1, 0, len(middle) - 2), np.minimum(closest, len(middle) - 2)):
+            quads = np.stack((middle[segments], middle[segments + 1], right[segments + 1], right[segments]), axis=1)
+            in_lane |= _points_in_quads(positions, quads)
+
+        misses = np.flatnonzero(~in_lane)
+        if len(misses) > 0:
+            right_lane = np.vstack((middle, right[::-1]))
+            in_lane[misses] = _points_in_polygon(positions[misses], right_lane)
+
+        verdicts = ~in_lane
+        return _first_violation(verdicts) if first_only else verdicts
@@ -1,108 +1,378 @@
 # This code comes from the SBST Tool competition
 from numpy import linspace, array, cross, dot
+import numpy as np
 from shapely.geometry import LineString, Point
 from shapely.affinity import translate, rotate, scale
-from scipy.spatial import geometric_slerp
+from scipy.spatial import geometric_slerp, cKDTree
 from math import sin, cos, radians, degrees, atan2, copysign
+from functools import partial
+from multiprocessing import Pool
+import unittest
 import common
 
-def generate_trajectory(initial_location, initial_rotation, driving_actions, SAMPLING_UNIT = 5):
+# Interpolated points closer than this to a segment of the trajectory are kept
+MATCHING_DISTANCE = 0.5
+
+def generate_trajectory(initial_location, initial_rotation, driving_actions, SAMPLING_UNIT = 5, analytic=False):
+        """
+        Generates the points of the trajectory defined by the segments of the driving actions.
+
+        By default, the segments are approximated by polylines which are then interpolated using cubic splines and
+        resampled every SAMPLING_UNIT meters. With analytic=True, the points are computed directly from the segment
+        parameters at exact arc-length distances: this is faster and exactly reproducible. The spline smooths the
+        corners between segments, so the two modes differ by up to about 10 cm, and the analytic mode may give
+        one point more.
+        """
         segments = []
         for driving_action in driving_actions:
             segments.extend(driving_action["trajectory_segments"])
 
-        last_location = initial_location
-        last_rotation = initial_rotation
-
-        trajectory_points = [initial_location]
-        len_coor = []
-
-        for s in segments:
-            # Generate the segment from the initial position and rotation
-            # Then update the initial position and rotation for the next segment
-            segment = None
-            if s["type"] == 'straight':
-                # Create an horizontal line of given length from the origin
-                segment = LineString([(x, 0) for x in linspace(0, s["length"], 8)])
-                # Rotate it
-                segment = rotate(segment, last_rotation, (0, 0))
-                # Move it
-                segment = translate(segment, last_location.x, last_location.y)
-                # Update last rotation and last location
-                last_rotation = last_rotation  # Straight segments do not change the rotation
-                last_location = Point(list(segment.coords)[-1])
-
-            elif s["type"] == 'turn':
-                # Generate the points over the circle with 1.0 radius
-                # # Vector (0,1)
-                # start = array([cos(radians(90.0)), sin(radians(90.0))])
-                # # Compute this using the angle
-                # end = array([cos(radians(90.0 - s["angle"])), sin(radians(90.0 - s["angle"]))])
-                start = array([1, 0])
-
-                # Make sure that positive is
-                # TODO Pay attention to left/right positive/negative
-                end = array([cos(radians(s["angle"])), sin(radians(s["angle"]))])
-                # Interpolate over 8 points
-                t_vals = linspace(0, 1, 8)
-                result = geometric_slerp(start, end, t_vals)
-                segment = LineString([Point(p[0], p[1]) for p in result])
-
-                # Translate that back to origin
-                segment = translate(segment, -1.0, 0.0)
-                # Rotate
-                if s["angle"] > 0:
-                    segment = rotate(segment, -90.0, (0.0, 0.0), use_radians=False)
-                else:
-                    segment = rotate(segment, +90.0, (0.0, 0.0), use_radians=False)
-
-                # Scale to radius on both x and y
-                segment = scale(segment, s["radius"], s["radius"], 1.0, (0.0, 0.0))
-                # Rotate it
-                segment = rotate(segment, last_rotation, (0, 0))
-                # Translate it
-                segment = translate(segment, last_location.x, last_location.y)
-                # Update last rotation and last location
-                last_rotation = last_rotation + s["angle"]  # Straight segments do not change the rotation
-                last_location = Point(list(segment.coords)[-1])
-
-            if segment is not None:
-                len_coor.append(len(list(segment.coords)))
-                trajectory_points.extend([Point(x, y) for x, y in list(segment.coords)])
-
-        the_trajectory = LineString(common.remove_duplicates([(p.x, p.y) for p in trajectory_points]))
-
-        # Make sure we use as reference the NORTH
-        the_trajectory = translate(the_trajectory, - initial_location.x, - initial_location.y)
-        # Rotate by -90 deg
-        the_trajectory = rotate(the_trajectory, +90.0, (0, 0))
-        # Translate it back
-        the_trajectory = translate(the_trajectory, + initial_location.x, + initial_location.y)
+        if analytic:
+            return _resample_segments(initial_location, initial_rotation, segments, SAMPLING_UNIT)
+
+        the_trajectory, sls = _generate_segment_lines(initial_location, initial_rotation, segments)
 
         # Interpolate and resample uniformly - Make sure no duplicates are there. Hopefully we do not change the order
         # TODO Sampling unit is 5 meters for the moment. Can be changed later
-        interpolated_points = common.interpolate([(p[0], p[1]) for p in list(the_trajectory.coords)], sampling_unit = SAMPLING_UNIT)
-
-        # Concat the speed to the point
-        trajectory_points = list(the_trajectory.coords)
-        start = 0
-        sls = []
-        sl_coor = []
-        for s in len_coor:
-            sl_coor.append([start, start + s])
-            start = sl_coor[-1][1] - 1
-        for s in sl_coor:
-            sls.append(LineString(trajectory_points[s[0]:s[1]]))
-
-        trajectory_points = []
-        for line in sls:
-            for p in interpolated_points:
-                point = Point(p[0], p[1])
-                if point.distance(line) < 0.5 and p not in trajectory_points:
-                    trajectory_points.append((p[0], p[1]))
+        interpolated_points = common.interpolate(the_trajectory, sampling_unit = SAMPLING_UNIT, as_tuples=True)
 
         # Return triplet
-        return trajectory_points
+        return _match_points_to_segments(interpolated_points, sls)
+
+
+# Each segment is approximated by a polyline with this many points
+POINTS_PER_SEGMENT = 8
+
+
+def _rotation(angle):
+    """Returns the 2D affine matrix that rotates counterclockwise by angle (deg) around the origin."""
+    c, s = cos(radians(angle)), sin(radians(angle))
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+def _translation(x, y):
+    return np.array([[1.0, 0.0, x], [0.0, 1.0, y], [0.0, 0.0, 1.0]])
+
+
+def _scaling(factor):
+    return np.array([[factor, 0.0, 0.0], [0.0, factor, 0.0], [0.0, 0.0, 1.0]])
+
+
+def _generate_segment_lines(initial_location, initial_rotation, segments):
+    """
+    Approximates each segment with a polyline. Returns the points of the whole trajectory as a (n, 2) array and,
+    for each segment, its points.
+
+    Each segment is generated in its own reference frame, and moved in place with a single affine matrix.
+    All the points are written to one preallocated buffer, where each segment starts on the last point of
+    the previous one. Segments with no length (e.g., turns with a 0 angle) repeat the same point, so consecutive
+    duplicates are removed from the trajectory: the spline interpolation fails on them.
+
+    Turns must be sharper than -180 and smoother than 180 deg.
+    """
+    # Segments of unknown type are ignored
+    segments = [s for s in segments if s["type"] in ('straight', 'turn')]
+    for s in segments:
+        if s["type"] == 'turn' and abs(s["angle"]) >= 180.0:
+            raise ValueError("Turns of %s deg are not supported" % s["angle"])
+
+    t_vals = np.linspace(0, 1, POINTS_PER_SEGMENT)
+    step = POINTS_PER_SEGMENT - 1
+    points = np.empty((step * len(segments) + 1, 2))
+    points[0] = (initial_location.x, initial_location.y)
+    # The points of the segment in homogeneous coordinates
+    segment_points = np.ones((3, POINTS_PER_SEGMENT))
+
+    last_rotation = initial_rotation
+    for i, s in enumerate(segments):
+        start = i * step
+        last_location = points[start]
+        if s["type"] == 'straight':
+            # An horizontal line of given length from the origin, rotated and moved
+            segment_points[0] = t_vals * s["length"]
+            segment_points[1] = 0.0
+            transformation = _translation(last_location[0], last_location[1]) @ _rotation(last_rotation)
+            # Straight segments do not change the rotation
+
+        else:
+            # The points over the circle with 1.0 radius. Positive angles turn left, negative angles turn right
+            segment_points[0] = np.cos(t_vals * radians(s["angle"]))
+            segment_points[1] = np.sin(t_vals * radians(s["angle"]))
+            # Translate that back to origin, rotate so it starts horizontally, scale to radius, rotate and move
+            transformation = _translation(last_location[0], last_location[1]) @ _rotation(last_rotation) @ \
+                _scaling(s["radius"]) @ _rotation(-90.0 if s["angle"] > 0 else +90.0) @ _translation(-1.0, 0.0)
+            last_rotation = last_rotation + s["angle"]
+
+        # The first point is the last point of the previous segment
+        points[start + 1:start + POINTS_PER_SEGMENT] = (transformation @ segment_points)[0:2, 1:].T
+
+    # Make sure we use as reference the NORTH. Rotate by -90 deg around the initial location
+    origin = np.array([initial_location.x, initial_location.y])
+    points = (points - origin) @ _rotation(+90.0)[0:2, 0:2].T + origin
+
+    sls = [points[i * step:i * step + POINTS_PER_SEGMENT] for i in range(len(segments))]
+    is_duplicate = np.zeros(len(points), dtype=bool)
+    is_duplicate[1:] = np.all(points[1:] == points[:-1], axis=1)
+    return points[~is_duplicate], sls
+
+
+def _generate_segment_lines_shapely(initial_location, initial_rotation, segments):
+    """
+    Same as _generate_segment_lines, but builds and transforms each segment with Shapely.
+    This is slow, so use it only as reference.
+    """
+    last_location = initial_location
+    last_rotation = initial_rotation
+
+    trajectory_points = [initial_location]
+    len_coor = []
+
+    for s in segments:
+        # Generate the segment from the initial position and rotation
+        # Then update the initial position and rotation for the next segment
+        segment = None
+        if s["type"] == 'straight':
+            # Create an horizontal line of given length from the origin
+            segment = LineString([(x, 0) for x in linspace(0, s["length"], 8)])
+            # Rotate it
+            segment = rotate(segment, last_rotation, (0, 0))
+            # Move it
+            segment = translate(segment, last_location.x, last_location.y)
+            # Update last rotation and last location
+            last_rotation = last_rotation  # Straight segments do not change the rotation
+            last_location = Point(list(segment.coords)[-1])
+
+        elif s["type"] == 'turn':
+            # Generate the points over the circle with 1.0 radius
+            # # Vector (0,1)
+            # start = array([cos(radians(90.0)), sin(radians(90.0))])
+            # # Compute this using the angle
+            # end = array([cos(radians(90.0 - s["angle"])), sin(radians(90.0 - s["angle"]))])
+            start = array([1, 0])
+
+            # Make sure that positive is
+            # TODO Pay attention to left/right positive/negative
+            end = array([cos(radians(s["angle"])), sin(radians(s["angle"]))])
+            # Interpolate over 8 points
+            t_vals = linspace(0, 1, 8)
+            result = geometric_slerp(start, end, t_vals)
+            segment = LineString([Point(p[0], p[1]) for p in result])
+
+            # Translate that back to origin
+            segment = translate(segment, -1.0, 0.0)
+            # Rotate
+            if s["angle"] > 0:
+                segment = rotate(segment, -90.0, (0.0, 0.0), use_radians=False)
+            else:
+                segment = rotate(segment, +90.0, (0.0, 0.0), use_radians=False)
+
+            # Scale to radius on both x and y
+            segment = scale(segment, s["radius"], s["radius"], 1.0, (0.0, 0.0))
+            # Rotate it
+            segment = rotate(segment, last_rotation, (0, 0))
+            # Translate it
+            segment = translate(segment, last_location.x, last_location.y)
+            # Update last rotation and last location
+            last_rotation = last_rotation + s["angle"]  # Straight segments do not change the rotation
+            last_location = Point(list(segment.coords)[-1])
+
+        if segment is not None:
+            len_coor.append(len(list(segment.coords)))
+            trajectory_points.extend([Point(x, y) for x, y in list(segment.coords)])
+
+    the_trajectory = LineString(common.remove_duplicates([(p.x, p.y) for p in trajectory_points]))
+
+    # Make sure we use as reference the NORTH
+    the_trajectory = translate(the_trajectory, - initial_location.x, - initial_location.y)
+    # Rotate by -90 deg
+    the_trajectory = rotate(the_trajectory, +90.0, (0, 0))
+    # Translate it back
+    the_trajectory = translate(the_trajectory, + initial_location.x, + initial_location.y)
+
+    # Concat the speed to the point
+    trajectory_points = list(the_trajectory.coords)
+    start = 0
+    sls = []
+    sl_coor = []
+    for s in len_coor:
+        sl_coor.append([start, start + s])
+        start = sl_coor[-1][1] - 1
+    for s in sl_coor:
+        sls.append(trajectory_points[s[0]:s[1]])
+    return trajectory_points, sls
+
+
+def _match_points_to_segments(interpolated_points, segment_lines):
+    """
+    Returns the interpolated points that are closer than MATCHING_DISTANCE to any of the segment lines,
+    without duplicates. Points are sorted by the first segment they match, and then by their original order.
+
+    A k-d tree over the points selects, for each edge of the segment lines, the few points that might be close
+    to it, and only their distances are computed (at once, with NumPy).
+    """
+    points = np.array(interpolated_points, dtype=float)[:, 0:2]
+
+    # Split the segment lines into their edges, and remember to which segment line each edge belongs
+    edge_starts, edge_ends, edge_segments = [], [], []
+    for segment_index, line in enumerate(segment_lines):
+        coords = np.array(line, dtype=float)[:, 0:2]
+        edge_starts.append(coords[:-1])
+        edge_ends.append(coords[1:])
+        edge_segments.append(np.full(len(coords) - 1, segment_index))
+    edge_starts, edge_ends = np.concatenate(edge_starts), np.concatenate(edge_ends)
+    edge_segments = np.concatenate(edge_segments)
+
+    # Only the points close to the middle of an edge can be close to the edge. Use a k-d tree to find them
+    edges = edge_ends - edge_starts
+    squared_lengths = np.sum(edges ** 2, axis=1)
+    radii = np.sqrt(squared_lengths) / 2 + MATCHING_DISTANCE
+    candidates = cKDTree(points).query_ball_point((edge_starts + edge_ends) / 2, radii)
+    pair_edges = np.repeat(np.arange(len(edges)), [len(c) for c in candidates])
+    pair_points = np.fromiter((i for c in candidates for i in c), dtype=int, count=len(pair_edges))
+
+    # Project the candidate points on their edges
+    squared_lengths[squared_lengths == 0] = 1.0
+    offsets = points[pair_points] - edge_starts[pair_edges]
+    t = np.clip(np.sum(offsets * edges[pair_edges], axis=1) / squared_lengths[pair_edges], 0.0, 1.0)
+    distances = np.linalg.norm(offsets - t[:, np.newaxis] * edges[pair_edges], axis=1)
+    matching = distances < MATCHING_DISTANCE
+
+    first_segments = np.full(len(points), len(segment_lines))
+    np.minimum.at(first_segments, pair_points[matching], edge_segments[pair_edges[matching]])
+
+    # Stable sort by segment keeps the original order of the points that match the same segment
+    trajectory_points = []
+    seen = set()
+    for i in np.argsort(first_segments, kind='stable'):
+        if first_segments[i] == len(segment_lines):
+            break
+        p = (interpolated_points[i][0], interpolated_points[i][1])
+        if p not in seen:
+            seen.add(p)
+            trajectory_points.append(p)
+    return trajectory_points
+
+
+def _match_points_to_segments_all_pairs(interpolated_points, segment_lines):
+    """
+    Same as _match_points_to_segments, but computes the distance of every point to every segment line
+    with Shapely one pair at the time. This is slow, so use it only as reference.
+    """
+    trajectory_points = []
+    for line in [LineString(coords) for coords in segment_lines]:
+        for p in interpolated_points:
+            point = Point(p[0], p[1])
+            if point.distance(line) < MATCHING_DISTANCE and p not in trajectory_points:
+                trajectory_points.append((p[0], p[1]))
+    return trajectory_points
+
+
+def generate_trajectories(initial_location, initial_rotation, batch, SAMPLING_UNIT = 5, analytic=True,
+                          processes=None):
+    """
+    Generates the trajectories of a batch of individuals, i.e., lists of driving actions like the ones taken by
+    generate_trajectory, all starting from the same location and rotation. Returns one (n, 2) array of trajectory
+    points for each individual.
+
+    With analytic=True (default), the whole batch is resampled at once with NumPy. With processes > 1, the batch
+    is split in chunks which are generated by a pool of processes.
+    """
+    if processes is not None and processes > 1 and len(batch) > 1:
+        chunk_size = -(-len(batch) // processes)
+        chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+        with Pool(processes) as pool:
+            results = pool.map(partial(generate_trajectories, initial_location, initial_rotation,
+                                       SAMPLING_UNIT=SAMPLING_UNIT, analytic=analytic), chunks)
+        return [trajectory for chunk in results for trajectory in chunk]
+
+    if not analytic:
+        return [np.array(generate_trajectory(initial_location, initial_rotation, driving_actions, SAMPLING_UNIT))
+                for driving_actions in batch]
+
+    batch_segments = [[s for driving_action in driving_actions for s in driving_action["trajectory_segments"]]
+                      for driving_actions in batch]
+    return _resample_batch(initial_location, initial_rotation, batch_segments, SAMPLING_UNIT)
+
+
+def _resample_segments(initial_location, initial_rotation, segments, sampling_unit):
+    """
+    Samples the trajectory at uniform arc-length distances using the closed-form geometry of straight and turn
+    segments. Like the spline interpolation, the spacing is the closest to sampling_unit that divides the
+    trajectory in equal parts, and there are at least common.min_num_nodes + 1 points.
+    """
+    points = _resample_batch(initial_location, initial_rotation, [segments], sampling_unit)[0]
+    return [tuple(p) for p in points.tolist()]
+
+
+def _resample_batch(initial_location, initial_rotation, batch_segments, sampling_unit):
+    """
+    Same as _resample_segments, but for many roads at once: the segments of all the roads are processed together
+    and each road is a contiguous range of them. Returns a (n, 2) array for each road.
+    """
+    # Segments of unknown type are ignored
+    batch_segments = [[s for s in segments if s["type"] in ('straight', 'turn')] for segments in batch_segments]
+    counts = np.array([len(segments) for segments in batch_segments])
+    assert np.all(counts > 0), "Each road needs at least one segment"
+    segments = [s for road_segments in batch_segments for s in road_segments]
+    road_of_segment = np.repeat(np.arange(len(batch_segments)), counts)
+    first_segments = np.cumsum(counts) - counts
+    last_segments = np.cumsum(counts) - 1
+
+    def road_cumsum(values):
+        """The sum of the values of the previous segments of the same road."""
+        total = np.cumsum(values) - values
+        return total - total[first_segments][road_of_segment]
+
+    # Lengths and curvature directions of the segments. Positive angles turn left
+    is_turn = np.array([s["type"] == 'turn' for s in segments])
+    angles = np.radians([s["angle"] if s["type"] == 'turn' else 0.0 for s in segments])
+    radii = np.array([s["radius"] if s["type"] == 'turn' else 1.0 for s in segments], dtype=float)
+    lengths = np.where(is_turn, abs(angles) * radii,
+                       [s["length"] if s["type"] == 'straight' else 0.0 for s in segments])
+    turn_signs = np.sign(angles)
+
+    # The generated trajectory is rotated by 90 deg so that an initial rotation of 0 points NORTH
+    start_headings = radians(initial_rotation + 90.0) + road_cumsum(angles)
+    # Each segment starts where the previous ones end
+    end_x, end_y = _segment_point(is_turn, turn_signs, radii, start_headings, lengths)
+    start_x = initial_location.x + road_cumsum(end_x)
+    start_y = initial_location.y + road_cumsum(end_y)
+    segment_starts = road_cumsum(lengths)
+
+    # Uniform arc-length positions along each road
+    road_lengths = np.add.reduceat(lengths, first_segments)
+    num_nodes = np.maximum((road_lengths / sampling_unit).astype(int), common.min_num_nodes)
+    sample_counts = num_nodes + 1
+    road_of_sample = np.repeat(np.arange(len(batch_segments)), sample_counts)
+    sample_index = np.arange(sample_counts.sum()) - np.repeat(np.cumsum(sample_counts) - sample_counts, sample_counts)
+    distances = sample_index * (road_lengths / num_nodes)[road_of_sample]
+
+    # Find the segment of each sample. Roads are laid one after the other, so we can search all of them at once
+    road_offsets = np.cumsum(road_lengths) - road_lengths
+    indices = np.searchsorted(road_offsets[road_of_segment] + segment_starts,
+                              road_offsets[road_of_sample] + distances, side='right') - 1
+    indices = indices.clip(first_segments[road_of_sample], last_segments[road_of_sample])
+    local_distances = distances - segment_starts[indices]
+
+    x, y = _segment_point(is_turn[indices], turn_signs[indices], radii[indices], start_headings[indices],
+                          local_distances)
+    points = np.column_stack((start_x[indices] + x, start_y[indices] + y)).round(common.rounding_precision)
+    return np.split(points, np.cumsum(sample_counts)[:-1])
+
+
+def _segment_point(is_turn, turn_sign, radius, heading, distance):
+    """
+    Returns the offset from the beginning of a segment of the point at the given arc-length distance along it.
+    Works on scalars and on arrays.
+    """
+    # Straight segments advance along the heading, turns along the circle of the given radius. Turns with no
+    # radius have no length: they only change the heading
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = np.where(radius > 0, distance / radius, 0.0)
+    forward = np.where(is_turn, radius * np.sin(phi), distance)
+    lateral = np.where(is_turn, turn_sign * radius * (1.0 - np.cos(phi)), 0.0)
+    return (forward * np.cos(heading) - lateral * np.sin(heading),
+            forward * np.sin(heading) + lateral * np.cos(heading))
 
 
 def generate_left_marking(road_nodes):
@@ -123,5 +393,44 @@ def _generate_lane_marking(road_nodes, side):
     """
     road_spine = LineString([(rn[0],rn[1]) for rn in road_nodes])
     x, y = road_spine.parallel_offset(3.9, side, resolution=16, join_style=1, mitre_limit=5.0).coords.xy
-    interpolated_points = common.interpolate([(p[0], p[1]) for p in zip(x, y)], sampling_unit=10)
-    return [(p[0], p[1], 0, 0.1) for p in interpolated_points]
\ No newline at end of file
+    interpolated_points = common.interpolate([(p[0], p[1]) for p in zip(x, y)], sampling_unit=10, as_tuples=True)
+    return [(p[0], p[1], 0, 0.1) for p in interpolated_points]
+
+
+class SegmentLinesTest(unittest.TestCase):
+
+    SEGMENTS = [{'type': 'straight', 'length': 10}, {'type': 'straight', 'length': 0},
+                {'type': 'turn', 'angle': 0, 'radius': 20}, {'type': 'turn', 'angle': 170, 'radius': 15},
+                {'type': 'turn', 'angle': -120, 'radius': 30}, {'type': 'straight', 'length': 20}]
+
+    def test_segment_lines_match_the_shapely_ones(self):
+        points, _ = _generate_segment_lines(Point(0, 0), 0, self.SEGMENTS)
+        expected, _ = _generate_segment_lines_shapely(Point(0, 0), 0, self.SEGMENTS)
+
+        np.testing.assert_allclose(points, expected, atol=1e-9)
+
+    def test_segments_with_no_length_can_be_interpolated(self):
+        trajectory = generate_trajectory(Point(0, 0), 0, [{'trajectory_segments': [s]} for s in self.SEGMENTS])
+
+        self.assertGreater(len(trajectory), 0)
+
+    def test_turns_of_half_a_circle_or_more_are_rejected(self):
+        with self.assertRaises(ValueError):
+            _generate_segment_lines(Point(0, 0), 0, [{'type': 'turn', 'angle': -180, 'radius': 10}])
+
+    def test_turns_with_no_radius_only_change_the_heading(self):
+        segments = [{'type': 'straight', 'length': 10}, {'type': 'turn', 'angle': 90, 'radius': 0},
+                    {'type': 'straight', 'length': 10}]
+        driving_actions = [{'trajectory_segments': [s]} for s in segments]
+
+        points = np.array(generate_trajectory(Point(0, 0), 0, driving_actions, analytic=True))
+        expected = np.array(generate_trajectory(Point(0, 0), 0, driving_actions))
+
+        self.assertTrue(np.all(np.isfinite(points)))
+        np.testing.assert_allclose((-10.0, 10.0), points[-1])
+        self.assertEqual(expected.shape, points.shape)
+        np.testing.assert_allclose(expected, points, atol=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,58 +5,13 @@ from shapely.geometry import LineString, Polygon
 from shapely.affinity import translate, rotate
 from descartes import PolygonPatch
 from math import atan2, pi, degrees
-from scipy.interpolate import splev, splprep
-from numpy.ma import arange
 from beamngpy import Road
 from time import sleep
 
 from shapely.geometry import LineString, Point
+import common
 
 
-# Constants
-rounding_precision = 3
-interpolation_distance = 1
-smoothness = 0
-min_num_nodes = 20
-
-# Trajectory generation
-def _interpolate(nodes):
-    """
-        Interpolate the road points using cubic splines and ensure we handle 4F tuples for compatibility
-    """
-    old_x_vals = [t[0] for t in nodes]
-    old_y_vals = [t[1] for t in nodes]
-
-    # This is an approximation based on whatever input is given
-    test_road_lenght = LineString([(t[0], t[1]) for t in nodes]).length
-    num_nodes = int(test_road_lenght / interpolation_distance)
-    if num_nodes < min_num_nodes:
-        num_nodes = min_num_nodes
-
-    assert len(old_x_vals) >= 2, "You need at leas two road points to define a road"
-    assert len(old_y_vals) >= 2, "You need at leas two road points to define a road"
-
-    if len(old_x_vals) == 2:
-        # With two points the only option is a straight segment
-        k = 1
-    elif len(old_x_vals) == 3:
-        # With three points we use an arc, using linear interpolation will result in invalid road tests
-        k = 2
-    else:
-        # Otheriwse, use cubic splines
-        k = 3
-
-    pos_tck, pos_u = splprep([old_x_vals, old_y_vals], s= smoothness, k=k)
-
-    step_size = 1 / num_nodes
-    unew = arange(0, 1 + step_size, step_size)
-
-    new_x_vals, new_y_vals = splev(unew, pos_tck)
-
-    # Return the 4-tuple with default z and defatul road width
-    return list(zip([round(v, rounding_precision) for v in new_x_vals],
-                    [round(v, rounding_precision) for v in new_y_vals]))
-
 # https://stackoverflow.com/questions/1560492/how-to-tell-whether-a-point-is-to-the-right-or-left-side-of-a-line
 # Where a = line point 1; b = line point 2; c = point to check against.
 def isLeft(a, b, c):
@@ -111,8 +66,8 @@ class RoadVisualizer:
         # plt.gca().add_patch(map_patch)
 
         # Road Geometry.
-        interpolated_points = _interpolate(road.nodes)
-        road_spine = LineString([(t[0], t[1]) for t in interpolated_points])
+        interpolated_points = common.interpolate([(node[0], node[1]) for node in road.nodes])
+        road_spine = LineString(interpolated_points)
 
         # A buffer of 4 means 4.0 meter for each side !!
         road_poly = road_spine.buffer(4.0, cap_style=2, join_style=2)
@@ -120,9 +75,7 @@ class RoadVisualizer:
         plt.gca().add_patch(road_patch)
 
         # Interpolated Points
-        sx = [t[0] for t in interpolated_points]
-        sy = [t[1] for t in interpolated_points]
-        plt.plot(sx, sy, 'yellow')
+        plt.plot(interpolated_points[:, 0], interpolated_points[:, 1], 'yellow')
 
         right_points = road_spine.parallel_offset(3.9, "right", resolution=16, join_style=1, mitre_limit=5.0)
         x, y = right_points.coords.xy